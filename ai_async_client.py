@@ -0,0 +1,262 @@
+"""
+AI接口异步请求模块
+每个同步AI请求都要占用一个阻塞在 requests 上的线程，提高批改并发就要增加线程。
+异步客户端在一个独立的事件循环线程上发出全部请求（基于 aiohttp），
+数百个请求可以同时进行；每个请求有独立的超时，取消等待方时请求随之取消
+"""
+
+import asyncio
+import threading
+import logging
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+import circuit_breaker
+import rate_limiter
+from circuit_breaker import is_failure_status
+from rate_limiter import estimate_tokens, parse_retry_after, retry_delay, used_tokens
+from streaming import StreamReader
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+logger = logging.getLogger(__name__)
+
+# 默认同时进行的请求数上限
+DEFAULT_MAX_IN_FLIGHT = 256
+
+
+def is_available() -> bool:
+    """是否已安装 aiohttp"""
+    return aiohttp is not None
+
+
+class AsyncAIClient:
+    """运行在独立事件循环线程上的AI接口HTTP客户端（线程安全）
+
+    同步代码通过 call() 等待请求结果；异步代码通过 await run() 在任意事件循环中等待，
+    请求始终在客户端自己的事件循环上执行并共用同一个连接池。
+    """
+
+    def __init__(self, timeout: float = 30, max_retries: int = 3,
+                 max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+                 limiter: Optional[rate_limiter.ProviderRateLimiter] = None,
+                 breaker: Optional[circuit_breaker.CircuitBreaker] = None, max_tokens: int = 0):
+        """
+        Args:
+            timeout: 单次请求超时时间（秒）
+            max_retries: 最大尝试次数
+            max_in_flight: 同时进行的请求数上限（同时也是连接池大小）
+            limiter: 提供商共享的限流器（为空时不限流）
+            breaker: 熔断器，记录每次请求的结果，熔断后不再重试（为空时不熔断）
+            max_tokens: 每次请求的最大输出token数，用于估算token配额
+        """
+        if aiohttp is None:
+            raise RuntimeError('异步AI请求需要安装 aiohttp')
+        self.timeout = timeout
+        self.max_retries = max(1, int(max_retries))
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.limiter = limiter
+        self.breaker = breaker
+        self.max_tokens = max_tokens
+        self._loop = None
+        self._thread = None
+        self._session = None
+        self._slots = None
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.requests = 0
+        self.failed = 0
+        self.cancelled = 0
+
+    @property
+    def started(self) -> bool:
+        return self._thread is not None
+
+    def start(self):
+        """启动事件循环线程（重复调用无副作用）"""
+        with self._lock:
+            if self._thread:
+                return
+            ready = threading.Event()
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self._run_loop, args=(ready,),
+                                            name='ai-event-loop', daemon=True)
+            self._thread.start()
+        ready.wait()
+        logger.info(f"AI异步请求客户端已启动，同时请求数上限: {self.max_in_flight}")
+
+    def stop(self, timeout: Optional[float] = None):
+        """关闭连接池并停止事件循环线程"""
+        with self._lock:
+            thread, loop = self._thread, self._loop
+            self._thread = None
+        if thread is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._close(), loop).result(timeout)
+        except Exception as e:
+            logger.warning(f"关闭AI异步请求连接池失败: {str(e)}")
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout)
+
+    def _run_loop(self, ready: threading.Event):
+        asyncio.set_event_loop(self._loop)
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        ready.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            self._loop.close()
+
+    async def _close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _get_session(self):
+        # 只在事件循环线程中调用
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.max_in_flight)
+            self._session = aiohttp.ClientSession(
+                connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self._session
+
+    def submit(self, coro: Awaitable) -> Future:
+        """在事件循环线程上执行协程，返回 concurrent.futures.Future"""
+        if not self.started:
+            self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def call(self, coro: Awaitable, timeout: Optional[float] = None):
+        """
+        同步等待协程结果（供同步代码使用的桥接）
+
+        等待超时时取消协程并抛出 TimeoutError。
+        """
+        if self._loop is not None and threading.current_thread() is self._thread:
+            raise RuntimeError('不能在AI事件循环线程中同步等待请求')
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise
+
+    async def run(self, coro: Awaitable):
+        """在任意事件循环中等待协程结果（协程在客户端的事件循环上执行，取消等待方时一并取消）"""
+        if asyncio.get_running_loop() is self._loop:
+            return await coro
+        return await asyncio.wrap_future(self.submit(coro))
+
+    async def post_json(self, url: str, headers: Dict, data: Dict,
+                        make_reader: Optional[Callable[[], StreamReader]] = None) -> Tuple[bool, Dict]:
+        """
+        发送JSON请求，失败时按指数退避重试
+
+        Args:
+            make_reader: 流式请求时创建 StreamReader 的函数，所需字段完整后即关闭连接
+
+        Returns:
+            Tuple[bool, Dict]: (是否成功, 响应JSON或 {"error_message": ...})
+        """
+        async with self._slots:
+            self._track(1)
+            try:
+                return await self._post_with_retries(url, headers, data, make_reader)
+            except asyncio.CancelledError:
+                self.cancelled += 1
+                raise
+            finally:
+                self._track(-1)
+
+    def _track(self, delta: int):
+        self.in_flight += delta
+        if delta > 0:
+            self.requests += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    async def _post_with_retries(self, url: str, headers: Dict, data: Dict,
+                                 make_reader: Optional[Callable[[], StreamReader]]) -> Tuple[bool, Dict]:
+        session = self._get_session()
+        limiter = self.limiter
+        estimated = estimate_tokens(data, self.max_tokens)
+        for attempt in range(self.max_retries):
+            is_last = attempt == self.max_retries - 1
+            retry_after = None
+            outcome = rate_limiter.ERROR
+            permit = await limiter.acquire_async(estimated) if limiter is not None else None
+            try:
+                async with session.post(url, headers=headers, json=data) as response:
+                    self._record(not is_failure_status(response.status))
+                    if response.status == 200:
+                        if make_reader is not None and 'event-stream' in response.headers.get('Content-Type', ''):
+                            result = await self._read_stream(response, make_reader())
+                        else:
+                            result = await response.json(content_type=None)
+                        outcome = rate_limiter.OK
+                        if permit is not None:
+                            limiter.release(permit, outcome, tokens_used=used_tokens(result))
+                            permit = None
+                        return True, result
+                    if response.status == 429:
+                        outcome = rate_limiter.THROTTLED
+                        retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                    text = await response.text()
+                    logger.warning(f"API请求失败 (尝试 {attempt + 1}/{self.max_retries}): {response.status} - {text}")
+                    if is_last:
+                        self.failed += 1
+                        return False, {"error_message": f"API请求失败: {response.status} - {text}"}
+            except asyncio.TimeoutError:
+                self._record(False)
+                logger.warning(f"API请求超时 (尝试 {attempt + 1}/{self.max_retries})")
+                if is_last:
+                    self.failed += 1
+                    return False, {"error_message": "API请求超时"}
+            except aiohttp.ClientError as e:
+                self._record(False)
+                logger.warning(f"API请求异常 (尝试 {attempt + 1}/{self.max_retries}): {str(e)}")
+                if is_last:
+                    self.failed += 1
+                    return False, {"error_message": f"API请求异常: {str(e)}"}
+            finally:
+                if permit is not None:
+                    limiter.release(permit, outcome, retry_after)
+            if self.breaker is not None and self.breaker.state == circuit_breaker.OPEN:
+                self.failed += 1
+                return False, {"error_message": "AI服务暂时不可用（已熔断），转为人工批改", "circuit_open": True}
+            # 遵循 Retry-After，否则带抖动的指数退避
+            await asyncio.sleep(retry_delay(attempt, retry_after))
+        self.failed += 1
+        return False, {"error_message": "达到最大重试次数"}
+
+    async def _read_stream(self, response, reader: StreamReader) -> Dict:
+        """读取流式响应，所需字段完整后立即关闭连接"""
+        async for line in response.content:
+            if reader.feed_line(line.decode('utf-8')):
+                break
+        if not response.content.at_eof():
+            response.close()
+        return reader.response()
+
+    def _record(self, success: bool):
+        if self.breaker is None:
+            return
+        if success:
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure()
+
+    def stats(self) -> Dict:
+        return {
+            'started': self.started,
+            'max_in_flight': self.max_in_flight,
+            'in_flight': self.in_flight,
+            'peak_in_flight': self.peak_in_flight,
+            'requests': self.requests,
+            'failed': self.failed,
+            'cancelled': self.cancelled
+        }
@@ -3,17 +3,63 @@ AI批改服务模块
 提供简答题的AI自动批改功能
 """
 
+import asyncio
 import json
+import os
+import hashlib
 import requests
 import time
 import logging
-from typing import Dict, Optional, Tuple
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
 from config import AI_GRADING_CONFIG, AI_GRADING_PROMPTS
+from grading_cache import GradingResultCache, normalize_student_answer
+from fill_blank_matcher import FillBlankMatcher
+import circuit_breaker
+from circuit_breaker import CircuitBreaker, is_failure_status
+import rate_limiter
+from rate_limiter import estimate_tokens, get_rate_limiter, parse_retry_after, retry_delay, used_tokens
+from streaming import STREAM_FORMATS, StreamReader
+import ai_async_client
+from ai_async_client import AsyncAIClient
+import mock_ai_provider
+import health_monitor
+from health_monitor import HealthMonitor
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 代码内提示词（填空题提示词、结果解析规则）的版本，修改后递增使AI批改缓存失效
+PROMPT_TEMPLATE_VERSION = 2
+
+# 批量批改时每位学生的结果预计占用的输出token数，用于根据 max_tokens 确定每批的答案数
+BATCH_ITEM_TOKENS = 150
+
+# 流式响应中这些字段全部完整后即可结束读取（与提示词要求的输出顺序一致，之后的 analysis 等长字段不再等待）
+SHORT_ANSWER_STOP_FIELDS = ('score', 'feedback')
+FILL_BLANK_STOP_FIELDS = ('score', 'feedback', 'short_reason', 'order_required', 'correct_count', 'total_count')
+
+
+# 两阶段批改：提交时只评分（低 max_tokens），评语在查看成绩或空闲时按已评定的分数补充生成
+SCORE_ONLY_INSTRUCTION = '\n\n本次只需评分，不需要评语：请只返回 {"score": 分数(整数)}，不要输出其他内容。'
+FEEDBACK_INSTRUCTION = ('\n\n该答案已评定为{score}分（满分{max_score}分）。请按要求的JSON格式返回结果，'
+                        'score 填写{score}，feedback 中的评分理由须与该分数一致。')
+
+
+class ApiRequest(NamedTuple):
+    """批改步骤发出的一次AI请求"""
+    prompt: str
+    stop_fields: Tuple[str, ...] = ()  # 流式响应中这些字段完整后即可结束读取，为空时等待完整输出
+    max_tokens: Optional[int] = None  # 最大输出token数，为空时使用配置中的 max_tokens
+
+# AI批改结果缓存的默认路径
+DEFAULT_RESULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'ai_grading_cache.db')
+
 class AIGradingService:
     """AI批改服务类"""
     
@@ -21,6 +67,79 @@ class AIGradingService:
         self.config = AI_GRADING_CONFIG
         self.prompts = AI_GRADING_PROMPTS
         self.enabled, self.config_message = self._check_config()
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._http = None
+        self._http_lock = threading.Lock()
+        self._async_client = None
+        self._async_lock = threading.Lock()
+        self._async_disabled = False  # 配置了异步请求但未安装 aiohttp 时改用同步请求（不修改共享的配置）
+        self.rate_limiter = self._create_rate_limiter()
+        self.circuit_breaker = CircuitBreaker(
+            failure_threshold=self.config.get('circuit_failure_threshold', 5),
+            failure_ratio=self.config.get('circuit_failure_ratio', 0.5),
+            window=self.config.get('circuit_window', 20),
+            reset_timeout=self.config.get('circuit_reset_timeout', 30))
+        self.health_monitor = (HealthMonitor(
+            self.check_health,
+            interval=self.config.get('health_check_interval', 60),
+            window=self.config.get('health_check_window', 10),
+            failure_threshold=self.config.get('health_failure_threshold', 2),
+            slow_threshold=self.config.get('health_slow_ms', 5000) / 1000)
+            if self.enabled and self.config.get('health_check', True) else None)
+        self.result_cache = self._open_result_cache()
+        self.fill_blank_matcher = (FillBlankMatcher(self.config.get('fill_blank_edit_tolerance', 1))
+                                   if self.config.get('fill_blank_precheck', True) else None)
+        self._precheck_lock = threading.Lock()
+        self.precheck_stats = {'checked': 0, 'decided_locally': 0, 'escalated': 0,
+                               'blanks_local': 0, 'blanks_ai': 0}
+        self._batch_lock = threading.Lock()
+        self.batch_stats = {'batches': 0, 'answers': 0, 'fallbacks': 0}
+    
+    def _prompt_version(self) -> str:
+        """提示词版本：配置中的提示词模板和代码内提示词版本的哈希"""
+        payload = json.dumps([self.prompts, PROMPT_TEMPLATE_VERSION], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:12]
+    
+    def _open_result_cache(self) -> Optional[GradingResultCache]:
+        """打开AI批改结果缓存（未启用AI批改或缓存时返回 None）"""
+        if not self.enabled or not self.config.get('result_cache', True):
+            return None
+        try:
+            return GradingResultCache(
+                self.config.get('result_cache_path') or DEFAULT_RESULT_CACHE_PATH,
+                self._prompt_version(),
+                max_entries=self.config.get('result_cache_max_entries', 100000)
+            )
+        except Exception as e:
+            logger.warning(f"AI批改缓存打开失败，将不使用缓存: {str(e)}")
+            return None
+    
+    def _create_rate_limiter(self) -> rate_limiter.ProviderRateLimiter:
+        """获取当前提供商共享的限流器（异步请求时并发上限为 async_max_in_flight）"""
+        if self.config.get('async_requests', False) and ai_async_client.is_available():
+            ceiling = self.config.get('async_max_in_flight', ai_async_client.DEFAULT_MAX_IN_FLIGHT)
+        else:
+            ceiling = self.config.get('max_concurrency', 8)
+        return get_rate_limiter(
+            self.config.get('provider', 'openai').lower(),
+            requests_per_minute=self.config.get('rate_limit_rpm', 0),
+            tokens_per_minute=self.config.get('rate_limit_tpm', 0),
+            max_concurrency=ceiling,
+            min_concurrency=self.config.get('min_concurrency', 1),
+            adaptive=self.config.get('adaptive_concurrency', True))
+    
+    def get_circuit_stats(self) -> Dict:
+        """获取熔断器状态"""
+        return self.circuit_breaker.stats()
+    
+    def _circuit_open_error(self) -> Dict:
+        """熔断期间的失败结果：circuit_open 表示应直接转为人工批改，不再重试"""
+        return {"error_message": "AI服务暂时不可用（已熔断），转为人工批改", "circuit_open": True}
+    
+    def get_rate_limit_stats(self) -> Dict:
+        """获取限流器的当前并发上限、配额余量和等待中的请求数"""
+        return self.rate_limiter.stats()
     
     def _check_config(self) -> Tuple[bool, str]:
         """检查AI配置是否完整（仅检查配置项，不测试连接）"""
@@ -28,6 +147,10 @@ class AIGradingService:
         if not self.config.get('enabled', False):
             return False, "AI批改功能未启用"
         
+        # 模拟接口不需要密钥和模型
+        if self.config.get('provider', '').strip().lower() == 'mock':
+            return True, "配置正确（模拟AI接口）"
+        
         # 检查API密钥
         api_key = self.config.get('api_key', '').strip()
         if not api_key:
@@ -55,52 +178,74 @@ class AIGradingService:
         
         return True, "配置正确"
     
-    def test_connection(self) -> Tuple[bool, str]:
-        """测试API连接是否有效"""
+    def test_connection(self, timeout: float = 10) -> Tuple[bool, str]:
+        """测试API连接是否有效（同步等待响应，启动和请求处理中请读取 get_health_status 的结论）"""
         if not self.enabled:
             return False, self.config_message
+        status_code, message = self._probe_connection(timeout)
+        if status_code is None:
+            return False, message
+        if status_code == 200:
+            return True, "API连接测试成功"
+        elif status_code == 401:
+            return False, "API密钥无效或已过期"
+        elif status_code == 403:
+            return False, "API密钥无权限访问"
+        elif status_code == 429:
+            return False, "API请求频率超限"
+        else:
+            return False, f"API连接失败 (状态码: {status_code})"
+    
+    def check_health(self) -> Tuple[bool, str]:
+        """
+        健康检查的探测函数：接口有响应且不是服务端错误或密钥无效即为可用（429限流说明接口仍可用）
         
+        Returns:
+            Tuple[bool, str]: (是否可用, 说明)
+        """
+        if not self.enabled:
+            return False, self.config_message
+        status_code, message = self._probe_connection(self.config.get('health_check_timeout', 10))
+        if status_code is None:
+            return False, message
+        if status_code == 429:
+            return True, "API可用（请求频率超限）"
+        if is_failure_status(status_code):
+            return False, {401: "API密钥无效或已过期", 403: "API密钥无权限访问"}.get(
+                status_code, f"API服务异常 (状态码: {status_code})")
+        return True, "API连接正常"
+    
+    def _probe_connection(self, timeout: float) -> Tuple[Optional[int], str]:
+        """
+        向当前提供商发送一个极短的请求（使用共享连接池，不经过限流器和熔断器）
+        
+        Returns:
+            Tuple[Optional[int], str]: (HTTP状态码, 说明)；请求失败时状态码为 None
+        """
         try:
-            # 发送一个简单的测试请求
-            test_prompt = "请回复'OK'"
-            provider = self.config.get('provider', 'openai').lower()
-            
-            # 构建测试请求
-            if provider == 'openai':
-                url = self.config.get('base_url', 'https://api.openai.com/v1') + '/chat/completions'
-                headers = {
-                    'Authorization': f'Bearer {self.config["api_key"]}',
-                    'Content-Type': 'application/json'
-                }
-                data = {
-                    'model': self.config.get('model', 'gpt-3.5-turbo'),
-                    'messages': [{'role': 'user', 'content': test_prompt}],
-                    'max_tokens': 10
-                }
-            else:
-                # 其他提供商暂时跳过实际测试
-                return True, "配置正确（未测试连接）"
-            
-            # 发送请求，设置较短的超时时间
-            response = requests.post(url, headers=headers, json=data, timeout=10)
-            
-            if response.status_code == 200:
-                return True, "API连接测试成功"
-            elif response.status_code == 401:
-                return False, "API密钥无效或已过期"
-            elif response.status_code == 403:
-                return False, "API密钥无权限访问"
-            elif response.status_code == 429:
-                return False, "API请求频率超限"
-            else:
-                return False, f"API连接失败 (状态码: {response.status_code})"
-                
+            url, headers, data = self._build_request("请回复'OK'", 10)
+            response = self._get_http_session().post(url, headers=headers, json=data, timeout=timeout)
+            response.close()
+            return response.status_code, ''
         except requests.exceptions.Timeout:
-            return False, "API连接超时"
+            return None, "API连接超时"
         except requests.exceptions.ConnectionError:
-            return False, "无法连接到API服务器"
+            return None, "无法连接到API服务器"
         except Exception as e:
-            return False, f"连接测试失败: {str(e)}"
+            return None, f"连接测试失败: {str(e)}"
+    
+    def start_health_monitor(self) -> bool:
+        """启动后台健康检查（未启用AI批改或健康检查时不启动）"""
+        if self.health_monitor is None:
+            return False
+        self.health_monitor.start()
+        return True
+    
+    def get_health_status(self) -> Dict:
+        """获取最近一次健康检查的结论（不发送请求）；未启用健康检查时 verdict 为 unknown"""
+        if self.health_monitor is None:
+            return {'verdict': health_monitor.UNKNOWN, 'message': '未启用健康检查', 'running': False}
+        return self.health_monitor.status()
     
     def is_enabled(self) -> bool:
         """检查AI批改功能是否可用"""
@@ -111,7 +256,8 @@ class AIGradingService:
         return self.enabled, self.config_message
     
     def grade_answer(self, question: str, reference_answer: str, 
-                    student_answer: str, max_score: int, question_type: str = 'short_answer') -> Tuple[bool, Dict]:
+                    student_answer: str, max_score: int, question_type: str = 'short_answer',
+                    score_only: bool = False) -> Tuple[bool, Dict]:
         """
         批改学生答案
         
@@ -121,28 +267,506 @@ class AIGradingService:
             student_answer: 学生答案
             max_score: 题目满分
             question_type: 题目类型 ('short_answer' 或 'fill_blank')
+            score_only: 只评分不生成评语（两阶段批改的第一阶段），评语之后由 generate_feedback 补充
             
         Returns:
             Tuple[bool, Dict]: (是否成功, 结果字典)
-            结果字典包含: score, feedback, error_message
+            结果字典包含: score, feedback, error_message；只评分时 feedback 为空且 feedback_pending 为 True
         """
         if not self.enabled:
             return False, {"error_message": "AI批改功能未启用"}
-        
+        return self._drive(self._grade_answer_steps(
+            question, reference_answer, student_answer, max_score, question_type, score_only))
+    
+    async def grade_answer_async(self, question: str, reference_answer: str,
+                                 student_answer: str, max_score: int,
+                                 question_type: str = 'short_answer', score_only: bool = False) -> Tuple[bool, Dict]:
+        """批改学生答案（异步版本，参数和返回值与 grade_answer 相同）"""
+        if not self.enabled:
+            return False, {"error_message": "AI批改功能未启用"}
+        return await self._drive_async(self._grade_answer_steps(
+            question, reference_answer, student_answer, max_score, question_type, score_only))
+    
+    def _grade_answer_steps(self, question: str, reference_answer: str, student_answer: str,
+                            max_score: int, question_type: str, score_only: bool = False):
+        """批改步骤（生成器，每次 yield 一个 ApiRequest 并接收API请求结果，见 _drive）"""
         try:
+            # 相同题目的相同答案直接使用缓存的批改结果
+            cached, cache_key = self._cache_lookup(question, reference_answer, student_answer,
+                                                   max_score, question_type, score_only)
+            if cached is not None:
+                return True, cached
+            
             # 根据题目类型选择不同的批改策略
             if question_type == 'fill_blank':
-                return self._grade_fill_blank(question, reference_answer, student_answer, max_score)
+                success, result = yield from self._grade_fill_blank(
+                    question, reference_answer, student_answer, max_score, score_only)
             else:
-                return self._grade_short_answer(question, reference_answer, student_answer, max_score)
+                success, result = yield from self._grade_short_answer(
+                    question, reference_answer, student_answer, max_score, score_only=score_only)
+            
+            if success and cache_key is not None:
+                self.result_cache.put(cache_key, result)
+            return success, result
             
         except Exception as e:
             logger.error(f"AI批改过程中发生错误: {str(e)}")
             return False, {"error_message": f"批改失败: {str(e)}"}
     
+    def _drive(self, steps):
+        """
+        同步执行批改步骤
+        
+        批改流程写成生成器：需要调用AI时 yield ApiRequest，并接收 (是否成功, 响应) 继续执行，
+        同一套流程既可以由 _drive 同步执行，也可以由 _drive_async 在事件循环中执行。
+        """
+        response, error = None, None
+        while True:
+            try:
+                request = steps.throw(error) if error else steps.send(response)
+            except StopIteration as stop:
+                return stop.value
+            try:
+                response, error = self._make_api_request(*request), None
+            except Exception as e:
+                response, error = None, e
+    
+    async def _drive_async(self, steps):
+        """在事件循环中执行批改步骤（见 _drive）"""
+        response, error = None, None
+        while True:
+            try:
+                request = steps.throw(error) if error else steps.send(response)
+            except StopIteration as stop:
+                return stop.value
+            try:
+                response, error = await self._make_api_request_async(*request), None
+            except Exception as e:
+                response, error = None, e
+    
+    def generate_feedback(self, question: str, reference_answer: str, student_answer: str,
+                          max_score: int, score: int, question_type: str = 'short_answer') -> Tuple[bool, Dict]:
+        """
+        为已评分的答案生成评语（两阶段批改的第二阶段）
+        
+        Args:
+            score: 第一阶段评定的分数，评语按该分数给出，返回结果中的 score 保持不变
+            其余参数同 grade_answer
+        
+        Returns:
+            Tuple[bool, Dict]: (是否成功, 结果字典)，结果字典包含 score 和 feedback，填空题可能包含 short_reason
+        """
+        if not self.enabled:
+            return False, {"error_message": "AI批改功能未启用"}
+        return self._drive(self._feedback_steps(
+            question, reference_answer, student_answer, max_score, score, question_type))
+    
+    def generate_feedback_many(self, items: List[Dict]) -> List[Tuple[bool, Dict]]:
+        """
+        并发生成多道题目的评语
+        
+        Args:
+            items: generate_feedback 的关键字参数字典列表
+        
+        Returns:
+            List[Tuple[bool, Dict]]: 与 items 顺序一致的结果
+        """
+        if not items:
+            return []
+        if not self.enabled:
+            return [(False, {"error_message": "AI批改功能未启用"})] * len(items)
+        client = self._get_async_client()
+        if client is not None:
+            async def generate_all():
+                return await asyncio.gather(*(self._drive_async(self._feedback_steps(**item)) for item in items))
+            return client.call(generate_all())
+        executor = self._get_executor()
+        futures = [executor.submit(self.generate_feedback, **item) for item in items]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                logger.error(f"AI评语生成过程中发生错误: {str(e)}")
+                results.append((False, {"error_message": f"评语生成失败: {str(e)}"}))
+        return results
+    
+    def _feedback_steps(self, question: str, reference_answer: str, student_answer: str,
+                        max_score: int, score: int, question_type: str = 'short_answer'):
+        """评语生成步骤（生成器，见 _drive）"""
+        try:
+            cached, cache_key = self._cache_lookup(question, reference_answer, student_answer,
+                                                   max_score, question_type)
+            if cached is not None and cached.get('score') == score:
+                return True, cached
+            
+            if question_type == 'fill_blank':
+                success, result = yield from self._grade_fill_blank_with_ai(
+                    question, reference_answer, student_answer, max_score, awarded_score=score)
+            else:
+                success, result = yield from self._grade_short_answer(
+                    question, reference_answer, student_answer, max_score, awarded_score=score)
+            if not success:
+                return False, result
+            result['score'] = score
+            if cache_key is not None:
+                self.result_cache.put(cache_key, result)
+            return True, result
+        
+        except Exception as e:
+            logger.error(f"AI评语生成过程中发生错误: {str(e)}")
+            return False, {"error_message": f"评语生成失败: {str(e)}"}
+    
+    def _cache_lookup(self, question: str, reference_answer: str, student_answer: str, max_score: int,
+                      question_type: str, score_only: bool = False) -> Tuple[Optional[Dict], Optional[str]]:
+        """
+        查找缓存的批改结果
+        
+        Returns:
+            (缓存的结果, 保存本次结果使用的缓存键)；未启用缓存时均为 None。
+            只评分时带评语的完整结果同样可用，未命中时本次结果保存在单独的缓存键下
+        """
+        full_key = self._result_cache_key(question, reference_answer, student_answer, max_score, question_type)
+        if full_key is None:
+            return None, None
+        cached = self.result_cache.get(full_key)
+        if cached is not None or not score_only:
+            return cached, full_key
+        key = self._result_cache_key(question, reference_answer, student_answer, max_score,
+                                     f'{question_type}:score_only')
+        return self.result_cache.get(key), key
+    
+    def _result_cache_key(self, question: str, reference_answer: str, student_answer: str,
+                          max_score: int, question_type: str) -> Optional[str]:
+        """计算AI批改结果的缓存键（未启用缓存时返回 None）"""
+        if self.result_cache is None:
+            return None
+        return self.result_cache.make_key(
+            question, reference_answer, student_answer, max_score, question_type,
+            self.config.get('provider', 'openai').lower(), self.config.get('model', ''),
+            self.config.get('temperature', 0.3))
+    
+    def grade_many(self, items: List[Dict]) -> List[Tuple[bool, Dict]]:
+        """
+        并发批改多道题目
+        
+        同一道简答题的多份答案（如全班对同一题的作答）合并为批量请求，
+        其余题目逐题并发批改。
+        
+        Args:
+            items: 批改参数列表，每项为 grade_answer 的关键字参数字典
+                   (question, reference_answer, student_answer, max_score, question_type)
+            
+        Returns:
+            List[Tuple[bool, Dict]]: 与 items 顺序一致的批改结果
+        """
+        if not items:
+            return []
+        if self._get_async_client() is not None:
+            # 全部请求在事件循环线程上并发发出，不再占用批改线程池
+            return self._get_async_client().call(self.grade_many_async(items))
+        if len(items) == 1:
+            return [self.grade_answer(**items[0])]
+        
+        singles, groups = self._group_items(items)
+        
+        # 使用共享线程池，所有调用方合计的并发请求数不超过 max_concurrency
+        executor = self._get_executor()
+        tasks = [([index], executor.submit(self._grade_one, items[index])) for index in singles]
+        for (question, reference_answer, max_score, score_only), indexes in groups.items():
+            for chunk in self._batch_chunks(indexes):
+                answers = [items[index]['student_answer'] for index in chunk]
+                tasks.append((chunk, executor.submit(self.grade_batch, question, reference_answer,
+                                                     answers, max_score, score_only)))
+        
+        results = [None] * len(items)
+        for indexes, future in tasks:
+            try:
+                outcome = future.result()
+            except Exception as e:
+                logger.error(f"AI并发批改过程中发生错误: {str(e)}")
+                outcome = [(False, {"error_message": f"批改失败: {str(e)}"})] * len(indexes)
+            for index, result in zip(indexes, outcome):
+                results[index] = result
+        return results
+    
+    async def grade_many_async(self, items: List[Dict]) -> List[Tuple[bool, Dict]]:
+        """
+        并发批改多道题目（异步版本，参数和返回值与 grade_many 相同）
+        
+        所有题目和批量请求在当前事件循环中同时进行，取消时未完成的请求一并取消。
+        """
+        if not items:
+            return []
+        singles, groups = self._group_items(items)
+        tasks = [([index], self._grade_one_async(items[index])) for index in singles]
+        for (question, reference_answer, max_score, score_only), indexes in groups.items():
+            for chunk in self._batch_chunks(indexes):
+                answers = [items[index]['student_answer'] for index in chunk]
+                tasks.append((chunk, self.grade_batch_async(question, reference_answer, answers,
+                                                            max_score, score_only)))
+        
+        outcomes = await asyncio.gather(*(coro for _, coro in tasks), return_exceptions=True)
+        results = [None] * len(items)
+        for (indexes, _), outcome in zip(tasks, outcomes):
+            if isinstance(outcome, Exception):
+                logger.error(f"AI并发批改过程中发生错误: {str(outcome)}")
+                outcome = [(False, {"error_message": f"批改失败: {str(outcome)}"})] * len(indexes)
+            for index, result in zip(indexes, outcome):
+                results[index] = result
+        return results
+    
+    def _group_items(self, items: List[Dict]) -> Tuple[List[int], Dict[Tuple, List[int]]]:
+        """
+        把同一道简答题的多份答案分为一组
+        
+        Returns:
+            (逐题批改的序号列表, {(题目, 参考答案, 分值, 是否只评分): 合并批改的序号列表})
+        """
+        groups = OrderedDict()
+        singles = []
+        if self.batch_size() > 1:
+            for index, item in enumerate(items):
+                if item.get('question_type', 'short_answer') == 'short_answer':
+                    key = (item['question'], item['reference_answer'], item['max_score'],
+                           item.get('score_only', False))
+                    groups.setdefault(key, []).append(index)
+                else:
+                    singles.append(index)
+            for key in [key for key, indexes in groups.items() if len(indexes) < 2]:
+                singles.extend(groups.pop(key))
+        else:
+            singles = list(range(len(items)))
+        return singles, groups
+    
+    def _grade_one(self, item: Dict) -> List[Tuple[bool, Dict]]:
+        return [self.grade_answer(**item)]
+    
+    async def _grade_one_async(self, item: Dict) -> List[Tuple[bool, Dict]]:
+        return [await self.grade_answer_async(**item)]
+    
+    def batch_size(self) -> int:
+        """每个批量请求最多包含的答案数：由 max_tokens 可容纳的结果数和 batch_max_size 共同决定"""
+        if not self.config.get('batch_grading', True):
+            return 1
+        by_tokens = int(self.config.get('max_tokens', 1000)) // BATCH_ITEM_TOKENS
+        return max(1, min(by_tokens, int(self.config.get('batch_max_size', 10))))
+    
+    def _batch_chunks(self, indexes: List[int]) -> List[List[int]]:
+        """把同一道题的答案平均分成若干批，避免最后一批只有一两份答案"""
+        size = self.batch_size()
+        chunk_count = -(-len(indexes) // size)
+        return [indexes[i::chunk_count] for i in range(chunk_count)]
+    
+    def grade_batch(self, question: str, reference_answer: str, student_answers: List[str],
+                    max_score: int, score_only: bool = False) -> List[Tuple[bool, Dict]]:
+        """
+        在一次请求中批改同一道简答题的多份答案
+        
+        命中缓存的答案不再发送，相同的答案只批改一次；
+        AI返回结果中缺失或无法解析的答案回退为逐份批改。
+        
+        Args:
+            question: 题目内容
+            reference_answer: 参考答案
+            student_answers: 学生答案列表（数量不超过 batch_size()）
+            max_score: 题目满分
+            score_only: 只评分不生成评语（见 grade_answer）
+            
+        Returns:
+            List[Tuple[bool, Dict]]: 与 student_answers 顺序一致的批改结果
+        """
+        if not self.enabled:
+            return [(False, {"error_message": "AI批改功能未启用"})] * len(student_answers)
+        return self._drive(self._grade_batch_steps(question, reference_answer, student_answers,
+                                                   max_score, score_only))
+    
+    async def grade_batch_async(self, question: str, reference_answer: str, student_answers: List[str],
+                                max_score: int, score_only: bool = False) -> List[Tuple[bool, Dict]]:
+        """批量批改同一道简答题的多份答案（异步版本，见 grade_batch）"""
+        if not self.enabled:
+            return [(False, {"error_message": "AI批改功能未启用"})] * len(student_answers)
+        return await self._drive_async(
+            self._grade_batch_steps(question, reference_answer, student_answers, max_score, score_only))
+    
+    def _grade_batch_steps(self, question: str, reference_answer: str, student_answers: List[str],
+                           max_score: int, score_only: bool = False):
+        """批量批改步骤（生成器，见 _drive）"""
+        results = [None] * len(student_answers)
+        cache_keys = {}
+        unique = OrderedDict()  # {标准化后的答案: [答案序号]}
+        for index, answer in enumerate(student_answers):
+            cached, cache_key = self._cache_lookup(question, reference_answer, answer, max_score,
+                                                   'short_answer', score_only)
+            if cached is not None:
+                results[index] = (True, cached)
+                continue
+            if cache_key is not None:
+                cache_keys[index] = cache_key
+            unique.setdefault(normalize_student_answer(answer), []).append(index)
+        
+        groups = list(unique.values())
+        graded = {}
+        if len(groups) > 1:
+            try:
+                graded = yield from self._grade_short_answer_batch(
+                    question, reference_answer, [student_answers[indexes[0]] for indexes in groups],
+                    max_score, score_only)
+            except Exception as e:
+                logger.error(f"AI批量批改过程中发生错误: {str(e)}")
+        
+        fallbacks = 0
+        for number, indexes in enumerate(groups, 1):
+            if number in graded:
+                outcome = (True, graded[number])
+                for index in indexes:
+                    if index in cache_keys:
+                        self.result_cache.put(cache_keys[index], graded[number])
+            else:
+                if len(groups) > 1:
+                    fallbacks += 1
+                outcome = yield from self._grade_answer_steps(
+                    question, reference_answer, student_answers[indexes[0]], max_score, 'short_answer', score_only)
+            for index in indexes:
+                results[index] = outcome
+        
+        with self._batch_lock:
+            if graded:
+                self.batch_stats['batches'] += 1
+                self.batch_stats['answers'] += len(graded)
+            self.batch_stats['fallbacks'] += fallbacks
+        return results
+    
+    def get_batch_stats(self) -> Dict:
+        """获取批量批改统计"""
+        with self._batch_lock:
+            stats = dict(self.batch_stats)
+        stats['batch_size'] = self.batch_size()
+        # 批量请求每次代替多次单独请求
+        stats['requests_saved'] = max(0, stats['answers'] - stats['batches'])
+        return stats
+    
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """获取批改请求共享线程池（延迟创建）"""
+        with self._executor_lock:
+            if self._executor is None:
+                max_workers = max(1, int(self.config.get('max_concurrency', 8)))
+                self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ai-grading')
+            return self._executor
+    
+    def _get_http_session(self) -> requests.Session:
+        """
+        获取共享的HTTP会话（延迟创建）
+        
+        会话的连接池按 max_concurrency 设置大小，各线程复用与API服务器的长连接，
+        避免每次批改都重新进行TCP和TLS握手。重试由 _send_request 负责，连接池本身不重试。
+        """
+        with self._http_lock:
+            if self._http is None:
+                pool_size = max(1, int(self.config.get('max_concurrency', 8)))
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+                session = requests.Session()
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                self._http = session
+            return self._http
+    
+    def _api_origin(self) -> Optional[str]:
+        """获取当前提供商API服务器的地址（scheme://host:port），用于预热连接"""
+        provider = self.config.get('provider', 'openai').lower()
+        default_urls = {
+            'openai': 'https://api.openai.com/v1',
+            'anthropic': 'https://api.anthropic.com/v1',
+            'qianfan': 'https://aip.baidubce.com',
+            'tongyi': 'https://dashscope.aliyuncs.com',
+        }
+        if provider == 'mock':
+            url = self._mock_base_url()
+        else:
+            url = self.config.get('base_url') or default_urls.get(provider)
+        if not url:
+            return None
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}" if parts.scheme and parts.netloc else None
+    
+    def warm_up(self, connections: Optional[int] = None) -> int:
+        """
+        预先建立与API服务器的连接（考试开始前调用，首批批改请求无需等待握手）
+        
+        Args:
+            connections: 建立的连接数，默认为配置中的 warm_up_connections
+        
+        Returns:
+            int: 成功建立的连接数
+        """
+        if connections is None:
+            connections = self.config.get('warm_up_connections', 0)
+        origin = self._api_origin()
+        if not self.enabled or not origin or connections <= 0:
+            return 0
+        session = self._get_http_session()
+        timeout = self.config.get('timeout', 30)
+        barrier = threading.Barrier(connections)
+        
+        def open_connection():
+            # 所有线程同时发出请求，迫使连接池建立多个连接而不是复用同一个
+            try:
+                barrier.wait(timeout)
+            except threading.BrokenBarrierError:
+                pass
+            # 只需建立连接，响应状态码（通常为404）无关紧要
+            session.head(origin, timeout=timeout).close()
+        
+        with ThreadPoolExecutor(max_workers=connections, thread_name_prefix='ai-warm-up') as executor:
+            futures = [executor.submit(open_connection) for _ in range(connections)]
+        opened = 0
+        for future in futures:
+            try:
+                future.result()
+                opened += 1
+            except Exception as e:
+                logger.warning(f"预热AI接口连接失败: {str(e)}")
+        logger.info(f"已预热 {opened} 个AI接口连接")
+        return opened
+    
+    def get_connection_stats(self) -> Dict:
+        """
+        获取连接复用统计
+        
+        Returns:
+            dict: requests 为已发送的请求数，connections 为新建的连接数，
+                reused 为复用已有连接的请求数
+        """
+        stats = {'requests': 0, 'connections': 0, 'reused': 0, 'pool_maxsize': 0}
+        with self._http_lock:
+            session = self._http
+        if session is None:
+            return stats
+        stats['pool_maxsize'] = max(1, int(self.config.get('max_concurrency', 8)))
+        pools = session.get_adapter('https://').poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            stats['requests'] += pool.num_requests
+            stats['connections'] += pool.num_connections
+        stats['reused'] = max(0, stats['requests'] - stats['connections'])
+        return stats
+    
+    def get_result_cache_stats(self) -> Optional[Dict]:
+        """获取AI批改结果缓存的命中统计（未启用缓存时返回 None）"""
+        return self.result_cache.stats() if self.result_cache is not None else None
+    
     def _grade_short_answer(self, question: str, reference_answer: str, 
-                           student_answer: str, max_score: int) -> Tuple[bool, Dict]:
-        """批改简答题"""
+                           student_answer: str, max_score: int, score_only: bool = False,
+                           awarded_score: Optional[int] = None):
+        """
+        批改简答题（批改步骤生成器，见 _drive）
+        
+        Args:
+            score_only: 只评分，使用较小的 max_tokens
+            awarded_score: 已评定的分数，只需生成与之一致的评语
+        """
         # 构建请求消息
         user_prompt = self.prompts['user_prompt_template'].format(
             question=question,
@@ -152,17 +776,177 @@ class AIGradingService:
         )
         
         # 根据不同的API提供商构建请求
-        success, result = self._make_api_request(user_prompt)
+        success, result = yield self._leaf_request(user_prompt, SHORT_ANSWER_STOP_FIELDS, max_score,
+                                                   score_only, awarded_score)
         
         if not success:
             return False, result
         
         # 解析AI返回的结果
-        return self._parse_ai_response(result, max_score)
+        success, result = self._parse_ai_response(result, max_score)
+        if success and score_only:
+            result = self._score_only_result(result)
+        return success, result
+    
+    def _leaf_request(self, prompt: str, stop_fields: Tuple[str, ...], max_score: int,
+                      score_only: bool = False, awarded_score: Optional[int] = None) -> ApiRequest:
+        """构建单题批改请求：只评分时只要求返回分数，补充评语时告知已评定的分数"""
+        if score_only:
+            return ApiRequest(prompt + SCORE_ONLY_INSTRUCTION, ('score',), self.score_only_max_tokens())
+        if awarded_score is not None:
+            prompt += FEEDBACK_INSTRUCTION.format(score=awarded_score, max_score=max_score)
+        return ApiRequest(prompt, stop_fields)
+    
+    def score_only_max_tokens(self) -> int:
+        """只评分请求的最大输出token数"""
+        return int(self.config.get('score_only_max_tokens', 50))
+    
+    def _score_only_result(self, result: Dict) -> Dict:
+        """只评分的结果：丢弃模型可能附带的评语，标记评语待生成"""
+        return {'score': result['score'], 'feedback': '', 'feedback_pending': True}
+    
+    def _grade_short_answer_batch(self, question: str, reference_answer: str,
+                                  student_answers: List[str], max_score: int, score_only: bool = False):
+        """
+        发送一次批量批改请求（批改步骤生成器，见 _drive）
+        
+        Returns:
+            Dict[int, Dict]: {学生编号(从1开始): 批改结果}，只包含通过校验的结果
+        """
+        answers_text = '\n\n'.join(f"【学生{number}】\n{answer}"
+                                    for number, answer in enumerate(student_answers, 1))
+        # 只评分时不要求评语
+        feedback_format = '' if score_only else ', "feedback": "AI评语：[评分理由] 改进建议：[具体建议]"'
+        user_prompt = f"""题目：{question}
+
+参考答案：{reference_answer or "无参考答案"}
+
+题目分值：{max_score}分
+
+以下是{len(student_answers)}位学生对同一道题的答案，请按评分要求分别独立评分，不要相互比较：
+
+{answers_text}
+
+请以JSON数组格式返回全部{len(student_answers)}位学生的结果，每位学生一项:
+[
+    {{"id": 学生编号(整数), "score": 分数(整数，0-{max_score}){feedback_format}}}
+]"""
+        if score_only:
+            request = ApiRequest(user_prompt, max_tokens=self.score_only_max_tokens() * len(student_answers))
+        else:
+            request = ApiRequest(user_prompt)
+        success, response = yield request
+        if not success:
+            logger.warning(f"AI批量批改请求失败，改为逐份批改: {response.get('error_message')}")
+            return {}
+        graded = self._parse_batch_response(response, len(student_answers), max_score)
+        if score_only:
+            graded = {number: self._score_only_result(result) for number, result in graded.items()}
+        return graded
+    
+    def _parse_batch_response(self, response: Dict, count: int, max_score: int) -> Dict[int, Dict]:
+        """解析批量批改返回的JSON数组，丢弃编号越界、重复或分数无效的项"""
+        content = self._extract_content(response)
+        if not content or '[' not in content or ']' not in content:
+            logger.warning("AI批量批改未返回JSON数组")
+            return {}
+        try:
+            items = json.loads(content[content.find('['):content.rfind(']') + 1])
+        except json.JSONDecodeError:
+            logger.warning("无法解析AI批量批改返回的JSON数组")
+            return {}
+        
+        graded = {}
+        for item in items if isinstance(items, list) else []:
+            if not isinstance(item, dict):
+                continue
+            try:
+                number = int(item.get('id'))
+                score = int(item.get('score'))
+            except (TypeError, ValueError):
+                continue
+            if number < 1 or number > count or number in graded:
+                continue
+            feedback = str(item.get('feedback') or '').strip()
+            if not feedback:
+                feedback = "AI评语：答案已评分，请参考参考答案进行对比学习。"
+            graded[number] = {
+                'score': max(0, min(score, max_score)),
+                'feedback': feedback
+            }
+        return graded
+    
+    def _record_precheck(self, decided: bool, blanks_local: int, blanks_ai: int):
+        with self._precheck_lock:
+            self.precheck_stats['checked'] += 1
+            self.precheck_stats['decided_locally' if decided else 'escalated'] += 1
+            self.precheck_stats['blanks_local'] += blanks_local
+            self.precheck_stats['blanks_ai'] += blanks_ai
+    
+    def get_precheck_stats(self) -> Dict:
+        """获取填空题本地预批改统计，api_calls_avoided 为本地直接判定、未调用AI接口的次数"""
+        with self._precheck_lock:
+            stats = dict(self.precheck_stats)
+        stats['api_calls_avoided'] = stats['decided_locally']
+        return stats
     
     def _grade_fill_blank(self, question: str, reference_answer: str, 
-                         student_answer: str, max_score: int) -> Tuple[bool, Dict]:
-        """批改填空题"""
+                         student_answer: str, max_score: int, score_only: bool = False):
+        """
+        批改填空题（批改步骤生成器，见 _drive）
+        
+        先在本地逐空比对（标准化、同义答案、顺序不限、轻微拼写差异），
+        全部填空都能判定时直接给分；否则只把无法判定的填空交给AI批改。
+        """
+        match = (self.fill_blank_matcher.match(question, reference_answer, student_answer)
+                 if self.fill_blank_matcher else None)
+        if match is None:
+            return (yield from self._grade_fill_blank_with_ai(question, reference_answer, student_answer, max_score,
+                                                              score_only=score_only))
+        
+        # 与自动评分一致：每空平均分配分数，按答对的空数给分
+        score_per_blank = round(max_score / match.total, 1)
+        
+        if match.decided:
+            self._record_precheck(True, match.total, 0)
+            score = min(round(score_per_blank * match.correct), max_score)
+            wrong = match.total - match.correct
+            feedback = f"自动评语：共{match.total}个填空，正确{match.correct}个"
+            feedback += f"，错误或缺失{wrong}个。请对照参考答案复习。" if wrong else "，全部正确。"
+            return True, {
+                'score': score,
+                'feedback': feedback,
+                'short_reason': '答案不准确或缺失' if wrong else '',
+                'order_required': not match.order_free,
+                'correct_count': match.correct,
+                'total_count': match.total
+            }
+        
+        # 只把无法判定的填空交给AI，每空按1分评分
+        self._record_precheck(False, match.total - len(match.undecided), len(match.undecided))
+        success, result = yield from self._grade_fill_blank_with_ai(
+            question, '、'.join(match.undecided_references), '、'.join(match.undecided_answers),
+            len(match.undecided), score_only=score_only)
+        if not success:
+            return False, result
+        ai_correct = max(0, min(int(result.get('score', 0)), len(match.undecided)))
+        correct = match.correct + ai_correct
+        score = min(round(score_per_blank * correct), max_score)
+        if score_only:
+            return True, self._score_only_result({'score': score})
+        result.update({
+            'score': score,
+            'feedback': f"{result.get('feedback', '')}（共{match.total}个填空，"
+                        f"{match.total - len(match.undecided)}个由本地比对判定，正确{correct}个）",
+            'correct_count': correct,
+            'total_count': match.total
+        })
+        return True, result
+    
+    def _grade_fill_blank_with_ai(self, question: str, reference_answer: str, 
+                                  student_answer: str, max_score: int, score_only: bool = False,
+                                  awarded_score: Optional[int] = None):
+        """调用AI批改填空题（批改步骤生成器，见 _drive；score_only 和 awarded_score 同 _grade_short_answer）"""
         # 预处理答案，统一分隔符
         def normalize_answers(text):
             """标准化答案格式"""
@@ -229,33 +1013,122 @@ class AIGradingService:
 }}"""
 
         # 发送API请求
-        success, result = self._make_api_request(fill_blank_prompt)
+        success, result = yield self._leaf_request(fill_blank_prompt, FILL_BLANK_STOP_FIELDS, max_score,
+                                                   score_only, awarded_score)
         
         if not success:
             return False, result
         
         # 解析AI返回的结果
-        return self._parse_ai_response(result, max_score)
+        success, result = self._parse_ai_response(result, max_score)
+        if success and score_only:
+            result = self._score_only_result(result)
+        return success, result
+    
+    def _make_api_request(self, user_prompt: str, stop_fields: Tuple[str, ...] = (),
+                          max_tokens: Optional[int] = None) -> Tuple[bool, Dict]:
+        """
+        发送API请求（启用异步请求时由事件循环线程发送，当前线程只等待结果）
+        
+        Args:
+            user_prompt: 提示词
+            stop_fields: 使用流式响应时，这些字段完整后即结束读取
+            max_tokens: 最大输出token数，为空时使用配置中的 max_tokens
+        """
+        try:
+            url, headers, data = self._build_request(user_prompt, max_tokens)
+        except ValueError as e:
+            return False, {"error_message": str(e)}
+        if not self.circuit_breaker.allow():
+            return False, self._circuit_open_error()
+        make_reader = self._stream_reader_factory(stop_fields)
+        if make_reader is not None:
+            data = dict(data, stream=True)
+        
+        client = self._get_async_client()
+        if client is not None:
+            return client.call(client.post_json(url, headers, data, make_reader))
+        return self._send_request(url, headers, data, make_reader)
+    
+    async def _make_api_request_async(self, user_prompt: str, stop_fields: Tuple[str, ...] = (),
+                                      max_tokens: Optional[int] = None) -> Tuple[bool, Dict]:
+        """发送API请求（异步版本；未启用异步请求时在线程中发送同步请求）"""
+        try:
+            url, headers, data = self._build_request(user_prompt, max_tokens)
+        except ValueError as e:
+            return False, {"error_message": str(e)}
+        if not self.circuit_breaker.allow():
+            return False, self._circuit_open_error()
+        make_reader = self._stream_reader_factory(stop_fields)
+        if make_reader is not None:
+            data = dict(data, stream=True)
+        
+        client = self._get_async_client()
+        if client is None:
+            return await asyncio.to_thread(self._send_request, url, headers, data, make_reader)
+        return await client.run(client.post_json(url, headers, data, make_reader))
+    
+    def _stream_reader_factory(self, stop_fields: Tuple[str, ...]) -> Optional[Callable[[], StreamReader]]:
+        """需要使用流式响应时返回创建 StreamReader 的函数，否则返回 None"""
+        provider = self._wire_format()
+        if not stop_fields or not self.config.get('stream_responses', True) or provider not in STREAM_FORMATS:
+            return None
+        return lambda: StreamReader(provider, stop_fields)
+    
+    def _get_async_client(self) -> Optional[AsyncAIClient]:
+        """获取异步请求客户端（延迟创建；未启用异步请求或未安装 aiohttp 时返回 None）"""
+        if not self.config.get('async_requests', False) or self._async_disabled:
+            return None
+        with self._async_lock:
+            if self._async_client is None:
+                if not ai_async_client.is_available():
+                    logger.warning("未安装 aiohttp，AI批改改用同步请求")
+                    self._async_disabled = True
+                    return None
+                self._async_client = AsyncAIClient(
+                    timeout=self.config.get('timeout', 30),
+                    max_retries=self.config.get('max_retries', 3),
+                    max_in_flight=self.config.get('async_max_in_flight', ai_async_client.DEFAULT_MAX_IN_FLIGHT),
+                    limiter=self.rate_limiter,
+                    breaker=self.circuit_breaker,
+                    max_tokens=self.config.get('max_tokens', 1000))
+            return self._async_client
     
-    def _make_api_request(self, user_prompt: str) -> Tuple[bool, Dict]:
-        """发送API请求"""
+    def get_async_stats(self) -> Optional[Dict]:
+        """获取异步请求统计（未启用异步请求时返回 None）"""
+        with self._async_lock:
+            client = self._async_client
+        return client.stats() if client is not None else None
+    
+    def _build_request(self, user_prompt: str, max_tokens: Optional[int] = None) -> Tuple[str, Dict, Dict]:
+        """
+        构建当前提供商的请求（max_tokens 为空时使用配置中的 max_tokens）
+        
+        Returns:
+            Tuple[str, Dict, Dict]: (url, headers, data)
+        
+        Raises:
+            ValueError: 不支持的提供商或配置不完整
+        """
         provider = self.config.get('provider', 'openai').lower()
         
         if provider == 'openai':
-            return self._openai_request(user_prompt)
+            return self._openai_request(user_prompt, max_tokens)
         elif provider == 'azure':
-            return self._azure_request(user_prompt)
+            return self._azure_request(user_prompt, max_tokens)
         elif provider == 'anthropic':
-            return self._anthropic_request(user_prompt)
+            return self._anthropic_request(user_prompt, max_tokens)
         elif provider == 'qianfan':
-            return self._qianfan_request(user_prompt)
+            return self._qianfan_request(user_prompt, max_tokens)
         elif provider == 'tongyi':
-            return self._tongyi_request(user_prompt)
+            return self._tongyi_request(user_prompt, max_tokens)
+        elif provider == 'mock':
+            return self._mock_request(user_prompt, max_tokens)
         else:
-            return False, {"error_message": f"不支持的API提供商: {provider}"}
+            raise ValueError(f"不支持的API提供商: {provider}")
     
-    def _openai_request(self, user_prompt: str) -> Tuple[bool, Dict]:
-        """OpenAI API请求"""
+    def _openai_request(self, user_prompt: str, max_tokens: Optional[int] = None) -> Tuple[str, Dict, Dict]:
+        """构建OpenAI API请求"""
         url = self.config.get('base_url', 'https://api.openai.com/v1') + '/chat/completions'
         
         headers = {
@@ -270,18 +1143,18 @@ class AIGradingService:
                 {'role': 'user', 'content': user_prompt}
             ],
             'temperature': self.config.get('temperature', 0.3),
-            'max_tokens': self.config.get('max_tokens', 1000)
+            'max_tokens': max_tokens or self.config.get('max_tokens', 1000)
         }
         
-        return self._send_request(url, headers, data)
+        return url, headers, data
     
-    def _azure_request(self, user_prompt: str) -> Tuple[bool, Dict]:
-        """Azure OpenAI API请求"""
+    def _azure_request(self, user_prompt: str, max_tokens: Optional[int] = None) -> Tuple[str, Dict, Dict]:
+        """构建Azure OpenAI API请求"""
         # Azure OpenAI的URL格式通常是：
         # https://{resource}.openai.azure.com/openai/deployments/{deployment}/chat/completions?api-version=2023-12-01-preview
         base_url = self.config.get('base_url', '')
         if not base_url:
-            return False, {"error_message": "Azure OpenAI需要配置base_url"}
+            raise ValueError("Azure OpenAI需要配置base_url")
         
         headers = {
             'api-key': self.config["api_key"],
@@ -294,13 +1167,13 @@ class AIGradingService:
                 {'role': 'user', 'content': user_prompt}
             ],
             'temperature': self.config.get('temperature', 0.3),
-            'max_tokens': self.config.get('max_tokens', 1000)
+            'max_tokens': max_tokens or self.config.get('max_tokens', 1000)
         }
         
-        return self._send_request(base_url, headers, data)
+        return base_url, headers, data
     
-    def _anthropic_request(self, user_prompt: str) -> Tuple[bool, Dict]:
-        """Anthropic Claude API请求"""
+    def _anthropic_request(self, user_prompt: str, max_tokens: Optional[int] = None) -> Tuple[str, Dict, Dict]:
+        """构建Anthropic Claude API请求"""
         url = self.config.get('base_url', 'https://api.anthropic.com/v1') + '/messages'
         
         headers = {
@@ -311,16 +1184,16 @@ class AIGradingService:
         
         data = {
             'model': self.config.get('model', 'claude-3-sonnet-20240229'),
-            'max_tokens': self.config.get('max_tokens', 1000),
+            'max_tokens': max_tokens or self.config.get('max_tokens', 1000),
             'messages': [
                 {'role': 'user', 'content': f"{self.prompts['system_prompt']}\n\n{user_prompt}"}
             ]
         }
         
-        return self._send_request(url, headers, data)
+        return url, headers, data
     
-    def _qianfan_request(self, user_prompt: str) -> Tuple[bool, Dict]:
-        """百度千帆API请求"""
+    def _qianfan_request(self, user_prompt: str, max_tokens: Optional[int] = None) -> Tuple[str, Dict, Dict]:
+        """构建百度千帆API请求"""
         # 千帆API需要access_token，这里简化处理
         # 实际使用时需要先获取access_token
         url = self.config.get('base_url', 'https://aip.baidubce.com/rpc/2.0/ai_custom/v1/wenxinworkshop/chat/completions')
@@ -334,16 +1207,16 @@ class AIGradingService:
                 {'role': 'user', 'content': f"{self.prompts['system_prompt']}\n\n{user_prompt}"}
             ],
             'temperature': self.config.get('temperature', 0.3),
-            'max_output_tokens': self.config.get('max_tokens', 1000)
+            'max_output_tokens': max_tokens or self.config.get('max_tokens', 1000)
         }
         
         # 添加access_token到URL
         url += f"?access_token={self.config['api_key']}"
         
-        return self._send_request(url, headers, data)
+        return url, headers, data
     
-    def _tongyi_request(self, user_prompt: str) -> Tuple[bool, Dict]:
-        """阿里通义千问API请求"""
+    def _tongyi_request(self, user_prompt: str, max_tokens: Optional[int] = None) -> Tuple[str, Dict, Dict]:
+        """构建阿里通义千问API请求"""
         url = self.config.get('base_url', 'https://dashscope.aliyuncs.com/api/v1/services/aigc/text-generation/generation')
         
         headers = {
@@ -361,64 +1234,131 @@ class AIGradingService:
             },
             'parameters': {
                 'temperature': self.config.get('temperature', 0.3),
-                'max_tokens': self.config.get('max_tokens', 1000)
+                'max_tokens': max_tokens or self.config.get('max_tokens', 1000)
             }
         }
         
-        return self._send_request(url, headers, data)
+        return url, headers, data
+    
+    def _mock_request(self, user_prompt: str, max_tokens: Optional[int] = None) -> Tuple[str, Dict, Dict]:
+        """构建模拟AI接口请求（按 mock 设置中的 format 使用 OpenAI 或 Anthropic 格式）"""
+        base_url = self._mock_base_url()
+        if self._wire_format() == 'anthropic':
+            _, headers, data = self._anthropic_request(user_prompt, max_tokens)
+            return base_url + '/messages', headers, data
+        _, headers, data = self._openai_request(user_prompt, max_tokens)
+        return base_url + '/chat/completions', headers, data
+    
+    def _mock_base_url(self) -> str:
+        """模拟AI接口地址：配置了 base_url 时使用外部的模拟服务器，否则启动进程内的模拟服务器"""
+        if self.config.get('base_url'):
+            return self.config['base_url'].rstrip('/')
+        return mock_ai_provider.get_mock_server(self.config.get('mock')).base_url
     
-    def _send_request(self, url: str, headers: Dict, data: Dict) -> Tuple[bool, Dict]:
-        """发送HTTP请求"""
+    def _wire_format(self) -> str:
+        """请求和响应使用的协议格式：模拟接口按 mock 设置中的 format，其他为提供商本身"""
+        provider = self.config.get('provider', 'openai').lower()
+        if provider == 'mock':
+            return (self.config.get('mock') or {}).get('format', 'openai')
+        return provider
+    
+    def _send_request(self, url: str, headers: Dict, data: Dict,
+                      make_reader: Optional[Callable[[], StreamReader]] = None) -> Tuple[bool, Dict]:
+        """
+        发送HTTP请求（经过提供商共享的限流器，失败时带抖动退避重试，熔断后不再重试）
+        
+        Args:
+            make_reader: 流式请求时创建 StreamReader 的函数，所需字段完整后即关闭连接
+        """
         max_retries = self.config.get('max_retries', 3)
         timeout = self.config.get('timeout', 30)
+        estimated = estimate_tokens(data, self.config.get('max_tokens', 1000))
         
         for attempt in range(max_retries):
+            retry_after = None
+            outcome = rate_limiter.ERROR
+            permit = self.rate_limiter.acquire(estimated)
             try:
-                response = requests.post(
+                response = self._get_http_session().post(
                     url, 
                     headers=headers, 
                     json=data, 
-                    timeout=timeout
+                    timeout=timeout,
+                    stream=make_reader is not None
                 )
                 
+                if is_failure_status(response.status_code):
+                    self.circuit_breaker.record_failure()
+                else:
+                    self.circuit_breaker.record_success()
+                
                 if response.status_code == 200:
-                    return True, response.json()
+                    if make_reader is not None and 'event-stream' in response.headers.get('Content-Type', ''):
+                        result = self._read_stream(response, make_reader())
+                    else:
+                        result = response.json()
+                    outcome = rate_limiter.OK
+                    self.rate_limiter.release(permit, outcome, tokens_used=used_tokens(result))
+                    permit = None
+                    return True, result
                 else:
+                    if response.status_code == 429:
+                        outcome = rate_limiter.THROTTLED
+                        retry_after = parse_retry_after(response.headers.get('Retry-After'))
                     logger.warning(f"API请求失败 (尝试 {attempt + 1}/{max_retries}): {response.status_code} - {response.text}")
                     if attempt == max_retries - 1:
                         return False, {"error_message": f"API请求失败: {response.status_code} - {response.text}"}
                     
             except requests.exceptions.Timeout:
+                self.circuit_breaker.record_failure()
                 logger.warning(f"API请求超时 (尝试 {attempt + 1}/{max_retries})")
                 if attempt == max_retries - 1:
                     return False, {"error_message": "API请求超时"}
                     
             except requests.exceptions.RequestException as e:
+                self.circuit_breaker.record_failure()
                 logger.warning(f"API请求异常 (尝试 {attempt + 1}/{max_retries}): {str(e)}")
                 if attempt == max_retries - 1:
                     return False, {"error_message": f"API请求异常: {str(e)}"}
             
-            # 重试前等待
+            finally:
+                if permit is not None:
+                    self.rate_limiter.release(permit, outcome, retry_after)
+            
+            if self.circuit_breaker.state == circuit_breaker.OPEN:
+                return False, self._circuit_open_error()
+            
+            # 重试前等待（遵循 Retry-After，否则带抖动的指数退避）
             if attempt < max_retries - 1:
-                time.sleep(2 ** attempt)  # 指数退避
+                time.sleep(retry_delay(attempt, retry_after))
         
         return False, {"error_message": "达到最大重试次数"}
     
+    def _read_stream(self, response, reader: StreamReader) -> Dict:
+        """读取流式响应，所需字段完整后立即关闭连接，不再接收其余输出"""
+        try:
+            return reader.read(line.decode('utf-8') for line in response.iter_lines() if line)
+        finally:
+            response.close()
+    
+    def _extract_content(self, response: Dict) -> Optional[str]:
+        """根据不同提供商提取模型回复的文本，不支持的提供商返回 None"""
+        provider = self._wire_format()
+        if provider == 'openai' or provider == 'azure':
+            return response['choices'][0]['message']['content']
+        elif provider == 'anthropic':
+            return response['content'][0]['text']
+        elif provider == 'qianfan':
+            return response['result']
+        elif provider == 'tongyi':
+            return response['output']['text']
+        return None
+    
     def _parse_ai_response(self, response: Dict, max_score: int) -> Tuple[bool, Dict]:
         """解析AI返回的响应"""
         try:
-            provider = self.config.get('provider', 'openai').lower()
-            
-            # 根据不同提供商提取内容
-            if provider == 'openai' or provider == 'azure':
-                content = response['choices'][0]['message']['content']
-            elif provider == 'anthropic':
-                content = response['content'][0]['text']
-            elif provider == 'qianfan':
-                content = response['result']
-            elif provider == 'tongyi':
-                content = response['output']['text']
-            else:
+            content = self._extract_content(response)
+            if content is None:
                 return False, {"error_message": "不支持的API提供商响应格式"}
             
             # 尝试解析JSON格式的回答
@@ -7,13 +7,42 @@ from datetime import datetime
 from datetime import timedelta
 import random
 import json
+import hashlib
+import threading
 from sqlalchemy import func
 from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
 from collections import defaultdict
 from io import BytesIO
 from werkzeug.utils import secure_filename
 import uuid
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from ai_grading_service import get_ai_grading_service
+from grading_queue import GradingJobQueue
+from scoring import score_answers, points_for, get_answer_key, QuestionSnapshot, QUESTION_TYPES
+from submission_writer import GroupCommitWriter
+from question_index import QuestionIdIndex
+from paper_pool import PaperPool, PaperQuestion, DrawnPaper, SeededPaperCache, new_paper_seed
+from fragment_cache import FragmentCache
+from markupsafe import Markup
+from database import configure_sqlite_engine, read_sqlite_settings
+from config import AI_GRADING_CONFIG
+try:
+    from config import SUBMISSION_WRITER_CONFIG
+except ImportError:
+    SUBMISSION_WRITER_CONFIG = {}
+try:
+    from config import PAPER_POOL_CONFIG
+except ImportError:
+    PAPER_POOL_CONFIG = {}
+try:
+    from config import DATABASE_URI
+except ImportError:
+    DATABASE_URI = 'sqlite:///test_system.db'
+try:
+    from config import SQLITE_PRAGMAS
+except ImportError:
+    SQLITE_PRAGMAS = {}
 import logging
 
 # 配置日志
@@ -43,10 +72,14 @@ def bjtime_filter(value, fmt='%Y-%m-%d %H:%M'):
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///test_system.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URI
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 db = SQLAlchemy(app)
 
+# SQLite 连接统一设置 WAL、忙等待等性能参数
+with app.app_context():
+    configure_sqlite_engine(db.engine, SQLITE_PRAGMAS)
+
 # 注册过滤器
 app.jinja_env.filters['bjtime'] = bjtime_filter
 
@@ -84,6 +117,7 @@ class Question(db.Model):
     score = db.Column(db.Integer, nullable=False)
     explanation = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)  # 答案键缓存版本
     bank_id = db.Column(db.Integer, db.ForeignKey('question_bank.id'), nullable=False)
 
 class Test(db.Model):
@@ -116,6 +150,12 @@ class Test(db.Model):
     # AI批改配置
     short_answer_grading_method = db.Column(db.String(20), default='manual')  # 'manual' 或 'ai'
     fill_blank_grading_method = db.Column(db.String(20), default='manual')  # 'manual' 或 'ai'
+    
+    # 由预设生成的测试：每个预设版本（题数、分值、题库的内容哈希）只对应一条测试记录
+    preset_id = db.Column(db.Integer, nullable=True)
+    content_hash = db.Column(db.String(40), nullable=True)
+    
+    __table_args__ = (db.Index('uq_test_preset_version', 'preset_id', 'content_hash', unique=True),)
 
 class TestResult(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -129,6 +169,9 @@ class TestResult(db.Model):
     ip_address = db.Column(db.String(15), nullable=True) # Added ip_address column
     test = db.relationship('Test', backref=db.backref('results', lazy=True))
 
+    # 学生历史记录的最高/最低分按学生查询，需要 (student_id, score) 索引
+    __table_args__ = (db.Index('ix_test_result_student_score', 'student_id', 'score'),)
+
 class StudentTestHistory(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     student_id = db.Column(db.Integer, db.ForeignKey('user.id'))
@@ -187,6 +230,8 @@ class ShortAnswerSubmission(db.Model):
     ai_original_score = db.Column(db.Integer, nullable=True)  # AI原始评分
     ai_feedback = db.Column(db.Text, nullable=True)  # AI反馈
     manual_reviewed = db.Column(db.Boolean, default=False)  # 是否经过人工复核
+    ai_feedback_attempts = db.Column(db.Integer, default=0)  # 两阶段批改中生成AI评语失败的次数
+    ai_feedback_failed_at = db.Column(db.DateTime, nullable=True)  # 最近一次生成AI评语失败的时间
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 class FillBlankSubmission(db.Model):
@@ -202,23 +247,992 @@ class FillBlankSubmission(db.Model):
     ai_original_score = db.Column(db.Integer, nullable=True)  # AI原始评分
     ai_feedback = db.Column(db.Text, nullable=True)  # AI反馈
     manual_reviewed = db.Column(db.Boolean, default=False)  # 是否经过人工复核
+    ai_feedback_attempts = db.Column(db.Integer, default=0)  # 两阶段批改中生成AI评语失败的次数
+    ai_feedback_failed_at = db.Column(db.DateTime, nullable=True)  # 最近一次生成AI评语失败的时间
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
-def shuffle_options(question):
+class GradingJob(db.Model):
+    """AI批改任务（持久化队列，由后台工作线程处理）"""
+    id = db.Column(db.Integer, primary_key=True)
+    result_id = db.Column(db.Integer, db.ForeignKey('test_result.id'), nullable=False, index=True)
+    question_id = db.Column(db.Integer, db.ForeignKey('question.id'), nullable=False)
+    question_type = db.Column(db.String(20), nullable=False)  # 'short_answer' 或 'fill_blank'
+    max_score = db.Column(db.Integer, default=0)  # 题目分值（按提交时的测试配置）
+    status = db.Column(db.String(20), default='pending', index=True)  # pending / running / done / failed
+    attempts = db.Column(db.Integer, default=0)
+    error_message = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class TestPaper(db.Model):
+    """抽题时生成的试卷快照（题目顺序、各题型分值和答案键），提交时据此评分"""
+    id = db.Column(db.Integer, primary_key=True)
+    student_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    test_id = db.Column(db.Integer, db.ForeignKey('test.id'), nullable=True)
+    preset_id = db.Column(db.Integer, db.ForeignKey('test_preset.id'), nullable=True)
+    questions = db.Column(db.Text, nullable=False)  # JSON: 按出题顺序的 QuestionSnapshot 列表
+    scores = db.Column(db.Text, nullable=False)  # JSON: {'single_choice_score': 5, ...}
+    short_answer_grading_method = db.Column(db.String(20), default='manual')
+    fill_blank_grading_method = db.Column(db.String(20), default='manual')
+    option_orders = db.Column(db.Text, nullable=True)  # JSON: {题目ID: 各位置上原选项的字母}，打乱选项时保存
+    result_id = db.Column(db.Integer, db.ForeignKey('test_result.id'), nullable=True)  # 提交后关联的成绩
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    submitted_at = db.Column(db.DateTime, nullable=True)
+
+    def question_map(self):
+        """返回 {题目ID: QuestionSnapshot}，按出题顺序"""
+        snapshots = (QuestionSnapshot.from_json(item) for item in json.loads(self.questions))
+        return {snapshot.id: snapshot for snapshot in snapshots}
+
+    def score_config(self):
+        """返回各题型分值字典，可直接作为评分引擎的 test_config"""
+        return json.loads(self.scores)
+
+    def option_order_map(self):
+        """返回 {题目ID: 各位置上原选项的字母}，未打乱选项时为空字典"""
+        return {int(qid): order for qid, order in json.loads(self.option_orders or '{}').items()}
+
+# 单选题和多选题参与打乱的选项
+SHUFFLED_OPTIONS = 'ABCD'
+
+def shuffle_options(question, rng=None):
     """
-    返回题目选项的原始顺序
+    打乱单选题/多选题的选项顺序
+    
+    Args:
+        question: 题目（Question 或 PaperQuestion）
+        rng: 随机数生成器，传入按种子创建的 random.Random 时结果可复现
+    
+    Returns:
+        dict: 题目数据，option_a~option_d 为打乱后的选项，correct_answer 为打乱后的正确答案，
+            option_order 为各位置上原选项的字母（如 'CADB' 表示A位置显示原C选项）
     """
-    return {
+    order = list(SHUFFLED_OPTIONS)
+    (rng or random).shuffle(order)
+    position = {original: SHUFFLED_OPTIONS[i] for i, original in enumerate(order)}
+    shuffled = {
         'content': question.content,
         'id': question.id,
         'score': question.score,
-        'option_a': question.option_a,
-        'option_b': question.option_b,
-        'option_c': question.option_c,
-        'option_d': question.option_d,
-        'correct_answer': question.correct_answer,
-        'original_correct_answer': question.correct_answer
+        'correct_answer': ''.join(position.get(c, c) for c in (question.correct_answer or '').upper()),
+        'original_correct_answer': question.correct_answer,
+        'option_order': ''.join(order)
     }
+    for letter, original in zip(SHUFFLED_OPTIONS, order):
+        shuffled[f'option_{letter.lower()}'] = getattr(question, f'option_{original.lower()}')
+    return shuffled
+
+def restore_option(answer, order):
+    """把打乱选项后学生选择的位置字母还原为原选项字母"""
+    return ''.join(order[SHUFFLED_OPTIONS.index(c)] if c in SHUFFLED_OPTIONS else c
+                   for c in (answer or '').upper())
+
+# 预设版本哈希包含的字段：各题型的题数、分值和题库
+PRESET_VERSION_FIELDS = tuple(f'{q_type}_{field}' for q_type in QUESTION_TYPES
+                              for field in ('count', 'score', 'bank_id'))
+
+# 由预设生成的测试标题前缀
+PRESET_TEST_TITLE_PREFIX = '预设测试: '
+
+def preset_content_hash(source):
+    """按各题型题数、分值和题库计算内容哈希，source 可以是 TestPreset 或 Test"""
+    payload = json.dumps([getattr(source, field) or 0 for field in PRESET_VERSION_FIELDS])
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+def get_preset_test(preset):
+    """
+    获取预设当前版本对应的测试记录，不存在时创建（不提交事务）
+    
+    预设的题数、分值或题库修改后会生成新版本的测试记录，旧成绩仍关联旧版本。
+    """
+    content_hash = preset_content_hash(preset)
+    title = f"{PRESET_TEST_TITLE_PREFIX}{preset.title}"
+    test = Test.query.filter_by(preset_id=preset.id, content_hash=content_hash).first()
+    if not test:
+        test = Test(
+            title=title,
+            preset_id=preset.id,
+            content_hash=content_hash,
+            is_active=False,  # 标记为非活跃，避免影响正常测试
+            total_score=sum((getattr(preset, f'{q_type}_count') or 0) * (getattr(preset, f'{q_type}_score') or 0)
+                            for q_type in QUESTION_TYPES),
+            **{field: getattr(preset, field) or (None if field.endswith('_bank_id') else 0)
+               for field in PRESET_VERSION_FIELDS}
+        )
+        try:
+            with db.session.begin_nested():
+                db.session.add(test)
+        except IntegrityError:
+            # 并发请求已创建同一版本
+            test = Test.query.filter_by(preset_id=preset.id, content_hash=content_hash).first()
+    
+    # 标题和批改方式不影响版本，直接同步
+    test.title = title
+    test.short_answer_grading_method = preset.short_answer_grading_method or 'manual'
+    test.fill_blank_grading_method = preset.fill_blank_grading_method or 'manual'
+    return test
+
+def merge_duplicate_preset_tests():
+    """
+    合并旧版本每次提交都新建的预设测试记录
+    
+    内容相同的记录合并为一条，成绩和试卷改为关联保留的记录。
+    
+    Returns:
+        int: 删除的重复测试数量
+    """
+    legacy_tests = Test.query.filter(
+        Test.content_hash.is_(None),
+        Test.title.like(f'{PRESET_TEST_TITLE_PREFIX}%')
+    ).order_by(Test.id).all()
+    if not legacy_tests:
+        return 0
+    
+    presets_by_title = {preset.title: preset for preset in TestPreset.query.all()}
+    canonical = {}
+    merged = 0
+    for test in legacy_tests:
+        content_hash = preset_content_hash(test)
+        preset = presets_by_title.get(test.title[len(PRESET_TEST_TITLE_PREFIX):])
+        preset_id = preset.id if preset and preset_content_hash(preset) == content_hash else None
+        key = (preset_id, content_hash, test.title)
+        target = canonical.get(key)
+        if target is None and preset_id is not None:
+            target = Test.query.filter_by(preset_id=preset_id, content_hash=content_hash).first()
+        if target is None:
+            test.preset_id = preset_id
+            test.content_hash = content_hash
+            canonical[key] = test
+            db.session.flush()
+            continue
+        canonical[key] = target
+        TestResult.query.filter_by(test_id=test.id).update({TestResult.test_id: target.id})
+        TestPaper.query.filter_by(test_id=test.id).update({TestPaper.test_id: target.id})
+        db.session.delete(test)
+        merged += 1
+    db.session.commit()
+    return merged
+
+@app.cli.command('merge-preset-tests')
+def merge_preset_tests_command():
+    """合并重复的预设测试记录（flask --app app merge-preset-tests）"""
+    merged = merge_duplicate_preset_tests()
+    print(f"✓ 已合并 {merged} 条重复的预设测试记录")
+
+def _load_question_ids(bank_id, question_type):
+    """加载题库中某题型的全部题目ID（bank_id 为空时不限题库）"""
+    query = db.session.query(Question.id).filter(Question.question_type == question_type)
+    if bank_id:
+        query = query.filter(Question.bank_id == bank_id)
+    return [qid for (qid,) in query.order_by(Question.id)]
+
+# 抽题用的题目ID索引，题目增删改提交后按题库失效
+question_id_index = QuestionIdIndex(_load_question_ids)
+
+@db.event.listens_for(db.session, 'after_flush')
+def _collect_changed_banks(session, flush_context):
+    """记录本事务中题目发生变化的题库"""
+    changed = session.info.setdefault('changed_bank_ids', set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Question):
+            changed.add(obj.bank_id)
+            # 题目移动到其他题库时，原题库的索引同样需要失效
+            changed.update(db.inspect(obj).attrs.bank_id.history.deleted or ())
+        elif isinstance(obj, QuestionBank):
+            changed.add(obj.id)
+
+@db.event.listens_for(db.session, 'after_commit')
+def _invalidate_changed_banks(session):
+    changed = session.info.pop('changed_bank_ids', ())
+    for bank_id in changed:
+        question_id_index.invalidate(bank_id)
+    if changed:
+        paper_pool.invalidate()
+
+@db.event.listens_for(db.session, 'after_rollback')
+def _discard_changed_banks(session):
+    session.info.pop('changed_bank_ids', None)
+
+def draw_questions(question_type, count, bank_id, rng=None):
+    """
+    从题库中随机抽取题目
+    
+    在内存中的题目ID索引上抽样，再通过一次 IN 查询加载题目，保持抽样顺序。
+    传入按种子创建的 rng 时，题库不变则抽样结果不变。
+    """
+    if count <= 0:
+        return []
+    sampled_ids = question_id_index.sample(bank_id or None, question_type, count, rng=rng)
+    question_map = load_questions_by_ids(sampled_ids)
+    return [question_map[qid] for qid in sampled_ids if qid in question_map]
+
+def draw_paper(source, seed=None):
+    """
+    按测试或预设的题数和题库抽取一份试卷
+    
+    题目转换为脱离会话的 PaperQuestion，同时编译答案键并生成试卷快照，
+    因此既可在请求中当场抽题，也可由试卷池在后台线程中预先抽题。
+    抽题和选项顺序完全由种子决定，同一次作答可以随时按种子重建同一份试卷。
+    
+    Args:
+        source: Test 或 TestPreset
+        seed: 抽题种子，为空时生成新种子
+    
+    Returns:
+        DrawnPaper: 按题型分组的题目、试卷快照和抽题种子
+    """
+    if seed is None:
+        seed = new_paper_seed()
+    shuffle = PAPER_POOL_CONFIG.get('shuffle_options', False)
+    questions = {}
+    snapshots = []
+    option_orders = {}
+    for q_type in QUESTION_TYPES:
+        drawn = [PaperQuestion.of(q) for q in draw_questions(
+            q_type, getattr(source, f'{q_type}_count') or 0, getattr(source, f'{q_type}_bank_id'),
+            rng=random.Random(f'{seed}:{q_type}'))]
+        for i, question in enumerate(drawn):
+            get_answer_key(question)
+            # 快照保存原正确答案，提交时先把学生选择的位置还原为原选项再评分
+            snapshots.append(QuestionSnapshot.of(question).to_json())
+            if shuffle and q_type in ('single_choice', 'multiple_choice'):
+                shuffled = shuffle_options(question, random.Random(f'{seed}:options:{question.id}'))
+                option_orders[question.id] = shuffled['option_order']
+                drawn[i] = question._replace(**{f'option_{letter.lower()}': shuffled[f'option_{letter.lower()}']
+                                                for letter in SHUFFLED_OPTIONS})
+        questions[q_type] = drawn
+    return DrawnPaper(questions, json.dumps(snapshots, ensure_ascii=False), seed, option_orders or None)
+
+def paper_digest(drawn):
+    """试卷快照摘要，用于判断按种子重建的试卷是否与保存的试卷一致"""
+    return hashlib.sha1(drawn.snapshot.encode('utf-8')).hexdigest()[:16]
+
+def paper_source_key(source):
+    """试卷池中的来源标识，题数、分值或题库变化后随内容哈希变化"""
+    kind = 'preset' if isinstance(source, TestPreset) else 'test'
+    return (kind, source.id, preset_content_hash(source))
+
+def build_pooled_paper(key):
+    """为试卷池抽题，来源已删除或已修改时返回 None"""
+    kind, source_id, content_hash = key
+    source = (TestPreset if kind == 'preset' else Test).query.get(source_id)
+    if not source or preset_content_hash(source) != content_hash:
+        return None
+    return draw_paper(source)
+
+# 按 (来源, 种子) 缓存的试卷，学生刷新考试页面时复用
+seeded_paper_cache = SeededPaperCache()
+
+def get_current_test():
+    """获取当前激活的测试，没有时返回最新的测试"""
+    return (Test.query.filter_by(is_active=True).first() or
+            Test.query.order_by(Test.created_at.desc()).first())
+
+def paper_pool_sources():
+    """需要预热的试卷来源：当前测试，以及允许学生自选时的全部预设"""
+    current_test = get_current_test()
+    if not current_test:
+        return []
+    sources = [paper_source_key(current_test)]
+    if current_test.allow_student_choice:
+        sources.extend(paper_source_key(preset) for preset in TestPreset.query.all())
+    return sources
+
+# 试卷池：考试开始前为当前测试预先抽好试卷，题库或测试配置变化后失效
+paper_pool = PaperPool(
+    app, db, build_pooled_paper, paper_pool_sources,
+    enabled=PAPER_POOL_CONFIG.get('enabled', True),
+    depth=PAPER_POOL_CONFIG.get('depth', 10),
+    refill_interval=PAPER_POOL_CONFIG.get('refill_interval', 30)
+)
+
+# 考试页面的题目片段缓存
+question_fragment_cache = FragmentCache()
+
+def render_question_fragments(questions, option_orders=None):
+    """
+    渲染题目的题干和作答区域片段，按 (题目ID, 版本, 题型, 选项顺序) 缓存
+    
+    Args:
+        questions: 题目列表（Question 或 PaperQuestion）
+        option_orders: {题目ID: 各位置上原选项的字母}，打乱选项时传入
+    
+    Returns:
+        dict: {题目ID: 渲染好的 HTML 片段}
+    """
+    option_orders = option_orders or {}
+    fragments = {}
+    for question in questions:
+        key = (question.id, getattr(question, 'updated_at', None), question.question_type,
+               option_orders.get(question.id))
+        fragments[question.id] = Markup(question_fragment_cache.get(
+            key, lambda: render_template('question_fragment.html', question=question)))
+    return fragments
+
+def create_test_paper(student_id, test_config, questions, test_id=None, preset_id=None,
+                      short_answer_grading_method='manual', fill_blank_grading_method='manual',
+                      snapshot=None, option_orders=None):
+    """
+    保存本次抽到的试卷快照（不提交事务）
+    
+    Args:
+        student_id: 学生ID
+        test_config: 测试配置字典（提供各题型分值）
+        questions: 按出题顺序排列的题目列表
+        test_id: 关联的测试ID（使用预设时为该预设版本的测试）
+        preset_id: 关联的预设ID
+        snapshot: 预先生成的题目快照（JSON），为空时由 questions 生成
+        option_orders: {题目ID: 各位置上原选项的字母}，打乱选项时传入
+    
+    Returns:
+        TestPaper: 新建的试卷
+    """
+    paper = TestPaper(
+        student_id=student_id,
+        test_id=test_id,
+        preset_id=preset_id,
+        questions=snapshot or json.dumps([QuestionSnapshot.of(q).to_json() for q in questions], ensure_ascii=False),
+        scores=json.dumps({f'{q_type}_score': test_config.get(f'{q_type}_score') or 0 for q_type in QUESTION_TYPES}),
+        short_answer_grading_method=short_answer_grading_method or 'manual',
+        fill_blank_grading_method=fill_blank_grading_method or 'manual',
+        option_orders=json.dumps(option_orders) if option_orders else None
+    )
+    db.session.add(paper)
+    return paper
+
+def load_questions_by_ids(question_ids):
+    """
+    通过一次 IN 查询批量加载题目
+    
+    Args:
+        question_ids: 题目ID集合
+    
+    Returns:
+        dict: {题目ID: Question}，不存在的ID不会出现在结果中
+    """
+    ids = {int(qid) for qid in question_ids}
+    if not ids:
+        return {}
+    questions = Question.query.filter(Question.id.in_(ids)).all()
+    return {q.id: q for q in questions}
+
+def refresh_student_history(student_id, student_name='', class_number=''):
+    """
+    根据学生的全部测试结果重新统计历史记录（不提交事务）
+
+    仅用于修复统计偏差，正常提交和评分使用 record_history_score 增量更新。
+    """
+    test_count, total_score_sum, highest_score, lowest_score = db.session.query(
+        db.func.count(TestResult.id),
+        db.func.coalesce(db.func.sum(TestResult.score), 0),
+        db.func.coalesce(db.func.max(TestResult.score), 0),
+        db.func.coalesce(db.func.min(TestResult.score), 0)
+    ).filter(TestResult.student_id == student_id).one()
+
+    history = StudentTestHistory.query.filter_by(student_id=student_id).first()
+    if not history:
+        history = StudentTestHistory(
+            student_id=student_id,
+            student_name=student_name,
+            class_number=class_number,
+        )
+        db.session.add(history)
+
+    history.test_count = test_count
+    history.total_score = total_score_sum
+    history.highest_score = highest_score
+    history.lowest_score = lowest_score
+    db.session.flush()
+    _update_history_average(student_id)
+    db.session.refresh(history)
+    return history
+
+def _student_score_extreme(student_id, func):
+    """(student_id, score) 索引上的最高分或最低分子查询"""
+    return (db.session.query(db.func.coalesce(func(TestResult.score), 0))
+            .filter(TestResult.student_id == student_id).scalar_subquery())
+
+def _update_history_average(student_id):
+    """在SQL中按总分和测试次数更新平均分（四舍五入为整数）"""
+    StudentTestHistory.query.filter_by(student_id=student_id).update({
+        StudentTestHistory.average_score: db.case(
+            (StudentTestHistory.test_count > 0,
+             db.func.round(StudentTestHistory.total_score * 1.0 / StudentTestHistory.test_count)),
+            else_=0)
+    }, synchronize_session=False)
+
+def record_history_score(student_id, new_score, old_score=None, student_name='', class_number=''):
+    """
+    按分数变化增量更新学生历史记录（不提交事务）
+
+    Args:
+        student_id: 学生ID
+        new_score: 新成绩
+        old_score: 被替换的旧成绩；为 None 表示新增一次测试
+        student_name: 学生姓名（历史记录不存在时使用）
+        class_number: 班级（历史记录不存在时使用）
+
+    只有被替换的旧成绩恰好是当前最高/最低分时，才通过索引查询重新获取极值。
+    调用前 TestResult 中的成绩应已更新为 new_score。
+    提交写入器、批改工作线程和教师评分会并发调用，各项统计都在SQL中按增量更新
+    （SET total_score = total_score + :delta），不在Python中读取后写回，避免丢失更新。
+    """
+    H = StudentTestHistory
+    history = H.query.filter_by(student_id=student_id).first()
+    if not history or (old_score is not None and not history.test_count):
+        # 没有可增量更新的历史记录，按全部成绩重建
+        return refresh_student_history(student_id, student_name, class_number)
+
+    count = db.func.coalesce(H.test_count, 0)
+    if old_score is None:
+        values = {
+            H.test_count: count + 1,
+            H.total_score: db.func.coalesce(H.total_score, 0) + new_score,
+            H.highest_score: db.case((count == 0, new_score), (H.highest_score < new_score, new_score),
+                                     else_=H.highest_score),
+            H.lowest_score: db.case((count == 0, new_score), (H.lowest_score > new_score, new_score),
+                                    else_=H.lowest_score),
+        }
+    else:
+        if new_score == old_score:
+            return history
+        values = {
+            H.total_score: db.func.coalesce(H.total_score, 0) + (new_score - old_score),
+            H.highest_score: db.case(
+                (H.highest_score <= new_score, new_score),
+                (H.highest_score == old_score, _student_score_extreme(student_id, db.func.max)),
+                else_=H.highest_score),
+            H.lowest_score: db.case(
+                (H.lowest_score >= new_score, new_score),
+                (H.lowest_score == old_score, _student_score_extreme(student_id, db.func.min)),
+                else_=H.lowest_score),
+        }
+    H.query.filter_by(id=history.id).update(values, synchronize_session=False)
+    _update_history_average(student_id)
+    db.session.refresh(history)
+    return history
+
+def rebuild_student_histories():
+    """
+    按全部测试结果重建所有学生的历史记录，用于修复增量统计的偏差
+
+    Returns:
+        int: 重建的学生数量
+    """
+    student_ids = {sid for (sid,) in db.session.query(TestResult.student_id).distinct()}
+    student_ids.update(sid for (sid,) in db.session.query(StudentTestHistory.student_id))
+    for student_id in student_ids:
+        if student_id is None:
+            continue
+        latest = TestResult.query.filter_by(student_id=student_id).order_by(TestResult.created_at.desc()).first()
+        refresh_student_history(
+            student_id,
+            latest.student_name if latest else '',
+            latest.class_number if latest else ''
+        )
+    db.session.commit()
+    return len(student_ids)
+
+@app.cli.command('rebuild-history')
+def rebuild_history_command():
+    """重建学生历史统计（flask --app app rebuild-history）"""
+    count = rebuild_student_histories()
+    print(f"✓ 已重建 {count} 名学生的历史记录")
+
+def rescore_result(result):
+    """
+    使用评分引擎重新计算一次答卷的总分（未取整）
+
+    客观题由答案键自动评分；简答题和有提交记录的填空题使用提交记录中的分数。
+    待批改（分数为空）的题目与提交时一样按 0 分计算：AI批改完成或教师评分时再按分差计入总分，
+    若按答案键自动评分，批改完成后该题会被重复计分。
+    """
+    test = Test.query.get(result.test_id)
+    answers = json.loads(result.answers)
+    question_map = load_questions_by_ids(answers.keys())
+    graded_scores = {}
+    for model in (ShortAnswerSubmission, FillBlankSubmission):
+        for submission in model.query.filter_by(result_id=result.id):
+            graded_scores[submission.question_id] = submission.score or 0
+    total_score, _ = score_answers(answers, question_map, test, graded_scores)
+    return total_score
+
+class GradingConflictError(Exception):
+    """教师评分时该题分数已被其他请求修改"""
+
+def save_manual_grade(submission_model, result, question_id, score, comment):
+    """
+    保存教师对单道题的评分，并按分差更新测试总分和学生历史（不提交事务）
+
+    旧分数取自提交记录；没有记录时由评分引擎计算该题的自动得分。
+    提交记录用“分数未变”作为条件更新，测试总分用 SQL 自增更新，
+    并发评分同一道题时后到的请求会失败而不是覆盖，避免丢失更新。
+
+    Args:
+        submission_model: ShortAnswerSubmission 或 FillBlankSubmission
+        result: TestResult
+        question_id: 题目ID
+        score: 新分数
+        comment: 评语
+
+    Returns:
+        int: 测试总分的变化量
+
+    Raises:
+        GradingConflictError: 该题分数已被其他请求修改
+    """
+    question_id = int(question_id)
+    submission = submission_model.query.filter_by(result_id=result.id, question_id=question_id).first()
+    
+    if submission:
+        # 待批改（分数为空）的题目尚未计入总分
+        old_score = submission.score or 0
+    else:
+        answers = json.loads(result.answers)
+        _, details = score_answers({question_id: answers.get(str(question_id), '')},
+                                   load_questions_by_ids([question_id]), Test.query.get(result.test_id))
+        old_score = details.get(question_id, (0, None))[0] or 0
+    
+    if not submission:
+        db.session.add(submission_model(
+            result_id=result.id,
+            question_id=question_id,
+            student_answer='',  # 这里不需要学生答案，因为已经在answers字段中
+            score=score,
+            comment=comment,
+            graded_bool=True
+        ))
+    else:
+        values = {
+            submission_model.score: score,
+            submission_model.comment: comment,
+            submission_model.graded_bool: True
+        }
+        # 如果是AI批改的题目，标记为已人工复核
+        if submission.grading_method == 'ai':
+            values[submission_model.manual_reviewed] = True
+        score_unchanged = (submission_model.score.is_(None) if submission.score is None
+                           else submission_model.score == submission.score)
+        updated = submission_model.query.filter(
+            submission_model.id == submission.id, score_unchanged
+        ).update(values, synchronize_session='fetch')
+        if not updated:
+            raise GradingConflictError('该题分数已被其他人修改，请刷新后重试')
+    
+    # 教师评分后不再需要AI批改
+    GradingJob.query.filter(
+        GradingJob.result_id == result.id,
+        GradingJob.question_id == question_id,
+        GradingJob.status.in_(('pending', 'failed'))
+    ).update({GradingJob.status: 'done'}, synchronize_session=False)
+    
+    score_delta = score - old_score
+    if score_delta:
+        TestResult.query.filter_by(id=result.id).update({TestResult.score: TestResult.score + score_delta})
+        db.session.refresh(result)
+        record_history_score(result.student_id, result.score, result.score - score_delta,
+                             result.student_name, result.class_number)
+    return score_delta
+
+# 两阶段批改中评语尚未生成时显示的评语
+AI_FEEDBACK_PENDING_COMMENT = 'AI评语生成中，请稍后刷新查看'
+# 多次生成AI评语失败、不再重试时的评语（分数不受影响）
+AI_FEEDBACK_FAILED_COMMENT = 'AI评语生成失败，分数不受影响'
+
+def ai_grading_comment(submission_model, ai_result):
+    """由AI批改结果生成评语（填空题如果有简短理由，将其放在评语开头）"""
+    short_reason = (ai_result.get('short_reason') or '').strip()
+    if submission_model is FillBlankSubmission and short_reason:
+        return f"扣分理由：{short_reason}。{ai_result['feedback']}"
+    return ai_result['feedback']
+
+def update_ungraded_submission(submission, values):
+    """
+    条件更新尚未评分、未经教师复核的提交记录（不提交事务）
+    
+    AI批改在事务外等待接口响应，期间教师可能已经评分；条件更新保证AI结果不会覆盖教师的评分。
+    
+    Returns:
+        bool: 是否更新成功（False 表示该题已被评分）
+    """
+    model = type(submission)
+    updated = model.query.filter(
+        model.id == submission.id,
+        model.graded_bool.isnot(True),
+        model.manual_reviewed.isnot(True)
+    ).update({getattr(model, name): value for name, value in values.items()}, synchronize_session='fetch')
+    return updated == 1
+
+def apply_ai_grading_result(submission, ai_result, max_score):
+    """
+    将AI批改结果写入简答题/填空题提交记录（条件更新，教师已评分时不写入）
+    
+    只评分的结果（feedback_pending）不写入 ai_feedback，评语由 fill_ai_feedback 之后补充。
+    
+    Returns:
+        Optional[int]: 实际计入的分数（不超过教师设置的分值）；该题已被评分时返回 None，不应计入总分
+    """
+    # 确保AI给出的分数不超过教师设置的分值
+    actual_score = min(ai_result['score'], max_score)
+    if actual_score != ai_result['score']:
+        logger.warning(f"AI给出的分数({ai_result['score']})超过设定分值({max_score})，已调整为{actual_score}")
+    
+    values = {'score': actual_score, 'graded_bool': True, 'ai_original_score': actual_score}
+    if ai_result.get('feedback_pending'):
+        values.update(comment=AI_FEEDBACK_PENDING_COMMENT, ai_feedback=None)
+    else:
+        values.update(comment=ai_grading_comment(type(submission), ai_result), ai_feedback=ai_result['feedback'])
+    if not update_ungraded_submission(submission, values):
+        return None
+    return actual_score
+
+def _pending_feedback_query(model):
+    """两阶段批改中已评分、尚未生成评语且可以（再次）生成评语的提交记录查询"""
+    max_attempts = AI_GRADING_CONFIG.get('feedback_max_attempts', 3)
+    retry_before = datetime.utcnow() - timedelta(seconds=AI_GRADING_CONFIG.get('feedback_retry_delay', 300))
+    return model.query.filter(
+        model.grading_method == 'ai',
+        model.graded_bool.is_(True),
+        model.ai_original_score.isnot(None),
+        model.ai_feedback.is_(None),
+        model.manual_reviewed.isnot(True),
+        func.coalesce(model.ai_feedback_attempts, 0) < max_attempts,
+        db.or_(model.ai_feedback_failed_at.is_(None), model.ai_feedback_failed_at <= retry_before)
+    )
+
+def count_pending_feedback():
+    """统计尚未生成评语的提交记录数（COUNT 查询，不加载记录）"""
+    return sum(_pending_feedback_query(model).count() for model in (ShortAnswerSubmission, FillBlankSubmission))
+
+def pending_feedback_submissions(result_id=None, limit=None):
+    """
+    查询两阶段批改中已评分、尚未生成评语的提交记录（教师已复核的不再补充）
+    
+    生成失败的记录在 feedback_retry_delay 秒内不再返回，失败 feedback_max_attempts 次后不再重试，
+    避免少数总是失败的记录占满每批的名额并反复请求AI接口。
+    
+    Args:
+        result_id: 只查询该测试结果的记录
+        limit: 最多返回的记录数
+    """
+    pending = []
+    for model in (ShortAnswerSubmission, FillBlankSubmission):
+        if limit is not None and len(pending) >= limit:
+            break
+        query = _pending_feedback_query(model)
+        if result_id is not None:
+            query = query.filter(model.result_id == result_id)
+        if limit is not None:
+            query = query.order_by(model.id).limit(limit - len(pending))
+        pending.extend(query.all())
+    return pending
+
+def fill_ai_feedback(submissions):
+    """
+    为只评了分的提交记录生成AI评语（两阶段批改的第二阶段，不提交事务）
+    
+    评语按已评定的分数生成，分数不变；其他请求已先行补充的记录不会被覆盖。
+    生成失败时记录失败次数和时间，达到 feedback_max_attempts 次后评语改为生成失败的提示。
+    
+    Returns:
+        int: 成功补充评语的记录数
+    """
+    items = []
+    for submission in submissions:
+        question = Question.query.get(submission.question_id)
+        if not question:
+            continue
+        model = type(submission)
+        # 分值以提交时登记的批改任务为准
+        job = GradingJob.query.filter_by(result_id=submission.result_id,
+                                         question_id=submission.question_id).first()
+        items.append((model, submission.id, {
+            'question': question.content,
+            'reference_answer': question.correct_answer,
+            'student_answer': submission.student_answer,
+            'max_score': job.max_score if job and job.max_score else question.score or 0,
+            'score': submission.ai_original_score,
+            'question_type': 'fill_blank' if model is FillBlankSubmission else 'short_answer'
+        }))
+    if not items:
+        return 0
+    
+    # 调用AI前结束读事务，避免长时间持有SQLite共享锁阻塞写入
+    db.session.commit()
+    
+    results = get_ai_grading_service().generate_feedback_many([args for _, _, args in items])
+    max_attempts = AI_GRADING_CONFIG.get('feedback_max_attempts', 3)
+    filled = 0
+    for (model, submission_id, _), (success, ai_result) in zip(items, results):
+        if not success:
+            logger.warning(f"AI评语生成失败 - 记录ID: {submission_id}, 错误: {ai_result.get('error_message')}")
+            model.query.filter(model.id == submission_id, model.ai_feedback.is_(None)).update({
+                model.ai_feedback_attempts: func.coalesce(model.ai_feedback_attempts, 0) + 1,
+                model.ai_feedback_failed_at: datetime.utcnow()
+            }, synchronize_session=False)
+            model.query.filter(
+                model.id == submission_id,
+                model.ai_feedback.is_(None),
+                model.manual_reviewed.isnot(True),
+                model.ai_feedback_attempts >= max_attempts
+            ).update({model.comment: AI_FEEDBACK_FAILED_COMMENT}, synchronize_session=False)
+            continue
+        updated = model.query.filter(model.id == submission_id, model.ai_feedback.is_(None)).update(
+            {model.ai_feedback: ai_result['feedback']}, synchronize_session=False)
+        if not updated:
+            continue
+        # 教师已复核的记录保留教师的评语
+        model.query.filter(model.id == submission_id, model.manual_reviewed.isnot(True)).update(
+            {model.comment: ai_grading_comment(model, ai_result)}, synchronize_session=False)
+        filled += 1
+    return filled
+
+# 查看成绩时请求生成评语的测试结果ID，由批改队列空闲时优先处理
+_feedback_requests = set()
+_feedback_requests_lock = threading.Lock()
+
+def request_ai_feedback(result_id):
+    """请求为一份测试结果生成AI评语（在批改队列的工作线程中生成，不阻塞查看成绩的请求）"""
+    with _feedback_requests_lock:
+        _feedback_requests.add(result_id)
+    grading_job_queue.notify()
+
+def backfill_ai_feedback():
+    """
+    批改队列空闲时补充AI评语（两阶段批改），返回补充的记录数
+    
+    先处理查看成绩时请求的测试结果；feedback_backfill 开启时再补充一批其他记录。
+    """
+    ai_service = get_ai_grading_service()
+    if not AI_GRADING_CONFIG.get('two_phase_grading', False) or not ai_service.is_enabled():
+        return 0
+    if ai_service.get_circuit_stats()['state'] != 'closed':
+        return 0
+    limit = AI_GRADING_CONFIG.get('feedback_backfill_batch', 10)
+    with _feedback_requests_lock:
+        requested = sorted(_feedback_requests)
+        _feedback_requests.clear()
+    submissions = []
+    for result_id in requested:
+        submissions.extend(pending_feedback_submissions(result_id=result_id))
+    if not submissions and AI_GRADING_CONFIG.get('feedback_backfill', True):
+        submissions = pending_feedback_submissions(limit=limit)
+    return fill_ai_feedback(submissions)
+
+def _grading_submission_model(question_type):
+    return ShortAnswerSubmission if question_type == 'short_answer' else FillBlankSubmission
+
+def process_grading_jobs(jobs, max_attempts):
+    """
+    处理一组AI批改任务（由后台批改队列在应用上下文中调用，不提交事务）
+    
+    同一份试卷的题目通过 AIGradingService.grade_many 并发批改，其他提交中同一道简答题的答案
+    合并为批量请求；完成后按提交把得分累加到测试总分并刷新学生历史。
+    
+    Args:
+        jobs: 一份提交的 GradingJob 列表，可附带其他提交中相同题目的任务
+        max_attempts: 最大尝试次数，最后一次失败时记录失败评语
+    
+    Returns:
+        dict: {任务ID: (是否成功, 错误信息)}，AI接口熔断时为 (False, 错误信息, False) 表示不再重试
+    """
+    outcomes = {}
+    pending = []
+    for job in jobs:
+        submission = _grading_submission_model(job.question_type).query.filter_by(
+            result_id=job.result_id, question_id=job.question_id).first()
+        question = Question.query.get(job.question_id)
+        if not submission or not question:
+            outcomes[job.id] = (True, '提交记录或题目已不存在')
+            continue
+        if submission.graded_bool:
+            # 教师已先行人工评分
+            outcomes[job.id] = (True, '')
+            continue
+        pending.append({
+            'job_id': job.id,
+            'result_id': job.result_id,
+            'question_id': job.question_id,
+            'question_type': job.question_type,
+            'max_score': job.max_score or 0,
+            'is_last_attempt': job.attempts >= max_attempts,
+            'grade_args': {
+                'question': question.content,
+                'reference_answer': question.correct_answer,
+                'student_answer': submission.student_answer,
+                'max_score': job.max_score or 0,
+                'question_type': job.question_type
+            }
+        })
+        if AI_GRADING_CONFIG.get('two_phase_grading', False):
+            # 两阶段批改：提交后只评分，评语在查看成绩或批改队列空闲时生成
+            pending[-1]['grade_args']['score_only'] = True
+    if not pending:
+        return outcomes
+    
+    # 调用AI前结束读事务，避免长时间持有SQLite共享锁阻塞写入
+    db.session.commit()
+    
+    graded = get_ai_grading_service().grade_many([item['grade_args'] for item in pending])
+    
+    score_deltas = {}
+    for item, (success, ai_result) in zip(pending, graded):
+        submission = _grading_submission_model(item['question_type']).query.filter_by(
+            result_id=item['result_id'], question_id=item['question_id']).first()
+        if not submission or submission.graded_bool:
+            outcomes[item['job_id']] = (True, '')
+            continue
+        if not success:
+            error_message = ai_result.get('error_message', '未知错误')
+            if ai_result.get('circuit_open'):
+                # AI接口熔断中：不再重试，保留为待批改，由教师人工批改
+                update_ungraded_submission(submission, {'comment': '待人工批改（AI服务暂时不可用）'})
+                outcomes[item['job_id']] = (False, error_message, False)
+                continue
+            if item['is_last_attempt']:
+                update_ungraded_submission(submission, {
+                    'score': 0, 'comment': f"AI批改失败: {error_message}", 'graded_bool': True})
+            outcomes[item['job_id']] = (False, error_message)
+            continue
+        actual_score = apply_ai_grading_result(submission, ai_result, item['max_score'])
+        if actual_score is None:
+            # 等待AI响应期间教师已评分，保留教师的分数，不再计入总分
+            outcomes[item['job_id']] = (True, '')
+            continue
+        score_deltas[item['result_id']] = score_deltas.get(item['result_id'], 0) + actual_score
+        outcomes[item['job_id']] = (True, '')
+        logger.info(f"AI批改成功 - 题目ID: {item['question_id']}, 得分: {actual_score}/{item['max_score']}")
+    
+    for result_id, score_delta in score_deltas.items():
+        result = TestResult.query.get(result_id)
+        if not result or not score_delta:
+            continue
+        old_total = result.score
+        TestResult.query.filter_by(id=result.id).update({TestResult.score: TestResult.score + score_delta})
+        db.session.refresh(result)
+        record_history_score(result.student_id, result.score, old_total,
+                             result.student_name, result.class_number)
+    return outcomes
+
+grading_job_queue = GradingJobQueue(
+    app, db, GradingJob, process_grading_jobs,
+    worker_count=AI_GRADING_CONFIG.get('grading_workers', 2),
+    max_attempts=AI_GRADING_CONFIG.get('max_retries', 3),
+    same_question_limit=(AI_GRADING_CONFIG.get('batch_max_size', 10)
+                         if AI_GRADING_CONFIG.get('batch_grading', True) else 0),
+    idle_handler=backfill_ai_feedback
+)
+
+# 考试提交写入器：高峰期把多份提交合并到一个事务中写入
+submission_writer = GroupCommitWriter(
+    app, db,
+    enabled=SUBMISSION_WRITER_CONFIG.get('enabled', True),
+    max_batch=SUBMISSION_WRITER_CONFIG.get('max_batch', 50),
+    max_wait=SUBMISSION_WRITER_CONFIG.get('max_wait_ms', 5) / 1000,
+    timeout=SUBMISSION_WRITER_CONFIG.get('timeout', 30)
+)
+
+def save_submission(submission):
+    """
+    保存一份考试提交（由提交写入器在写线程中调用，不提交事务）
+    
+    Args:
+        submission: 提交数据字典，包含学生信息、test_id、paper_id、score、answers、
+            records（简答题/填空题提交记录）和 jobs（AI批改任务）
+    
+    Returns:
+        int: 新建的测试结果ID
+    
+    Raises:
+        ValueError: 试卷已提交
+    """
+    result = TestResult(
+        student_id=submission['student_id'],
+        student_name=submission['student_name'],
+        class_number=submission['class_number'],
+        test_id=submission['test_id'],
+        score=submission['score'],
+        answers=json.dumps(submission['answers']),
+        ip_address=submission['ip_address']
+    )
+    db.session.add(result)
+    db.session.flush()  # 获取result.id但不提交
+    
+    # 标记试卷已提交（条件更新，防止同一份试卷重复提交）
+    claimed = TestPaper.query.filter_by(id=submission['paper_id'], submitted_at=None).update(
+        {TestPaper.submitted_at: datetime.utcnow(), TestPaper.result_id: result.id})
+    if not claimed:
+        raise ValueError('试卷已提交')
+    
+    # 简答题和填空题提交记录
+    for record in submission['records']:
+        model = _grading_submission_model(record['question_type'])
+        item = model(
+            result_id=result.id,
+            question_id=record['question_id'],
+            student_answer=record['answer'],
+            grading_method=record['grading_method']
+        )
+        if record['pending_ai']:
+            # 待AI批改，批改完成前 score 为空
+            item.comment = 'AI批改中'
+        elif record['score'] is not None:
+            item.score = record['score']
+            item.graded_bool = True
+        db.session.add(item)
+    
+    # 登记AI批改任务，与提交记录在同一事务中持久化
+    for job in submission['jobs']:
+        db.session.add(GradingJob(result_id=result.id, **job))
+    
+    record_history_score(submission['student_id'], result.score,
+                         student_name=submission['student_name'],
+                         class_number=submission['class_number'])
+    return result.id
+
+def start_grading_workers():
+    """启动AI批改后台工作线程（会先恢复上次中断的任务）、试卷池补充线程和AI接口健康检查"""
+    grading_job_queue.start()
+    paper_pool.start()
+    ai_service = get_ai_grading_service()
+    ai_service.start_health_monitor()
+    if ai_service.is_enabled() and AI_GRADING_CONFIG.get('warm_up_connections', 0) > 0:
+        # 在后台预热AI接口连接，不阻塞启动
+        threading.Thread(target=ai_service.warm_up, name='ai-warm-up', daemon=True).start()
+
+def upgrade_schema():
+    """
+    为已有数据库补充模型中新增的列和索引（create_all 不会修改已存在的表）
+
+    Returns:
+        list: 新增的列和索引，格式为 '表名.列名' 或 '表名.索引名'
+    """
+    inspector = db.inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    added = []
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing_columns = {col['name'] for col in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                conn.execute(db.text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+                added.append(f'{table.name}.{column.name}')
+            existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(conn)
+                    added.append(f'{table.name}.{index.name}')
+    return added
+
+@app.cli.command('upgrade-schema')
+def upgrade_schema_command():
+    """为旧数据库补充新增的列和索引（flask --app app upgrade-schema）"""
+    added = upgrade_schema()
+    print(f"✓ 数据库结构已升级，新增: {', '.join(added)}" if added else "✓ 数据库结构已是最新")
 
 # 初始化数据库
 def init_db():
@@ -239,6 +1253,20 @@ def init_db():
             db.create_all()
             print("✓ 数据库表创建成功")
             
+            sqlite_settings = read_sqlite_settings(db.engine)
+            if sqlite_settings:
+                print("✓ SQLite 配置: " + ', '.join(f'{name}={value}' for name, value in sqlite_settings.items()))
+            
+            # 为旧数据库补充新增的列和索引
+            added_columns = upgrade_schema()
+            if added_columns:
+                print(f"✓ 数据库结构已升级，新增: {', '.join(added_columns)}")
+            
+            # 合并旧版本重复创建的预设测试记录
+            merged_tests = merge_duplicate_preset_tests()
+            if merged_tests:
+                print(f"✓ 已合并 {merged_tests} 条重复的预设测试记录")
+            
             # 检查并创建默认教师账户
             admin = User.query.filter_by(username='admin', role='teacher').first()
             if not admin:
@@ -379,10 +1407,16 @@ def student_start():
         session['class_number'] = class_number
         session['role'] = 'student'  # 明确设置学生角色
         session['selected_preset_id'] = test_content if test_content else None  # 新增：存储选择的预设ID
+        session.pop('paper_attempt', None)  # 重新开始测试时抽取新试卷
         
         return redirect(url_for('test'))
     return render_template('student_start.html')
 
+def _is_open_paper(paper_id):
+    """试卷存在且尚未提交"""
+    paper = TestPaper.query.get(paper_id)
+    return paper is not None and paper.submitted_at is None
+
 @app.route('/test')
 def test():
     if 'student_id' not in session:
@@ -424,12 +1458,8 @@ def test():
                           (preset.short_answer_count or 0) * (preset.short_answer_score or 0))
         }
     else:
-        # 学生没有选择，使用当前激活的测试
-        current_test = Test.query.filter_by(is_active=True).first()
-        if not current_test:
-            # 如果没有激活的测试，尝试获取最新的测试
-            current_test = Test.query.order_by(Test.created_at.desc()).first()
-            
+        # 学生没有选择，使用当前激活的测试（没有激活的测试时使用最新的测试）
+        current_test = get_current_test()
         if not current_test:
             flash('当前没有可用的测试，请联系管理员')
             return redirect(url_for('student_start'))
@@ -455,88 +1485,115 @@ def test():
             'total_score': current_test.total_score or 0
         }
     
-    # 每次都重新抽题，不再判断是否已参加过
-    def pick_questions(q_type, count, bank_id):
-        if count <= 0:
-            return []
-        q = Question.query.filter_by(question_type=q_type)
-        if bank_id:
-            q = q.filter_by(bank_id=bank_id)
-        return q.order_by(func.random()).limit(count).all()
-
-    single_choice_questions  = pick_questions('single_choice',  test_config['single_choice_count'],  test_config['single_choice_bank_id'])
-    multiple_choice_questions = pick_questions('multiple_choice', test_config['multiple_choice_count'], test_config['multiple_choice_bank_id'])
-    true_false_questions      = pick_questions('true_false',   test_config['true_false_count'],     test_config['true_false_bank_id'])
-    fill_blank_questions      = pick_questions('fill_blank',   test_config['fill_blank_count'],     test_config['fill_blank_bank_id'])
-    short_answer_questions    = pick_questions('short_answer', test_config['short_answer_count'],   test_config['short_answer_bank_id'])
+    source = preset if selected_preset_id else current_test
+    source_key = paper_source_key(source)
+    
+    # 刷新页面时按本次作答的种子重建同一份试卷（优先使用缓存），不再写数据库
+    drawn = None
+    attempt = session.get('paper_attempt')
+    if attempt and not _is_open_paper(attempt['paper_id']):
+        # 试卷已提交（例如提交写入超时后才保存完成）：丢弃种子，抽取新试卷
+        session.pop('paper_attempt', None)
+        attempt = None
+    if attempt and attempt['source'] == list(source_key) and attempt['paper_id'] == session.get('paper_id'):
+        cache_key = (source_key, attempt['seed'])
+        drawn = seeded_paper_cache.get(cache_key)
+        if drawn is None:
+            drawn = draw_paper(source, attempt['seed'])
+            # 题库已变化时重建的试卷与保存的不同，改为开始新的作答
+            if paper_digest(drawn) == attempt['digest']:
+                seeded_paper_cache.put(cache_key, drawn)
+            else:
+                drawn = None
+    
+    if drawn is not None:
+        paper_id = attempt['paper_id']
+    else:
+        # 新的作答：优先从试卷池取出预先抽好的试卷
+        drawn = paper_pool.take(source_key) or draw_paper(source)
+        
+        # 保存试卷快照，提交时按快照评分并拒绝试卷以外的题目
+        paper = create_test_paper(
+            session['student_id'],
+            test_config,
+            [q for q_type in QUESTION_TYPES for q in drawn.questions[q_type]],
+            test_id=get_preset_test(preset).id if selected_preset_id else current_test.id,
+            preset_id=preset.id if selected_preset_id else None,
+            short_answer_grading_method=source.short_answer_grading_method,
+            fill_blank_grading_method=source.fill_blank_grading_method,
+            snapshot=drawn.snapshot,
+            option_orders=drawn.option_orders
+        )
+        db.session.commit()
+        paper_id = paper.id
+        session['paper_id'] = paper_id
+        session['paper_attempt'] = {'source': list(source_key), 'seed': drawn.seed,
+                                    'paper_id': paper_id, 'digest': paper_digest(drawn)}
+        seeded_paper_cache.put((source_key, drawn.seed), drawn)
     
+    questions = [q for q_type in QUESTION_TYPES for q in drawn.questions[q_type]]
     return render_template('test.html', 
                          test=test_config,
-                         single_choice_questions=single_choice_questions,
-                         multiple_choice_questions=multiple_choice_questions,
-                         true_false_questions=true_false_questions,
-                         fill_blank_questions=fill_blank_questions,
-                         short_answer_questions=short_answer_questions)
+                         paper_id=paper_id,
+                         question_fragments=render_question_fragments(questions, drawn.option_orders),
+                         single_choice_questions=drawn.questions['single_choice'],
+                         multiple_choice_questions=drawn.questions['multiple_choice'],
+                         true_false_questions=drawn.questions['true_false'],
+                         fill_blank_questions=drawn.questions['fill_blank'],
+                         short_answer_questions=drawn.questions['short_answer'])
 
 @app.route('/submit_test', methods=['POST'])
 def submit_test():
     if 'student_id' not in session:
         return redirect(url_for('student_start'))
     
-    # 获取学生选择的预设ID
-    selected_preset_id = session.get('selected_preset_id')
-    
-    # 根据选择决定使用哪个测试配置
-    if selected_preset_id:
-        # 学生选择了预设，使用预设配置
-        preset = TestPreset.query.get(selected_preset_id)
-        if not preset:
-            flash('选择的测试内容不存在')
-            return redirect(url_for('student_start'))
-        
-        # 使用预设配置创建临时测试对象
-        test_config = {
-            'single_choice_score': preset.single_choice_score,
-            'multiple_choice_score': preset.multiple_choice_score,
-            'true_false_score': preset.true_false_score,
-            'fill_blank_score': preset.fill_blank_score,
-            'short_answer_score': preset.short_answer_score
-        }
-    else:
-        # 学生没有选择，使用当前激活的测试
-        current_test = Test.query.filter_by(is_active=True).first()
-        if not current_test:
-            flash('当前没有进行中的测试')
-            return redirect(url_for('student_dashboard'))
-        test_config = current_test
+    # 按抽题时保存的试卷快照评分，不再重新查询题目、测试和预设
+    paper_id = request.form.get('paper_id', type=int) or session.get('paper_id')
+    paper = TestPaper.query.get(paper_id) if paper_id else None
+    if not paper or paper.student_id != session['student_id'] or paper.submitted_at:
+        flash('试卷已失效或已提交，请重新开始测试')
+        return redirect(url_for('student_dashboard'))
+    question_map = paper.question_map()
+    option_orders = paper.option_order_map()
+    test_config = paper.score_config()
+    short_answer_grading_method = paper.short_answer_grading_method or 'manual'
+    fill_blank_grading_method = paper.fill_blank_grading_method or 'manual'
         
     # 获取所有答案
     answers = {}
     fill_blank_questions_ids = set()  # 记录填空题的ID
-    ai_scores = {}  # 存储AI批改的分数，提前初始化避免UnboundLocalError
     
+    # 只接受试卷中的题目
+    answer_keys = []
     for key in request.form:
         if key.startswith('answer_'):
             parts = key.split('_')
-            # 识别填空题的子字段（如 answer_123_1）
-            if len(parts) > 2 and parts[2].isdigit():
-                # 这是填空题的子字段，记录question_id但不处理
-                question_id = int(parts[1])
-                fill_blank_questions_ids.add(question_id)
-                continue
-            if parts[-1] == 'img' and parts[-2] == 'url':
-                continue  # 图片URL字段，跳过
+            if len(parts) > 1 and parts[1].isdigit() and int(parts[1]) in question_map:
+                answer_keys.append((key, parts))
+    
+    for key, parts in answer_keys:
+        # 识别填空题的子字段（如 answer_123_1）
+        if len(parts) > 2 and parts[2].isdigit():
+            # 这是填空题的子字段，记录question_id但不处理
             question_id = int(parts[1])
-            question = Question.query.get(question_id)
-            values = request.form.getlist(key)
-            if question and question.question_type == 'short_answer':
-                # 简答题：直接保存原始内容（可能包含图片标签），不做大写转换
-                answers[question_id] = values[0].strip() if values else ''
-            elif len(values) == 1:
-                answers[question_id] = values[0].strip().upper()
-            else:
-                # 多选题，拼接为逗号分隔的大写字母，顺序统一
-                answers[question_id] = ','.join(sorted([v.strip().upper() for v in values if v.strip()]))
+            fill_blank_questions_ids.add(question_id)
+            continue
+        if parts[-1] == 'img' and parts[-2] == 'url':
+            continue  # 图片URL字段，跳过
+        question_id = int(parts[1])
+        question = question_map.get(question_id)
+        values = request.form.getlist(key)
+        if question_id in option_orders:
+            # 选项已打乱：把学生选择的位置还原为原选项
+            values = [restore_option(v.strip(), option_orders[question_id]) for v in values]
+        if question and question.question_type == 'short_answer':
+            # 简答题：直接保存原始内容（可能包含图片标签），不做大写转换
+            answers[question_id] = values[0].strip() if values else ''
+        elif len(values) == 1:
+            answers[question_id] = values[0].strip().upper()
+        else:
+            # 多选题，拼接为逗号分隔的大写字母，顺序统一
+            answers[question_id] = ','.join(sorted([v.strip().upper() for v in values if v.strip()]))
     
     # 处理填空题：从request.form中收集填空题答案
     for question_id in fill_blank_questions_ids:
@@ -551,68 +1608,25 @@ def submit_test():
         else:
             answers[question_id] = ''  # 即使没有答案也要记录，以便显示
     
-    # 计算得分
-    total_score = 0
-    for question_id, answer in answers.items():
-        question = Question.query.get(question_id)
-        if not question:
-            continue
-        if question.question_type == 'single_choice':
-            if answer == question.correct_answer:
-                # 处理test_config可能是字典或对象的情况
-                score = test_config.get('single_choice_score') if isinstance(test_config, dict) else test_config.single_choice_score
-                total_score += score or 0
-        elif question.question_type == 'multiple_choice':
-            def normalize(ans):
-                return ''.join(sorted([c for c in ans.replace(',', '').replace(' ', '').upper() if c in 'ABCDE']))
-            is_correct = normalize(answer) == normalize(question.correct_answer)
-            if is_correct:
-                score = test_config.get('multiple_choice_score') if isinstance(test_config, dict) else test_config.multiple_choice_score
-                total_score += score or 0
-        elif question.question_type == 'true_false':
-            if answer == question.correct_answer:
-                score = test_config.get('true_false_score') if isinstance(test_config, dict) else test_config.true_false_score
-                total_score += score or 0
-        elif question.question_type == 'fill_blank':
-            # 检查是否已经通过AI批改计算了分数
-            if question_id in ai_scores:
-                # AI批改的填空题，分数已经在AI批改时计算，跳过传统计算
-                continue
-            
-            # 处理填空题多个答案（仅用于非AI批改的情况）
-            # 统一处理分隔符：支持顿号（、）和逗号（,）
-            def split_fill_answers(text):
-                """分割答案，支持顿号和逗号"""
-                # 先统一替换为顿号
-                text = text.replace(',', '、')
-                return [f.strip().lower() for f in text.split('、') if f.strip()]
-            
-            correct_fill_ins = split_fill_answers(question.correct_answer)
-            student_fill_ins = split_fill_answers(answer)
-            num_fill_ins = len(correct_fill_ins)
-            
-            if num_fill_ins > 0:
-                score = test_config.get('fill_blank_score') if isinstance(test_config, dict) else test_config.fill_blank_score
-                score_per_fill_in = round((score or 0) / num_fill_ins, 1)
-                fill_blank_score = 0
-                
-                # 比较每个填空
-                for i in range(min(len(student_fill_ins), num_fill_ins)):
-                    if student_fill_ins[i] == correct_fill_ins[i]:
-                        fill_blank_score += score_per_fill_in
-                
-                # 对填空题分数进行四舍五入
-                fill_blank_score = round(fill_blank_score)
-                total_score += fill_blank_score
-        elif question.question_type == 'short_answer':
-            # 检查是否已经通过AI批改计算了分数
-            if question_id in ai_scores:
-                # AI批改的简答题，分数已经在AI批改时计算，跳过传统计算
+    # 需要AI批改的题目：提交时只登记为待批改，由后台批改队列异步完成
+    ai_question_ids = set()
+    if get_ai_grading_service().is_enabled():
+        for question_id in answers:
+            question = question_map.get(question_id)
+            if not question:
                 continue
-                
+            if question.question_type == 'short_answer' and short_answer_grading_method == 'ai':
+                ai_question_ids.add(question_id)
+            elif question.question_type == 'fill_blank' and fill_blank_grading_method == 'ai':
+                ai_question_ids.add(question_id)
+    
+    # 简答题答案清理：限制字数和图片数量
+    for question_id in answers:
+        question = question_map.get(question_id)
+        if question and question.question_type == 'short_answer':
             # 简答题答案可能包含HTML标签（图片等），直接获取原始内容
             student_answer = request.form.get(f'answer_{question_id}', '').strip()
-            
+        
             # 限制字数：移除HTML标签后不超过200字
             import re
             text_only = re.sub(r'<[^>]*>', '', student_answer)
@@ -632,285 +1646,76 @@ def submit_test():
                     # 移除所有图片，只保留最后一张
                     text_without_imgs = re.sub(r'<img[^>]*>', '', student_answer)
                     student_answer = text_without_imgs + img_tags[-1]
-            
+        
             # 将简答题数据添加到answers字典中（不进行大小写转换）
             answers[question_id] = student_answer
-    # 题目循环结束后，只插入一次TestResult
+    
+    # 计算得分（AI批改的题目由后台批改队列计入总分）
+    objective_answers = {qid: ans for qid, ans in answers.items() if qid not in ai_question_ids}
+    total_score, score_details = score_answers(objective_answers, question_map, test_config)
+    
     ip_addr = request.headers.get('X-Forwarded-For', request.remote_addr)
     
-    # 确定test_id
-    if selected_preset_id:
-        # 使用预设时，需要创建一个特殊的测试记录
-        preset = TestPreset.query.get(selected_preset_id)
-        if preset:
-            try:
-                # 创建一个临时的测试记录用于关联
-                temp_test = Test(
-                    title=f"预设测试: {preset.title}",
-                    single_choice_count=preset.single_choice_count or 0,
-                    multiple_choice_count=preset.multiple_choice_count or 0,
-                    true_false_count=preset.true_false_count or 0,
-                    fill_blank_count=preset.fill_blank_count or 0,
-                    short_answer_count=preset.short_answer_count or 0,
-                    single_choice_score=preset.single_choice_score or 0,
-                    multiple_choice_score=preset.multiple_choice_score or 0,
-                    true_false_score=preset.true_false_score or 0,
-                    fill_blank_score=preset.fill_blank_score or 0,
-                    short_answer_score=preset.short_answer_score or 0,
-                    total_score=((preset.single_choice_count or 0) * (preset.single_choice_score or 0) +
-                               (preset.multiple_choice_count or 0) * (preset.multiple_choice_score or 0) +
-                               (preset.true_false_count or 0) * (preset.true_false_score or 0) +
-                               (preset.fill_blank_count or 0) * (preset.fill_blank_score or 0) +
-                               (preset.short_answer_count or 0) * (preset.short_answer_score or 0)),
-                    single_choice_bank_id=preset.single_choice_bank_id,
-                    multiple_choice_bank_id=preset.multiple_choice_bank_id,
-                    true_false_bank_id=preset.true_false_bank_id,
-                    fill_blank_bank_id=preset.fill_blank_bank_id,
-                    short_answer_bank_id=preset.short_answer_bank_id,
-                    is_active=False  # 标记为非活跃，避免影响正常测试
-                )
-                db.session.add(temp_test)
-                db.session.flush()  # 获取ID但不提交
-                test_id = temp_test.id
-            except Exception as e:
-                # 如果创建临时测试失败，记录错误并重定向
-                print(f"创建临时测试失败: {e}")
-                flash('创建测试记录失败，请重试')
-                return redirect(url_for('student_start'))
-        else:
-            flash('选择的测试内容不存在')
-            return redirect(url_for('student_start'))
-    else:
-        # 使用默认测试时，test_id为当前测试的ID
-        if isinstance(test_config, dict):
-            # 如果是字典格式，需要从数据库重新获取Test对象
-            current_test = Test.query.filter_by(is_active=True).first()
-            if not current_test:
-                current_test = Test.query.order_by(Test.created_at.desc()).first()
-            test_id = current_test.id if current_test else None
-        else:
-            # 如果是对象格式，直接获取ID
-            test_id = test_config.id
+    # 抽题时已确定关联的测试（使用预设时为该预设版本唯一的测试记录）
+    test_id = paper.test_id
     
     # 确保test_id不为None
     if test_id is None:
         flash('无法获取测试ID，请重试')
         return redirect(url_for('student_start'))
     
-    # 获取批改方式配置
-    short_answer_grading_method = 'manual'  # 默认人工批改
-    fill_blank_grading_method = 'manual'  # 默认人工批改
-    if selected_preset_id:
-        preset = TestPreset.query.get(selected_preset_id)
-        if preset:
-            short_answer_grading_method = preset.short_answer_grading_method or 'manual'
-            fill_blank_grading_method = preset.fill_blank_grading_method or 'manual'
-    else:
-        current_test = Test.query.filter_by(is_active=True).first()
-        if current_test:
-            short_answer_grading_method = current_test.short_answer_grading_method or 'manual'
-            fill_blank_grading_method = current_test.fill_blank_grading_method or 'manual'
-    
-    # 准备AI批改服务
-    ai_service = get_ai_grading_service()
+    # 整理提交数据，交给提交写入器与其他请求合并写入
+    records = []
+    for question_id, answer in answers.items():
+        question = question_map.get(question_id)
+        if not question or question.question_type not in ('short_answer', 'fill_blank'):
+            continue
+        records.append({
+            'question_id': question_id,
+            'question_type': question.question_type,
+            'answer': answer,
+            'grading_method': (short_answer_grading_method if question.question_type == 'short_answer'
+                               else fill_blank_grading_method),
+            'pending_ai': question_id in ai_question_ids,
+            # 简答题由教师或AI评分，填空题自动评分的结果直接保存
+            'score': score_details[question_id][0] if question.question_type == 'fill_blank'
+                     and question_id not in ai_question_ids else None
+        })
+    jobs = [{
+        'question_id': question_id,
+        'question_type': question_map[question_id].question_type,
+        'max_score': points_for(test_config, question_map[question_id].question_type)
+    } for question_id in ai_question_ids]
     
-    # 先进行AI批改（在数据库事务外）
-    if ai_service.is_enabled():
-        for question_id, answer in answers.items():
-            question = Question.query.get(question_id)
-            # 检查是否需要AI批改
-            should_ai_grade = False
-            if question.question_type == 'short_answer' and short_answer_grading_method == 'ai':
-                should_ai_grade = True
-            elif question.question_type == 'fill_blank' and fill_blank_grading_method == 'ai':
-                should_ai_grade = True
-            
-            if question and should_ai_grade:
-                try:
-                    # 获取题目分值（严格按照教师面板设置）
-                    question_score = 0
-                    if question.question_type == 'short_answer':
-                        if isinstance(test_config, dict):
-                            question_score = test_config.get('short_answer_score', 0)
-                        else:
-                            question_score = test_config.short_answer_score or 0
-                    elif question.question_type == 'fill_blank':
-                        if isinstance(test_config, dict):
-                            question_score = test_config.get('fill_blank_score', 0)
-                        else:
-                            question_score = test_config.fill_blank_score or 0
-                    
-                    # 注意：不再使用题目本身的分值，严格按照教师面板设置计算
-                    
-                    # 调用AI批改服务
-                    success, ai_result = ai_service.grade_answer(
-                        question=question.content,
-                        reference_answer=question.correct_answer,
-                        student_answer=answer,
-                        max_score=question_score,
-                        question_type=question.question_type
-                    )
-                    
-                    if success:
-                        # 确保AI给出的分数不超过教师设置的分值
-                        actual_score = min(ai_result['score'], question_score)
-                        if actual_score != ai_result['score']:
-                            logger.warning(f"AI给出的分数({ai_result['score']})超过设定分值({question_score})，已调整为{actual_score}")
-                        
-                        ai_scores[question_id] = {
-                            'score': actual_score,
-                            'feedback': ai_result['feedback'],
-                            'success': True
-                        }
-                        # 将调整后的AI评分加入总分
-                        total_score += actual_score
-                        logger.info(f"AI批改成功 - 题目ID: {question_id}, 得分: {actual_score}/{question_score}")
-                    else:
-                        ai_scores[question_id] = {
-                            'score': 0,
-                            'feedback': f"AI批改失败: {ai_result.get('error_message', '未知错误')}",
-                            'success': False
-                        }
-                        logger.error(f"AI批改失败 - 题目ID: {question_id}, 错误: {ai_result.get('error_message')}")
-                        
-                except Exception as e:
-                    ai_scores[question_id] = {
-                        'score': 0,
-                        'feedback': f"AI批改异常: {str(e)}",
-                        'success': False
-                    }
-                    logger.error(f"AI批改异常 - 题目ID: {question_id}, 异常: {str(e)}")
-    
-    # 使用单个事务保存所有数据
     try:
-        # 对总分进行四舍五入，不保留小数
-        final_score = round(total_score)
-        
-        # 创建测试结果记录
-        result = TestResult(
-            student_id=session['student_id'],
-            student_name=session.get('student_name', ''),
-            class_number=session.get('class_number', ''),
-            test_id=test_id,
-            score=final_score,
-            answers=json.dumps(answers),
-            ip_address=ip_addr
-        )
-        db.session.add(result)
-        db.session.flush()  # 获取result.id但不提交
-        
-        # 创建简答题和填空题提交记录
-        for question_id, answer in answers.items():
-            question = Question.query.get(question_id)
-            if question and question.question_type == 'short_answer':
-                sa = ShortAnswerSubmission(
-                    result_id=result.id,
-                    question_id=question_id,
-                    student_answer=answer,
-                    image_path=None,
-                    grading_method=short_answer_grading_method
-                )
-                
-                # 如果有AI批改结果，使用它
-                if question_id in ai_scores:
-                    ai_result = ai_scores[question_id]
-                    sa.score = ai_result['score']
-                    sa.comment = ai_result['feedback']
-                    sa.graded_bool = True
-                    
-                    if ai_result['success']:
-                        sa.ai_original_score = ai_result['score']
-                        sa.ai_feedback = ai_result['feedback']
-                
-                db.session.add(sa)
-            elif question and question.question_type == 'fill_blank':
-                fb = FillBlankSubmission(
-                    result_id=result.id,
-                    question_id=question_id,
-                    student_answer=answer,
-                    grading_method=fill_blank_grading_method
-                )
-                
-                # 如果有AI批改结果，使用它
-                if question_id in ai_scores:
-                    ai_result = ai_scores[question_id]
-                    fb.score = ai_result['score']
-                    fb.comment = ai_result['feedback']
-                    fb.graded_bool = True
-                    
-                    if ai_result['success']:
-                        fb.ai_original_score = ai_result['score']
-                        fb.ai_feedback = ai_result['feedback']
-                        # 如果有简短理由，将其保存到comment字段的开头
-                        if 'short_reason' in ai_result and ai_result['short_reason']:
-                            short_reason = ai_result['short_reason'].strip()
-                            if short_reason:
-                                fb.comment = f"扣分理由：{short_reason}。{ai_result['feedback']}"
-                else:
-                    # 如果没有AI批改，使用传统的填空题评分逻辑
-                    # 这里需要计算填空题的分数
-                    def split_fill_answers(text):
-                        """分割答案，支持顿号和逗号"""
-                        text = text.replace(',', '、')
-                        return [f.strip().lower() for f in text.split('、') if f.strip()]
-                    
-                    correct_fill_ins = split_fill_answers(question.correct_answer)
-                    student_fill_ins = split_fill_answers(answer)
-                    num_fill_ins = len(correct_fill_ins)
-                    
-                    if num_fill_ins > 0:
-                        if isinstance(test_config, dict):
-                            total_fill_score = test_config.get('fill_blank_score', 0)
-                        else:
-                            total_fill_score = test_config.fill_blank_score or 0
-                        
-                        score_per_fill_in = round((total_fill_score or 0) / num_fill_ins, 1)
-                        fill_blank_score = 0
-                        
-                        # 比较每个填空
-                        for i in range(min(len(student_fill_ins), num_fill_ins)):
-                            if student_fill_ins[i] == correct_fill_ins[i]:
-                                fill_blank_score += score_per_fill_in
-                        
-                        fb.score = round(fill_blank_score)
-                        fb.graded_bool = True
-                
-                db.session.add(fb)
-        
-        # 一次性提交所有更改
-        db.session.commit()
+        submission_writer.write(save_submission, {
+            'student_id': session['student_id'],
+            'student_name': session.get('student_name', ''),
+            'class_number': session.get('class_number', ''),
+            'test_id': test_id,
+            'paper_id': paper.id,
+            'score': round(total_score),  # 对总分进行四舍五入，不保留小数
+            'answers': answers,
+            'ip_address': ip_addr,
+            'records': records,
+            'jobs': jobs
+        })
         logger.info(f"测试提交成功 - 学生: {session.get('student_name')}, 总分: {total_score}")
-        
+        # 写入器确认保存后才清除种子，下次进入测试抽取新试卷
+        session.pop('paper_attempt', None)
+    
+    except FutureTimeoutError:
+        # 写入仍可能完成，保留种子：保存完成后 /test 发现试卷已提交会自动抽取新试卷
+        logger.error(f"提交写入超时 - 学生: {session.get('student_name')}")
+        flash('提交处理较慢，请稍后在个人中心查看成绩')
+        return redirect(url_for('student_dashboard'))
     except Exception as e:
-        db.session.rollback()
         logger.error(f"数据库保存失败: {str(e)}")
         flash('提交失败，请重试')
         return redirect(url_for('test'))
 
-    # 统计历史
-    all_results = TestResult.query.filter_by(student_id=session['student_id']).all()
-    test_count = len(all_results)
-    total_score_sum = sum(r.score for r in all_results)
-    average_score = round(total_score_sum / test_count) if test_count > 0 else 0
-    highest_score = max((r.score for r in all_results), default=0)
-    lowest_score = min((r.score for r in all_results), default=0)
-
-    history = StudentTestHistory.query.filter_by(student_id=session['student_id']).first()
-    if not history:
-        history = StudentTestHistory(
-            student_id=session['student_id'],
-            student_name=session.get('student_name', ''),
-            class_number=session.get('class_number', ''),
-        )
-        db.session.add(history)
-
-    history.test_count = test_count
-    history.total_score = total_score_sum
-    history.average_score = average_score
-    history.highest_score = highest_score
-    history.lowest_score = lowest_score
-
-    db.session.commit()
+    if ai_question_ids:
+        grading_job_queue.notify()
         
     flash('测试提交成功！')
     
@@ -963,10 +1768,9 @@ def test_statistics():
         return redirect(url_for('teacher_login'))
     # 获取所有考试及人次
     tests = Test.query.order_by(Test.created_at.desc()).all()
-    data = []
-    for t in tests:
-        cnt = TestResult.query.filter_by(test_id=t.id).count()
-        data.append({'test': t, 'count': cnt})
+    counts = dict(db.session.query(TestResult.test_id, func.count(TestResult.id))
+                  .group_by(TestResult.test_id).all())
+    data = [{'test': t, 'count': counts.get(t.id, 0)} for t in tests]
     return render_template('test_statistics.html', tests=data) 
 
 @app.route('/test_statistics/<int:test_id>')
@@ -1020,32 +1824,18 @@ def get_test_statistics(test_id):
     class_students = dict(sorted(class_students.items(), key=lambda x: x[0]))
     # 统计每道题的错误率
     question_stats = defaultdict(lambda: {'total': 0, 'wrong': 0, 'content': '', 'question_type': '', 'correct_answer': ''})
-    for result in results:
-        answers = json.loads(result.answers)
-        for qid_str, stu_ans in answers.items():
-            qid = int(qid_str)
-            question = Question.query.get(qid)
-            if not question:
-                continue
+    parsed_answers = [json.loads(result.answers) for result in results]
+    question_map = load_questions_by_ids({qid for answers in parsed_answers for qid in answers})
+    for answers in parsed_answers:
+        # 判定正误（与 test_result 使用同一评分引擎）
+        _, score_details = score_answers(answers, question_map, {})
+        for qid, (_, is_correct) in score_details.items():
+            question = question_map[qid]
             question_stats[qid]['total'] += 1
             question_stats[qid]['content'] = question.content
             question_stats[qid]['question_type'] = question.question_type
             question_stats[qid]['correct_answer'] = question.correct_answer
-            # 判定正误（与 test_result 逻辑一致）
-            is_wrong = False
-            if question.question_type == 'single_choice':
-                is_wrong = stu_ans != question.correct_answer
-            elif question.question_type == 'multiple_choice':
-                def normalize(ans):
-                    return ''.join(sorted([c for c in ans.replace(',', '').replace(' ', '').upper() if c in 'ABCDE']))
-                is_wrong = normalize(stu_ans) != normalize(question.correct_answer)
-            elif question.question_type == 'true_false':
-                is_wrong = stu_ans != question.correct_answer
-            elif question.question_type == 'fill_blank':
-                def norm_fill(s):
-                    parts = [p.strip().lower() for p in s.replace('、', ',').split(',') if p.strip()]
-                    return ','.join(parts)
-                is_wrong = norm_fill(stu_ans) != norm_fill(question.correct_answer)
+            is_wrong = is_correct is False
             # 简答题暂不统计
             if is_wrong:
                 question_stats[qid]['wrong'] += 1
@@ -1054,7 +1844,7 @@ def get_test_statistics(test_id):
     for qid, stat in question_stats.items():
         if stat['total'] > 0:
             error_rate = stat['wrong'] / stat['total']
-            question = Question.query.get(qid) # 重新获取question对象以访问选项
+            question = question_map.get(qid)
             if question:
                 q_data = {
                     'id': qid,
@@ -1087,13 +1877,20 @@ def delete_test(test_id):
     try:
         # 删除测试相关的所有数据
         # 1. 删除简答题提交记录
-        TestResult.query.filter_by(test_id=test_id).all()
+        affected_students = set()
         for result in TestResult.query.filter_by(test_id=test_id).all():
             ShortAnswerSubmission.query.filter_by(result_id=result.id).delete()
+            GradingJob.query.filter_by(result_id=result.id).delete()
+            affected_students.add(result.student_id)
         
         # 2. 删除测试结果
         TestResult.query.filter_by(test_id=test_id).delete()
         
+        # 删除成绩后重建相关学生的历史统计
+        for student_id in affected_students:
+            if student_id is not None:
+                refresh_student_history(student_id)
+        
         # 3. 删除测试配置
         test = Test.query.get(test_id)
         if test:
@@ -1130,6 +1927,11 @@ def test_result(result_id):
         flash('无权访问此测试结果')
         return redirect(url_for('student_start'))
     
+    # 两阶段批改：有尚未生成的AI评语时交给批改队列在后台生成，页面不等待AI接口
+    if (AI_GRADING_CONFIG.get('two_phase_grading', False) and get_ai_grading_service().is_enabled()
+            and pending_feedback_submissions(result_id=result.id, limit=1)):
+        request_ai_feedback(result.id)
+    
     # 获取测试信息
     test = Test.query.get(result.test_id)
     
@@ -1149,77 +1951,37 @@ def test_result(result_id):
             student_id=session['student_id']
         ).first()
     
-    # 获取题目详情
+    # 获取题目详情（题目和批改记录各一次查询）
     questions = []
     answers = json.loads(result.answers)
+    question_map = load_questions_by_ids(answers.keys())
+    short_submissions = {s.question_id: s for s in ShortAnswerSubmission.query.filter_by(result_id=result.id)}
+    fill_blank_submissions = {s.question_id: s for s in FillBlankSubmission.query.filter_by(result_id=result.id)}
+    
+    # 已有批改记录的题目使用记录中的分数，其余题目由评分引擎计算
+    graded_scores = {qid: s.score for qid, s in short_submissions.items()}
+    graded_scores.update({qid: s.score or 0 for qid, s in fill_blank_submissions.items()})
+    _, score_details = score_answers(answers, question_map, test, graded_scores)
     
     for question_id, answer in answers.items():
-        question = Question.query.get(int(question_id))
+        question = question_map.get(int(question_id))
         if question:
-            is_correct = None  # 默认为None，简答题不判断对错
-            score = 0
+            score, is_correct = score_details[question.id]
             comment = None
+            submission = None
+            fill_blank_submission = None
             
-            if question.question_type == 'single_choice':
-                is_correct = answer == question.correct_answer
-                score = test.single_choice_score if is_correct else 0
-            elif question.question_type == 'multiple_choice':
-                def normalize(ans):
-                    return ''.join(sorted([c for c in ans.replace(',', '').replace(' ', '').upper() if c in 'ABCDE']))
-                is_correct = normalize(answer) == normalize(question.correct_answer)
-                score = test.multiple_choice_score if is_correct else 0
-            elif question.question_type == 'true_false':
-                is_correct = answer == question.correct_answer
-                score = test.true_false_score if is_correct else 0
-            elif question.question_type == 'fill_blank':
-                # 首先尝试从FillBlankSubmission表中获取评分信息
-                fill_blank_submission = FillBlankSubmission.query.filter_by(
-                    result_id=result.id,
-                    question_id=question.id
-                ).first()
-                
+            if question.question_type == 'fill_blank':
+                fill_blank_submission = fill_blank_submissions.get(question.id)
                 if fill_blank_submission:
-                    # 如果有提交记录，使用记录中的分数
-                    score = fill_blank_submission.score or 0
                     comment = fill_blank_submission.comment
-                    is_correct = (score == test.fill_blank_score)
-                else:
-                    # 如果没有提交记录，使用传统的填空题评分逻辑
-                    # 统一处理分隔符：支持顿号（、）和逗号（,）
-                    def split_answers(text):
-                        """分割答案，支持顿号和逗号"""
-                        # 先统一替换为顿号
-                        text = text.replace(',', '、')
-                        return [f.strip().lower() for f in text.split('、') if f.strip()]
-                    
-                    correct_fill_ins = split_answers(question.correct_answer)
-                    student_fill_ins = split_answers(answer)
-                    num_fill_ins = len(correct_fill_ins)
-                    
-                    if num_fill_ins > 0:
-                        score_per_fill_in = round(test.fill_blank_score / num_fill_ins, 1)
-                        score = 0
-                        
-                        # 比较每个填空
-                        for i in range(min(len(student_fill_ins), num_fill_ins)):
-                            if student_fill_ins[i] == correct_fill_ins[i]:
-                                score += score_per_fill_in
-                        
-                        # 判断是否全对
-                        is_correct = (score == test.fill_blank_score)
-                    else:
-                        score = 0
-                        is_correct = False
             elif question.question_type == 'short_answer':
                 # 简答题不判断对错，保持is_correct为None
-                # 从ShortAnswerSubmission表中获取评分和评语
-                submission = ShortAnswerSubmission.query.filter_by(
-                    result_id=result.id,
-                    question_id=question.id
-                ).first()
+                submission = short_submissions.get(question.id)
                 if submission:
-                    score = submission.score
                     comment = submission.comment
+                else:
+                    score = 0
             
             # 为简答题和填空题添加AI批改相关信息
             grading_method = None
@@ -1280,92 +2042,12 @@ def grade_short_answer_by_result():
     comment = request.form.get('comment')
     test_id = request.form.get('test_id')
     
+    result = TestResult.query.get_or_404(result_id)
     try:
-        # 更新简答题评分
-        submission = ShortAnswerSubmission.query.filter_by(
-            result_id=result_id,
-            question_id=question_id
-        ).first()
-        
-        if not submission:
-            # 如果没有找到记录，创建一个新的
-            submission = ShortAnswerSubmission(
-                result_id=result_id,
-                question_id=question_id,
-                student_answer='',  # 这里不需要学生答案，因为已经在answers字段中
-                score=score,
-                comment=comment,
-                graded_bool=True
-            )
-            db.session.add(submission)
-        else:
-            submission.score = score
-            submission.comment = comment
-            submission.graded_bool = True
-            # 如果是AI批改的题目，标记为已人工复核
-            if submission.grading_method == 'ai':
-                submission.manual_reviewed = True
-        
-        # 重新计算测试结果的总分
-        result = TestResult.query.get(result_id)
-        test = Test.query.get(result.test_id)
-        answers = json.loads(result.answers)
-        
-        total_score = 0
-        for qid_str, answer in answers.items():
-            qid = int(qid_str)
-            question = Question.query.get(qid)
-            if not question:
-                continue
-            
-            if question.question_type == 'single_choice':
-                if answer == question.correct_answer:
-                    total_score += test.single_choice_score
-            elif question.question_type == 'multiple_choice':
-                def normalize(ans):
-                    return ''.join(sorted([c for c in ans.replace(',', '').replace(' ', '').upper() if c in 'ABCDE']))
-                if normalize(answer) == normalize(question.correct_answer):
-                    total_score += test.multiple_choice_score
-            elif question.question_type == 'true_false':
-                if answer == question.correct_answer:
-                    total_score += test.true_false_score
-            elif question.question_type == 'fill_blank':
-                def norm_fill(s):
-                    parts = [p.strip().lower() for p in s.replace('、', ',').split(',') if p.strip()]
-                    return ','.join(parts)
-                if norm_fill(answer) == norm_fill(question.correct_answer):
-                    total_score += test.fill_blank_score
-            elif question.question_type == 'short_answer':
-                # 从ShortAnswerSubmission表中获取评分
-                sa_submission = ShortAnswerSubmission.query.filter_by(
-                    result_id=result_id,
-                    question_id=qid
-                ).first()
-                if sa_submission and sa_submission.score is not None:
-                    total_score += sa_submission.score
-        
-        # 更新测试结果的总分（四舍五入）
-        result.score = round(total_score)
+        # 更新简答题评分，按分差更新测试总分
+        save_manual_grade(ShortAnswerSubmission, result, question_id, score, comment)
         db.session.commit()
         
-        # 更新学生历史记录
-        student_id = result.student_id
-        all_results = TestResult.query.filter_by(student_id=student_id).all()
-        test_count = len(all_results)
-        total_score_sum = sum(r.score for r in all_results)
-        average_score = round(total_score_sum / test_count) if test_count > 0 else 0
-        highest_score = max((r.score for r in all_results), default=0)
-        lowest_score = min((r.score for r in all_results), default=0)
-        
-        history = StudentTestHistory.query.filter_by(student_id=student_id).first()
-        if history:
-            history.test_count = test_count
-            history.total_score = total_score_sum
-            history.average_score = average_score
-            history.highest_score = highest_score
-            history.lowest_score = lowest_score
-            db.session.commit()
-        
         # flash('评分成功')  # 移除成功提示
     except Exception as e:
         db.session.rollback()
@@ -1383,107 +2065,38 @@ def grade_fill_blank(question_id, result_id):
     score = int(request.form.get('score'))
     comment = request.form.get('comment')
     
+    result = TestResult.query.get_or_404(result_id)
     try:
-        # 更新填空题评分
-        submission = FillBlankSubmission.query.filter_by(
-            result_id=result_id,
-            question_id=question_id
-        ).first()
-        
-        if not submission:
-            # 如果没有找到记录，创建一个新的
-            submission = FillBlankSubmission(
-                result_id=result_id,
-                question_id=question_id,
-                student_answer='',  # 这里不需要学生答案，因为已经在answers字段中
-                score=score,
-                comment=comment,
-                graded_bool=True
-            )
-            db.session.add(submission)
-        else:
-            submission.score = score
-            submission.comment = comment
-            submission.graded_bool = True
-            # 如果是AI批改的题目，标记为已人工复核
-            if submission.grading_method == 'ai':
-                submission.manual_reviewed = True
-        
-        # 重新计算测试结果的总分
-        result = TestResult.query.get(result_id)
-        test = Test.query.get(result.test_id)
-        answers = json.loads(result.answers)
-        
-        total_score = 0
-        for qid_str, answer in answers.items():
-            qid = int(qid_str)
-            question = Question.query.get(qid)
-            if not question:
-                continue
-            
-            if question.question_type == 'single_choice':
-                if answer == question.correct_answer:
-                    total_score += test.single_choice_score
-            elif question.question_type == 'multiple_choice':
-                def normalize(ans):
-                    return ''.join(sorted([c for c in ans.replace(',', '').replace(' ', '').upper() if c in 'ABCDE']))
-                if normalize(answer) == normalize(question.correct_answer):
-                    total_score += test.multiple_choice_score
-            elif question.question_type == 'true_false':
-                if answer == question.correct_answer:
-                    total_score += test.true_false_score
-            elif question.question_type == 'fill_blank':
-                # 从FillBlankSubmission表中获取评分
-                fb_submission = FillBlankSubmission.query.filter_by(
-                    result_id=result_id,
-                    question_id=qid
-                ).first()
-                if fb_submission and fb_submission.score is not None:
-                    total_score += fb_submission.score
-                else:
-                    # 如果没有提交记录，使用传统评分
-                    def norm_fill(s):
-                        parts = [p.strip().lower() for p in s.replace('、', ',').split(',') if p.strip()]
-                        return ','.join(parts)
-                    if norm_fill(answer) == norm_fill(question.correct_answer):
-                        total_score += test.fill_blank_score
-            elif question.question_type == 'short_answer':
-                # 从ShortAnswerSubmission表中获取评分
-                sa_submission = ShortAnswerSubmission.query.filter_by(
-                    result_id=result_id,
-                    question_id=qid
-                ).first()
-                if sa_submission and sa_submission.score is not None:
-                    total_score += sa_submission.score
-        
-        # 更新测试结果的总分（四舍五入）
-        result.score = round(total_score)
+        # 更新填空题评分，按分差更新测试总分
+        save_manual_grade(FillBlankSubmission, result, question_id, score, comment)
         db.session.commit()
         
-        # 更新学生历史记录
-        student_id = result.student_id
-        all_results = TestResult.query.filter_by(student_id=student_id).all()
-        test_count = len(all_results)
-        total_score_sum = sum(r.score for r in all_results)
-        average_score = round(total_score_sum / test_count) if test_count > 0 else 0
-        highest_score = max((r.score for r in all_results), default=0)
-        lowest_score = min((r.score for r in all_results), default=0)
-        
-        history = StudentTestHistory.query.filter_by(student_id=student_id).first()
-        if history:
-            history.test_count = test_count
-            history.total_score = total_score_sum
-            history.average_score = average_score
-            history.highest_score = highest_score
-            history.lowest_score = lowest_score
-            db.session.commit()
-        
     except Exception as e:
         db.session.rollback()
         flash(f'评分失败：{str(e)}')
     
     return redirect(url_for('test_result', result_id=result_id))
 
+@app.route('/rescore_result/<int:result_id>', methods=['POST'])
+def rescore_test_result(result_id):
+    """按全部答案重新计算测试总分（仅在教师明确要求时执行）"""
+    if 'role' not in session or session['role'] != 'teacher':
+        flash('未授权')
+        return redirect(url_for('teacher_login'))
+    
+    result = TestResult.query.get_or_404(result_id)
+    try:
+        old_total = result.score
+        result.score = round(rescore_result(result))
+        record_history_score(result.student_id, result.score, old_total,
+                             result.student_name, result.class_number)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        flash(f'重新计算总分失败：{str(e)}')
+    
+    return redirect(url_for('test_result', result_id=result_id))
+
 @app.route('/import_questions/<question_type>', methods=['POST'])
 def import_questions(question_type):
     """
@@ -2127,8 +2740,9 @@ def manage_bank_questions(bank_id):
             data = request.get_json()
             questions_data = data.get('questions', [])
             
-            # 删除现有题目
+            # 删除现有题目（批量删除不经过会话的变更记录，需要单独登记题库）
             Question.query.filter_by(bank_id=bank_id).delete()
+            db.session.info.setdefault('changed_bank_ids', set()).add(bank_id)
             
             # 添加新题目
             for q_data in questions_data:
@@ -2220,6 +2834,11 @@ def save_test_settings():
         if fill_blank_grading_method == 'ai' and not ai_service.is_enabled():
             fill_blank_grading_method = 'manual'
             warnings.append('填空题AI批改功能不可用，已自动切换为人工批改')
+        if 'ai' in (short_answer_grading_method, fill_blank_grading_method):
+            # 只读取后台健康检查的结论，不在保存设置时等待AI接口
+            health = ai_service.get_health_status()
+            if health['verdict'] == 'down':
+                warnings.append(f"AI接口当前无法访问（{health['message']}），接口恢复前AI批改的题目将转为人工批改")
         
         # 总是保存为预设，使用测试标题作为预设名
         save_as_preset = True
@@ -2403,6 +3022,7 @@ def save_test_settings():
         )
         db.session.add(test)
         db.session.commit()
+        paper_pool.invalidate()
         
         response_data = {
             'success': True,
@@ -2493,6 +3113,7 @@ def delete_test_preset(preset_id):
     preset = TestPreset.query.get_or_404(preset_id)
     db.session.delete(preset)
     db.session.commit()
+    paper_pool.invalidate()
     
     return jsonify({'success': True, 'message': '预设删除成功'})
 
@@ -2558,15 +3179,32 @@ def change_password():
 
 @app.route('/api/ai_grading_status')
 def get_ai_grading_status():
-    """获取AI批改功能状态"""
+    """获取AI批改功能状态（连接、缓存、限流和批改队列等内部统计仅教师可见）"""
     ai_service = get_ai_grading_service()
     enabled, config_message = ai_service.get_config_status()
     
     if enabled:
+        if 'role' not in session or session['role'] != 'teacher':
+            return jsonify({
+                'enabled': True,
+                'message': 'AI批改功能已正确配置',
+                'details': config_message
+            })
         return jsonify({
             'enabled': True,
             'message': 'AI批改功能已正确配置',
-            'details': config_message
+            'details': config_message,
+            'connections': ai_service.get_connection_stats(),
+            'result_cache': ai_service.get_result_cache_stats(),
+            'fill_blank_precheck': ai_service.get_precheck_stats(),
+            'batch_grading': ai_service.get_batch_stats(),
+            'async_requests': ai_service.get_async_stats(),
+            'rate_limit': ai_service.get_rate_limit_stats(),
+            'circuit_breaker': ai_service.get_circuit_stats(),
+            'health': ai_service.get_health_status(),
+            'two_phase_grading': AI_GRADING_CONFIG.get('two_phase_grading', False),
+            'pending_feedback': count_pending_feedback(),
+            'pending_jobs': grading_job_queue.pending_count()
         })
     else:
         return jsonify({
@@ -2576,6 +3214,20 @@ def get_ai_grading_status():
             'suggestion': '请检查config.py中的AI_GRADING_CONFIG配置'
         })
 
+@app.route('/api/paper_pool_status')
+def get_paper_pool_status():
+    """获取试卷池、题目ID索引和题目片段缓存的状态"""
+    if 'role' not in session or session['role'] != 'teacher':
+        return jsonify({'success': False, 'message': '未授权'}), 403
+    
+    return jsonify({
+        'success': True,
+        'paper_pool': paper_pool.stats(),
+        'question_index': question_id_index.stats(),
+        'question_fragments': question_fragment_cache.stats(),
+        'seeded_papers': seeded_paper_cache.stats()
+    })
+
 @app.route('/logout')
 def logout():
     session.clear()
@@ -2583,4 +3235,5 @@ def logout():
 
 if __name__ == '__main__':
     init_db()
+    start_grading_workers()
     app.run(debug=True, host='0.0.0.0', port=8000)
\ No newline at end of file
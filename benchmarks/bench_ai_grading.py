@@ -0,0 +1,290 @@
+"""
+AI批改吞吐量基准测试
+
+使用模拟AI接口（provider 'mock'，不访问真实接口）模拟全班交卷：若干学生并发提交含AI批改简答题的试卷，
+随后由后台批改队列完成全部批改。分别统计提交请求和AI接口请求的吞吐量、p50/p95/p99 延迟，
+以及批改工作线程的忙碌比例和AI请求并发的利用率。
+
+用法：
+    python benchmarks/bench_ai_grading.py [--students 60] [--questions 3] [--latency-ms 800]
+        [--error-rate 0.02] [--throttle-rate 0.05] [--format anthropic] [--async] [--two-phase] [--no-batch]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def configure(args, db_path):
+    """
+    导入 app 前切换到临时数据库和模拟AI接口（数据库连接和AI批改服务都在导入时按配置创建）
+
+    Returns:
+        dict: AI_GRADING_CONFIG
+    """
+    os.environ['DATABASE_URI'] = f'sqlite:///{db_path}'
+    from config import AI_GRADING_CONFIG
+    AI_GRADING_CONFIG.update({
+        'provider': 'mock',
+        'base_url': '',
+        'enabled': True,
+        'result_cache': False,  # 每次运行都真正请求模拟接口
+        'async_requests': args.use_async,
+        'two_phase_grading': args.two_phase,
+        'batch_grading': not args.no_batch,
+        'feedback_backfill': False,
+        'mock': {
+            'format': args.format,
+            'latency_ms': args.latency_ms,
+            'latency_sigma': args.latency_sigma,
+            'error_rate': args.error_rate,
+            'throttle_rate': args.throttle_rate,
+            'retry_after': 1,
+            'feedback_chars': args.feedback_chars,
+        },
+    })
+    if args.workers:
+        AI_GRADING_CONFIG['grading_workers'] = args.workers
+    return AI_GRADING_CONFIG
+
+
+def percentiles(values):
+    """返回 (p50, p95, p99)，单位毫秒"""
+    if not values:
+        return 0.0, 0.0, 0.0
+    values = sorted(values)
+
+    def pick(p):
+        return values[min(len(values) - 1, int(len(values) * p))] * 1000
+
+    return pick(0.50), pick(0.95), pick(0.99)
+
+
+def report(name, latencies, elapsed):
+    p50, p95, p99 = percentiles(latencies)
+    rate = len(latencies) / elapsed if elapsed else 0.0
+    print(f"[{name}] 共 {len(latencies)} 次，耗时 {elapsed:.2f} 秒")
+    print(f"  吞吐量: {rate:8.1f} 次/秒")
+    print(f"  延迟: p50 {p50:.1f} ms, p95 {p95:.1f} ms, p99 {p99:.1f} ms")
+
+
+def setup_database(app, db, models, questions):
+    """创建临时数据库、简答题题库和AI批改的当前测试"""
+    bank = models['QuestionBank'](name='bench_short_answer', question_type='short_answer')
+    db.session.add(bank)
+    db.session.flush()
+    for i in range(questions):
+        db.session.add(models['Question'](
+            question_type='short_answer', content=f'第{i + 1}题：简述光合作用的过程和意义。',
+            correct_answer='植物利用光能把二氧化碳和水合成有机物并释放氧气', score=10, bank_id=bank.id))
+    db.session.add(models['Test'](
+        title='AI批改基准测试', short_answer_count=questions, short_answer_score=10,
+        short_answer_bank_id=bank.id, short_answer_grading_method='ai',
+        total_score=10 * questions, is_active=True))
+    db.session.commit()
+
+
+def submit_all(app, question_ids, students, threads):
+    """
+    所有学生同时交卷，返回每次提交的耗时
+
+    与 waitress 一样由固定数量的请求线程处理请求，超出的请求排队等待（耗时包含排队时间）。
+    """
+    def open_paper(index):
+        client = app.test_client()
+        client.post('/student/start', data={'name': f'学生{index}', 'class_number': f'{index % 4 + 1:03d}'})
+        client.get('/test')
+        return client
+
+    def submit(index, client, queued_at):
+        answers = {f'answer_{qid}': f'学生{index}的答案：光合作用利用光能合成有机物（{qid}）'
+                   for qid in question_ids}
+        response = client.post('/submit_test', data=answers)
+        return response.status_code, time.perf_counter() - queued_at
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        clients = list(executor.map(open_paper, range(students)))
+        queued_at = time.perf_counter()
+        outcomes = list(executor.map(submit, range(students), clients, [queued_at] * students))
+
+    latencies = [elapsed for status, elapsed in outcomes if status in (200, 302)]
+    errors = [status for status, _ in outcomes if status not in (200, 302)]
+    if errors:
+        print(f"  提交失败: {len(errors)} 次，状态码 {sorted(set(errors))}")
+    return latencies
+
+
+class RequestRecorder:
+    """记录每次AI接口请求（含限流等待和重试）的耗时"""
+
+    def __init__(self, service):
+        self.latencies = []
+        self.failures = 0
+        self.lock = threading.Lock()
+        sync_request = service._make_api_request
+        async_request = service._make_api_request_async
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            success, result = sync_request(*args, **kwargs)
+            self.record(time.perf_counter() - start, success)
+            return success, result
+
+        async def timed_async(*args, **kwargs):
+            start = time.perf_counter()
+            success, result = await async_request(*args, **kwargs)
+            self.record(time.perf_counter() - start, success)
+            return success, result
+
+        service._make_api_request = timed
+        service._make_api_request_async = timed_async
+
+    def record(self, elapsed, success):
+        with self.lock:
+            self.latencies.append(elapsed)
+            if not success:
+                self.failures += 1
+
+
+class UtilizationSampler:
+    """定期采样批改工作线程的忙碌数和模拟接口上同时进行的请求数"""
+
+    def __init__(self, server, interval=0.05):
+        self.server = server
+        self.interval = interval
+        self.busy = 0
+        self.samples = []
+        self.lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def wrap(self, handler):
+        def counted(*args, **kwargs):
+            with self.lock:
+                self.busy += 1
+            try:
+                return handler(*args, **kwargs)
+            finally:
+                with self.lock:
+                    self.busy -= 1
+        return counted
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            with self.lock:
+                busy = self.busy
+            self.samples.append((busy, self.server.stats()['in_flight'], threading.active_count()))
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def summary(self, workers, max_in_flight):
+        if not self.samples:
+            return {}
+        count = len(self.samples)
+        return {
+            'worker_busy': sum(sample[0] for sample in self.samples) / count / workers,
+            'ai_in_flight_avg': sum(sample[1] for sample in self.samples) / count,
+            'ai_slot_usage': sum(sample[1] for sample in self.samples) / count / max_in_flight,
+            'threads_peak': max(sample[2] for sample in self.samples),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='AI批改吞吐量基准测试（模拟AI接口）')
+    parser.add_argument('--students', type=int, default=60, help='同时交卷的学生数')
+    parser.add_argument('--questions', type=int, default=3, help='每份试卷的AI批改简答题数')
+    parser.add_argument('--threads', type=int, default=8, help='处理请求的线程数（waitress 默认为 4）')
+    parser.add_argument('--workers', type=int, default=0, help='批改工作线程数（默认使用配置）')
+    parser.add_argument('--latency-ms', type=float, default=800, help='模拟接口响应时间中位数（毫秒）')
+    parser.add_argument('--latency-sigma', type=float, default=0.5, help='响应时间对数正态分布的 sigma')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回 500 的比例')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='返回 429 的比例')
+    parser.add_argument('--feedback-chars', type=int, default=200, help='评语字符数')
+    parser.add_argument('--format', choices=['openai', 'anthropic'], default='openai', help='模拟接口协议格式')
+    parser.add_argument('--async', dest='use_async', action='store_true', help='使用异步请求客户端')
+    parser.add_argument('--two-phase', action='store_true', help='两阶段批改（提交后只评分）')
+    parser.add_argument('--no-batch', action='store_true', help='不合并同一道题的答案，逐题请求')
+    parser.add_argument('--timeout', type=float, default=600, help='等待批改完成的最长时间（秒）')
+    args = parser.parse_args()
+    db_fd, db_path = tempfile.mkstemp(suffix='.db')
+    os.close(db_fd)
+    config = configure(args, db_path)
+
+    import app as app_module
+    from ai_grading_service import get_ai_grading_service
+    import mock_ai_provider
+
+    app, db, queue = app_module.app, app_module.db, app_module.grading_job_queue
+    app.config['TESTING'] = True
+
+    service = get_ai_grading_service()
+    server = mock_ai_provider.get_mock_server(config['mock'])
+    recorder = RequestRecorder(service)
+    sampler = UtilizationSampler(server)
+    queue.handler = sampler.wrap(queue.handler)
+    # 提交阶段只登记任务，全部交卷后再启动批改，分别统计
+    notify = queue.notify
+    queue.notify = lambda: None
+
+    try:
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            setup_database(app, db, vars(app_module), args.questions)
+            question_ids = [q.id for q in app_module.Question.query.all()]
+
+        print(f"模拟接口: {server.base_url}（{args.format}，延迟中位数 {args.latency_ms:.0f} ms，"
+              f"错误率 {args.error_rate:.0%}，限流率 {args.throttle_rate:.0%}）")
+        print(f"批改: {'异步请求' if args.use_async else '线程池'}，"
+              f"{'两阶段' if args.two_phase else '评分和评语一次完成'}，工作线程 {queue.worker_count}")
+
+        start = time.perf_counter()
+        submit_latencies = submit_all(app, question_ids, args.students, args.threads)
+        report('交卷', submit_latencies, time.perf_counter() - start)
+
+        queue.notify = notify
+        sampler.start()
+        start = time.perf_counter()
+        queue.notify()
+        deadline = start + args.timeout
+        while queue.pending_count() and time.perf_counter() < deadline:
+            time.sleep(0.05)
+        grading_elapsed = time.perf_counter() - start
+        sampler.stop()
+        queue.stop(5)
+
+        with app.app_context():
+            jobs = app_module.GradingJob.query.count()
+            failed = app_module.GradingJob.query.filter_by(status='failed').count()
+        print(f"[批改] {jobs} 道题，耗时 {grading_elapsed:.2f} 秒，{jobs / grading_elapsed:.1f} 题/秒，失败 {failed} 道")
+        report('AI接口请求', recorder.latencies, grading_elapsed)
+        print(f"  失败请求: {recorder.failures}")
+        max_in_flight = (config.get('async_max_in_flight', 256) if args.use_async
+                         else config.get('max_concurrency', 8))
+        utilization = sampler.summary(queue.worker_count, max_in_flight)
+        if utilization:
+            print(f"  批改工作线程忙碌比例: {utilization['worker_busy']:.0%}")
+            print(f"  AI请求并发: 平均 {utilization['ai_in_flight_avg']:.1f} / 上限 {max_in_flight} "
+                  f"（{utilization['ai_slot_usage']:.0%}），峰值线程数 {utilization['threads_peak']}")
+        print(f"模拟接口: {server.stats()}")
+        print(f"批量批改: {service.get_batch_stats()}")
+        print(f"限流器: {service.get_rate_limit_stats()}")
+    finally:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(db_path + suffix):
+                os.unlink(db_path + suffix)
+
+
+if __name__ == '__main__':
+    main()
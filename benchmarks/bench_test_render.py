@@ -0,0 +1,128 @@
+"""
+考试页面渲染基准测试
+
+模拟全班同时打开考试页面：若干学生线程并发渲染 test.html，每份试卷从同一题库中随机抽取题目。
+分别在不使用片段缓存（每次完整渲染每道题）和使用题目片段缓存两种方式下运行，
+对比每秒渲染页数和单页渲染延迟。
+
+用法：
+    python benchmarks/bench_test_render.py [--questions 50] [--students 60] [--rounds 5]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import render_template  # noqa: E402
+
+from app import app, render_question_fragments, question_fragment_cache  # noqa: E402
+from paper_pool import PaperQuestion  # noqa: E402
+from scoring import QUESTION_TYPES  # noqa: E402
+
+# 每个题型的题库规模
+BANK_SIZE = 200
+
+
+def make_bank():
+    """生成各题型的题库（题干较长，包含换行）"""
+    now = datetime.utcnow()
+    bank = {}
+    next_id = 1
+    for q_type in QUESTION_TYPES:
+        questions = []
+        for i in range(BANK_SIZE):
+            questions.append(PaperQuestion(
+                id=next_id, question_type=q_type,
+                content=f'第{i}题：' + '请根据下列材料回答问题。\n' * 8,
+                image_path=None,
+                option_a='选项A' * 5, option_b='选项B' * 5, option_c='选项C' * 5, option_d='选项D' * 5,
+                option_e=None, correct_answer='A', score=2, updated_at=now))
+            next_id += 1
+        bank[q_type] = questions
+    return bank
+
+
+def draw(bank, question_count, rng):
+    per_type = question_count // len(QUESTION_TYPES)
+    return {q_type: rng.sample(bank[q_type], per_type) for q_type in QUESTION_TYPES}
+
+
+def render_page(paper, fragments):
+    test_config = {'title': '基准测试', **{f'{q_type}_score': 2 for q_type in QUESTION_TYPES}}
+    return render_template('test.html', test=test_config, test_title='基准测试', paper_id=1,
+                           question_fragments=fragments,
+                           **{f'{q_type}_questions': paper[q_type] for q_type in QUESTION_TYPES})
+
+
+def render_uncached(paper):
+    """每道题都重新渲染（等同于未使用片段缓存时的整页渲染）"""
+    fragments = {}
+    for q_type in QUESTION_TYPES:
+        for question in paper[q_type]:
+            fragments[question.id] = render_template('question_fragment.html', question=question)
+    return render_page(paper, fragments)
+
+
+def render_cached(paper):
+    return render_page(paper, render_question_fragments(
+        [q for q_type in QUESTION_TYPES for q in paper[q_type]]))
+
+
+def run_mode(name, render, bank, questions, students, rounds):
+    latencies = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(students)
+
+    def student(index):
+        rng = random.Random(index)
+        with app.test_request_context('/test'):
+            barrier.wait()
+            for _ in range(rounds):
+                paper = draw(bank, questions, rng)
+                start = time.perf_counter()
+                render(paper)
+                elapsed = time.perf_counter() - start
+                with lock:
+                    latencies.append(elapsed)
+
+    threads = [threading.Thread(target=student, args=(i,)) for i in range(students)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    total = time.perf_counter() - start
+
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"[{name}] {len(latencies)} 页，耗时 {total:.2f} 秒")
+    print(f"  吞吐量: {len(latencies) / total:8.1f} 页/秒")
+    print(f"  延迟: p50 {statistics.median(latencies) * 1000:.1f} ms, p95 {p95 * 1000:.1f} ms")
+    return len(latencies) / total
+
+
+def main():
+    parser = argparse.ArgumentParser(description='考试页面渲染基准测试')
+    parser.add_argument('--questions', type=int, default=50, help='每份试卷的题数')
+    parser.add_argument('--students', type=int, default=60, help='并发学生数')
+    parser.add_argument('--rounds', type=int, default=5, help='每个学生渲染的次数')
+    args = parser.parse_args()
+
+    bank = make_bank()
+    baseline = run_mode('完整渲染', render_uncached, bank, args.questions, args.students, args.rounds)
+    question_fragment_cache.clear()
+    cached = run_mode('题目片段缓存', render_cached, bank, args.questions, args.students, args.rounds)
+    print(f"片段缓存: {question_fragment_cache.stats()}")
+    if baseline:
+        print(f"吞吐量提升: {cached / baseline:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
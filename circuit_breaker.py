@@ -0,0 +1,133 @@
+"""
+熔断器模块
+AI接口故障时，每道需要AI批改的题目都要完整地重试并等待，全班的提交会积压数分钟。
+熔断器在连续失败或最近失败率过高时断开，断开期间的请求立即失败（转为人工批改），
+一段时间后放行少量探测请求，探测成功即恢复
+"""
+
+import threading
+import time
+import logging
+from collections import deque
+from typing import Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+# 熔断器状态
+CLOSED = 'closed'        # 正常放行
+OPEN = 'open'            # 熔断中，请求立即失败
+HALF_OPEN = 'half_open'  # 放行探测请求
+
+
+def is_failure_status(status_code: int) -> bool:
+    """HTTP状态码是否表示接口故障（服务端错误或密钥无效）；429限流和请求内容错误说明接口仍可用"""
+    return status_code >= 500 or status_code in (401, 403)
+
+
+class CircuitBreaker:
+    """线程安全的熔断器
+
+    closed --(连续失败或失败率过高)--> open --(reset_timeout 后)--> half_open
+    half_open --(探测成功)--> closed；half_open --(探测失败)--> open
+    """
+
+    def __init__(self, failure_threshold: int = 5, failure_ratio: float = 0.5, window: int = 20,
+                 reset_timeout: float = 30.0, half_open_probes: int = 1,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            failure_threshold: 连续失败多少次后熔断
+            failure_ratio: 最近 window 次请求的失败率达到该值时熔断（请求数不少于 window 的一半时才计算）
+            window: 计算失败率的请求数
+            reset_timeout: 熔断后多少秒开始放行探测请求
+            half_open_probes: 同时放行的探测请求数
+        """
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.failure_ratio = failure_ratio
+        self.window = max(1, int(window))
+        self.reset_timeout = reset_timeout
+        self.half_open_probes = max(1, int(half_open_probes))
+        self.clock = clock
+        self._state = CLOSED
+        self._results = deque(maxlen=self.window)  # 最近的请求结果，True 表示失败
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self._probe_started = 0.0
+        self._lock = threading.Lock()
+        self.trips = 0
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        now = self.clock()
+        if self._state == OPEN and now - self._opened_at >= self.reset_timeout:
+            self._state = HALF_OPEN
+            self._probes = 0
+        elif self._state == HALF_OPEN and self._probes and now - self._probe_started >= self.reset_timeout:
+            # 探测请求被取消、没有报告结果时重新放行探测
+            self._probes = 0
+        return self._state
+
+    def allow(self) -> bool:
+        """是否放行一个请求；半开状态下放行的请求作为探测请求"""
+        with self._lock:
+            state = self._current_state()
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and self._probes < self.half_open_probes:
+                self._probes += 1
+                self._probe_started = self.clock()
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        """记录一次成功（接口有响应）"""
+        with self._lock:
+            self._results.append(False)
+            self._consecutive_failures = 0
+            if self._current_state() != CLOSED:
+                self._state = CLOSED
+                self._results.clear()
+                logger.info("AI接口已恢复，熔断器关闭")
+
+    def record_failure(self):
+        """记录一次失败（超时、连接失败或服务端错误）"""
+        with self._lock:
+            self._results.append(True)
+            self._consecutive_failures += 1
+            state = self._current_state()
+            if state == HALF_OPEN:
+                self._trip('探测请求失败')
+            elif state == CLOSED:
+                failures = sum(self._results)
+                if self._consecutive_failures >= self.failure_threshold:
+                    self._trip(f'连续失败 {self._consecutive_failures} 次')
+                elif (len(self._results) * 2 >= self.window and
+                      failures / len(self._results) >= self.failure_ratio):
+                    self._trip(f'最近 {len(self._results)} 次请求失败 {failures} 次')
+
+    def _trip(self, reason: str):
+        self._state = OPEN
+        self._opened_at = self.clock()
+        self.trips += 1
+        logger.warning(f"AI接口熔断（{reason}），{self.reset_timeout} 秒内AI批改直接转为人工批改")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            state = self._current_state()
+            failures = sum(self._results)
+            return {
+                'state': state,
+                'consecutive_failures': self._consecutive_failures,
+                'failure_ratio': round(failures / len(self._results), 3) if self._results else 0.0,
+                'retry_in': (round(max(0.0, self._opened_at + self.reset_timeout - self.clock()), 1)
+                             if state == OPEN else 0),
+                'trips': self.trips,
+                'rejected': self.rejected
+            }
@@ -10,6 +10,15 @@ PORT = int(os.environ.get('APP_PORT', 8000))
 # 数据库配置
 DATABASE_URI = os.environ.get('DATABASE_URI', 'sqlite:///test_system.db')
 
+# SQLite 性能配置（每个数据库连接建立时设置，使用其他数据库时忽略）
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',     # 读写并发：统计页面的读请求不阻塞考试提交
+    'busy_timeout': 5000,      # 数据库被锁时最多等待的毫秒数
+    'synchronous': 'NORMAL',   # WAL 模式下推荐 NORMAL
+    'cache_size': -20000,      # 页缓存大小，负数表示 KB（约 20MB）
+    'mmap_size': 134217728,    # 内存映射大小（128MB），设为 0 关闭
+}
+
 # 密钥配置（生产环境请使用环境变量设置）
 SECRET_KEY = os.environ.get('SECRET_KEY', 'your-secret-key')
 
@@ -23,10 +32,26 @@ MAX_IMG_SIZE = 2 * 1024 * 1024  # 2MB
 # 时区配置
 TIMEZONE_OFFSET = 8  # 北京时间 UTC+8
 
+# 考试提交写入配置（全班集中提交时，把多份提交合并到一个事务中写入数据库）
+SUBMISSION_WRITER_CONFIG = {
+    'enabled': True,
+    'max_batch': 50,     # 单个事务最多合并的提交数
+    'max_wait_ms': 5,    # 收到第一份提交后等待更多提交的时间（毫秒）
+    'timeout': 30,       # 提交请求等待写入完成的最长时间（秒）
+}
+
+# 试卷池配置（考试开始前为当前测试和可自选的预设预先抽好试卷，学生打开考试页面时直接取用）
+PAPER_POOL_CONFIG = {
+    'enabled': True,
+    'depth': 10,            # 每个测试预先抽好的试卷份数
+    'refill_interval': 30,  # 补充线程的检查间隔（秒）
+    'shuffle_options': False,  # 按学生的抽题种子打乱单选题和多选题的选项顺序
+}
+
 # AI批改配置
 # 请在下方填写您的AI API配置信息
 AI_GRADING_CONFIG = {
-    # API提供商选择: 'openai', 'azure', 'anthropic', 'qianfan', 'tongyi' 等
+    # API提供商选择: 'openai', 'azure', 'anthropic', 'qianfan', 'tongyi' 等；'mock' 为本地模拟接口（见下方 mock 设置）
     'provider': 'openai',
     
     # API密钥 - 请填写您的API Key
@@ -50,6 +75,82 @@ AI_GRADING_CONFIG = {
     # 最大token数
     'max_tokens': 1000,
     
+    # 后台AI批改工作线程数（提交后异步批改）
+    'grading_workers': 2,
+    
+    # 同时进行的AI批改请求数上限（同一份试卷的多道题并发批改），同时也是HTTP连接池大小
+    'max_concurrency': 8,
+    
+    # 启动时预先建立的API连接数（0 表示不预热）
+    'warm_up_connections': 0,
+    
+    # 缓存AI批改结果：相同题目的相同答案直接使用已有的分数和评语（保存在 instance/ai_grading_cache.db）
+    'result_cache': True,
+    'result_cache_max_entries': 100000,
+    
+    # 填空题本地预批改：标准化后一致的填空直接判定，只把无法判定的填空交给AI
+    # 参考答案中可用 | 分隔同一个空的多个可接受答案，如 "计算机|电脑"（自动评分同样适用）
+    'fill_blank_precheck': True,
+    'fill_blank_edit_tolerance': 1,  # 较长英文单词容许的拼写差异（编辑距离），0 表示不容许；中文答案只接受完全一致
+    
+    # 批量批改：同一道简答题的多份答案合并为一次请求，返回JSON数组
+    # 每批答案数取 max_tokens 可容纳的结果数（每份约150 token）与 batch_max_size 中的较小值
+    'batch_grading': True,
+    'batch_max_size': 10,
+    
+    # 异步请求：全部AI请求在同一个事件循环线程上发出，同时进行的请求数不再受线程数限制（需要安装 aiohttp）
+    'async_requests': False,
+    'async_max_in_flight': 256,  # 同时进行的请求数上限
+    
+    # 两阶段批改：提交后只评分（输出不超过 score_only_max_tokens 个token），AI评语在学生或教师查看成绩时由批改队列在后台生成，
+    # feedback_backfill 开启时批改队列空闲时也会每次为 feedback_backfill_batch 道题补充评语；
+    # 生成失败的评语 feedback_retry_delay 秒后再重试，失败 feedback_max_attempts 次后不再生成
+    'two_phase_grading': False,
+    'score_only_max_tokens': 50,
+    'feedback_backfill': True,
+    'feedback_backfill_batch': 10,
+    'feedback_max_attempts': 3,
+    'feedback_retry_delay': 300,
+    
+    # 流式接收AI响应，score、feedback 等评分字段完整后立即结束，不再等待其余输出（openai/azure/anthropic）
+    'stream_responses': True,
+    
+    # 限流（同一提供商的所有请求共享）：每分钟请求数和token数上限，按提供商的配额填写，0 表示不限制
+    'rate_limit_rpm': 0,
+    'rate_limit_tpm': 0,
+    # 自适应并发：请求成功时逐步提高并发上限，遇到429限流时减半（不低于 min_concurrency）
+    'adaptive_concurrency': True,
+    'min_concurrency': 1,
+    
+    # 熔断：连续失败 circuit_failure_threshold 次，或最近 circuit_window 次请求的失败率达到 circuit_failure_ratio 时熔断，
+    # 熔断期间AI批改立即转为人工批改；circuit_reset_timeout 秒后放行探测请求，成功即恢复
+    'circuit_failure_threshold': 5,
+    'circuit_failure_ratio': 0.5,
+    'circuit_window': 20,
+    'circuit_reset_timeout': 30,
+    
+    # 健康检查：后台每隔 health_check_interval 秒（0 表示只在启动时检查一次）发送一个极短的请求探测AI接口，
+    # 连续失败 health_failure_threshold 次判定为不可用，响应超过 health_slow_ms 毫秒判定为变慢；
+    # 启动、保存测试设置和状态接口只读取最近一次的结论，不等待接口
+    'health_check': True,
+    'health_check_interval': 60,
+    'health_check_timeout': 10,
+    'health_check_window': 10,
+    'health_failure_threshold': 2,
+    'health_slow_ms': 5000,
+    
+    # 模拟AI接口（provider 设为 'mock' 时使用，不访问真实接口，用于离线开发和压测）：
+    # 未配置 base_url 时在进程内启动模拟服务器，按以下设置模拟响应时间（对数正态分布）、错误率、限流率和评语长度
+    'mock': {
+        'format': 'openai',  # 协议格式：openai 或 anthropic
+        'latency_ms': 800,
+        'latency_sigma': 0.5,
+        'error_rate': 0.0,
+        'throttle_rate': 0.0,
+        'retry_after': 1,
+        'feedback_chars': 200,
+    },
+    
     # 是否启用AI批改（当api_key为空时自动禁用）
     'enabled': True  # 当api_key配置正确后，请改为True
 }
@@ -0,0 +1,72 @@
+"""
+数据库引擎配置模块
+为 SQLite 连接统一设置性能相关的 PRAGMA（WAL、忙等待、同步级别、缓存和内存映射），
+考试期间统计页面的读请求不再阻塞提交写入
+"""
+
+import logging
+from typing import Dict
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# 默认 SQLite 性能配置
+DEFAULT_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',      # 读写并发：读不阻塞写，写不阻塞读
+    'busy_timeout': 5000,       # 数据库被锁时等待的毫秒数，而不是立即报错
+    'synchronous': 'NORMAL',    # WAL 模式下 NORMAL 足够安全且明显快于 FULL
+    'cache_size': -20000,       # 页缓存大小，负数表示 KB（约 20MB）
+    'mmap_size': 134217728,     # 内存映射大小（128MB）
+    'temp_store': 'MEMORY',     # 临时表和索引放在内存中
+}
+
+# 允许通过配置设置的 PRAGMA（journal_mode 需要最先设置）
+SUPPORTED_PRAGMAS = ('journal_mode', 'busy_timeout', 'synchronous', 'cache_size', 'mmap_size',
+                     'temp_store', 'foreign_keys', 'wal_autocheckpoint')
+
+
+def is_sqlite(engine) -> bool:
+    return engine.dialect.name == 'sqlite'
+
+
+def configure_sqlite_engine(engine, pragmas: Dict = None):
+    """
+    为 SQLite 引擎注册连接事件，每个新连接都设置 PRAGMA
+
+    事务仍由 pysqlite 在第一条写语句前开始，只读查询不会持有 WAL 快照，
+    写入遇到锁时按 busy_timeout 等待而不是立即失败。
+
+    Args:
+        engine: SQLAlchemy 引擎（非 SQLite 引擎直接忽略）
+        pragmas: PRAGMA 配置，未指定的项使用 DEFAULT_SQLITE_PRAGMAS；值为 None 表示不设置
+    """
+    if not is_sqlite(engine):
+        return
+    settings = dict(DEFAULT_SQLITE_PRAGMAS)
+    settings.update(pragmas or {})
+    unknown = set(settings) - set(SUPPORTED_PRAGMAS)
+    if unknown:
+        raise ValueError(f"不支持的SQLite配置项: {', '.join(sorted(unknown))}")
+    statements = [f'PRAGMA {name}={settings[name]}' for name in SUPPORTED_PRAGMAS
+                  if settings.get(name) is not None]
+
+    @event.listens_for(engine, 'connect')
+    def _apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for statement in statements:
+                cursor.execute(statement)
+        finally:
+            cursor.close()
+
+
+def read_sqlite_settings(engine) -> Dict:
+    """读取当前连接上实际生效的 PRAGMA 值"""
+    if not is_sqlite(engine):
+        return {}
+    settings = {}
+    with engine.connect() as conn:
+        for name in SUPPORTED_PRAGMAS:
+            settings[name] = conn.exec_driver_sql(f'PRAGMA {name}').scalar()
+    return settings
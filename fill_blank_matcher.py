@@ -0,0 +1,154 @@
+"""
+填空题本地预批改模块
+学生答案与参考答案在标准化后一致（或只有轻微拼写差异）时，无需调用AI接口即可判定。
+本地比对逐空判定对错，只有无法判定的填空才交给AI批改
+"""
+
+import unicodedata
+from typing import List, NamedTuple, Optional
+
+from scoring import blank_aliases, split_blanks
+
+# 题目中出现这些关键词时不要求按顺序填写（与AI提示词中的规则一致）
+ORDER_FREE_KEYWORDS = ('不限顺序', '任意顺序', '顺序不限', '不分先后', '可以任意填写', '随意填写', '自由填写')
+
+# 参考答案至少有这么多个字母时才容许拼写差异（避免 "cat" 与 "car" 被判为一致）
+MIN_LENGTH_FOR_TOLERANCE = 4
+
+
+# 填空末尾可以忽略的句末标点（不含 "."，"3." 与 "3" 的含义由AI判断）
+TRAILING_PUNCTUATION = '。!?;！？；，,、'
+
+
+def fold_width(text: str) -> str:
+    """全角字母、数字和符号转为半角，全角空格转为普通空格（不做其他 Unicode 兼容转换，如 "²" 不会变为 "2"）"""
+    return ''.join(' ' if c == '\u3000' else chr(ord(c) - 0xfee0) if '\uff01' <= c <= '\uff5e' else c
+                   for c in text)
+
+
+def normalize_blank(text) -> str:
+    """
+    标准化单个填空：全角转半角、忽略大小写和空白，去掉末尾的句末标点
+
+    其他标点（如 "-"、"."、"/"、":"、"%"）会改变答案的含义，保持原样；
+    标准化后仍不一致的答案由AI判定，不在本地判对。
+    """
+    text = ''.join(fold_width(text or '').casefold().split())
+    return text.rstrip(TRAILING_PUNCTUATION)
+
+
+def is_latin_word(text: str) -> bool:
+    """是否只由拉丁字母组成（只有这类答案容许拼写差异；中文差一个字常常意思相反，如 "可逆" 与 "不可逆"）"""
+    return bool(text) and all(c.isalpha() and 'LATIN' in unicodedata.name(c, '') for c in text)
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """计算编辑距离，超过 limit 时提前返回 limit + 1"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def is_order_free(question) -> bool:
+    """题目是否明确说明填空不限顺序"""
+    return any(keyword in (question or '') for keyword in ORDER_FREE_KEYWORDS)
+
+
+class BlankMatch(NamedTuple):
+    """本地比对结果"""
+    total: int                  # 参考答案的填空数
+    correct: int                # 本地判定正确的填空数
+    undecided: List[int]        # 无法判定、需要AI批改的填空序号（从0开始）
+    undecided_references: List[str]  # 与 undecided 对应的参考答案
+    undecided_answers: List[str]  # 与 undecided 对应的学生答案
+    order_free: bool
+
+    @property
+    def decided(self) -> bool:
+        return not self.undecided
+
+
+class FillBlankMatcher:
+    """填空题本地比对器"""
+
+    def __init__(self, edit_tolerance: int = 1):
+        """
+        Args:
+            edit_tolerance: 参考答案为较长的拉丁字母单词时容许的编辑距离（0 表示只接受标准化后完全一致）；
+                其他答案（如中文）只接受完全一致，接近但不一致的答案交给AI判定
+        """
+        self.edit_tolerance = max(0, int(edit_tolerance))
+
+    def _matches(self, student: str, aliases: List[str]) -> bool:
+        if not student:
+            return False
+        for alias in aliases:
+            if student == alias:
+                return True
+            if (self.edit_tolerance and len(alias) >= MIN_LENGTH_FOR_TOLERANCE and
+                    is_latin_word(alias) and is_latin_word(student) and
+                    edit_distance(student, alias, self.edit_tolerance) <= self.edit_tolerance):
+                return True
+        return False
+
+    def match(self, question: str, reference_answer: str, student_answer: str) -> Optional[BlankMatch]:
+        """
+        逐空比对学生答案
+
+        Returns:
+            BlankMatch；参考答案为空时返回 None（无法本地比对）
+        """
+        reference_raw = []
+        references = []
+        for blank in split_blanks(reference_answer):
+            aliases = [normalize_blank(alias) for alias in blank_aliases(blank)]
+            aliases = [alias for alias in aliases if alias]
+            if aliases:
+                reference_raw.append(blank)
+                references.append(aliases)
+        if not references:
+            return None
+        student_raw = split_blanks(student_answer)
+        students = [normalize_blank(item) for item in student_raw]
+        order_free = is_order_free(question)
+
+        correct = 0
+        pending = []  # (填空序号, 学生答案序号)
+        if order_free:
+            # 不限顺序：每个学生答案可以匹配任意一个尚未匹配的空
+            remaining = list(range(len(references)))
+            unmatched_students = []
+            for index, student in enumerate(students):
+                hit = next((i for i in remaining if self._matches(student, references[i])), None)
+                if hit is None:
+                    unmatched_students.append(index)
+                else:
+                    remaining.remove(hit)
+                    correct += 1
+            # 剩余的空与剩余的学生答案依次配对；没有剩余学生答案的空判为错误
+            pending = list(zip(remaining, unmatched_students))
+        else:
+            for index, aliases in enumerate(references):
+                if index < len(students) and self._matches(students[index], aliases):
+                    correct += 1
+                elif index < len(students):
+                    pending.append((index, index))
+
+        # 未填写（或只填了标点）的空直接判为错误，其余无法判定的空交给AI
+        pending = [(blank, student) for blank, student in pending if students[student]]
+        return BlankMatch(
+            total=len(references),
+            correct=correct,
+            undecided=[blank for blank, _ in pending],
+            undecided_references=[reference_raw[blank] for blank, _ in pending],
+            undecided_answers=[student_raw[student] for _, student in pending],
+            order_free=order_free
+        )
@@ -0,0 +1,57 @@
+"""
+页面片段缓存模块
+同一道题目在每个学生的试卷中渲染结果完全相同，按 (题目ID, 版本, 题型) 缓存渲染好的 HTML 片段，
+考试页面只需按抽题顺序拼接片段
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable
+
+# 片段缓存容量
+FRAGMENT_CACHE_SIZE = 4096
+
+
+class FragmentCache:
+    """线程安全的 LRU 片段缓存
+
+    题目被编辑后版本（更新时间）变化，旧片段不再命中并逐渐被淘汰，无需主动失效。
+    """
+
+    def __init__(self, capacity: int = FRAGMENT_CACHE_SIZE):
+        self.capacity = max(1, int(capacity))
+        self._fragments = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, render: Callable[[], str]) -> str:
+        """获取缓存的片段，不存在时调用 render() 渲染并缓存"""
+        with self._lock:
+            fragment = self._fragments.get(key)
+            if fragment is not None:
+                self._fragments.move_to_end(key)
+                self.hits += 1
+                return fragment
+            self.misses += 1
+        fragment = render()
+        with self._lock:
+            self._fragments[key] = fragment
+            self._fragments.move_to_end(key)
+            if len(self._fragments) > self.capacity:
+                self._fragments.popitem(last=False)
+        return fragment
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._fragments.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'entries': len(self._fragments),
+                'capacity': self.capacity,
+                'hits': self.hits,
+                'misses': self.misses
+            }
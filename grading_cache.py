@@ -0,0 +1,135 @@
+"""
+AI批改结果缓存模块
+很多学生对同一道题给出相同的答案，按内容寻址缓存批改结果：
+键由题目、参考答案、标准化后的学生答案、分值、模型参数和提示词版本计算得到，
+命中时直接返回保存的分数和评语，不再调用AI接口。缓存保存在独立的 SQLite 文件中，重启后仍然有效
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+import logging
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# 默认最多保存的批改结果数
+DEFAULT_MAX_ENTRIES = 100000
+
+# 每写入多少条结果检查一次容量
+PRUNE_INTERVAL = 100
+
+
+def normalize_student_answer(answer, question_type='short_answer') -> str:
+    """
+    标准化学生答案，使仅有全半角、空白差异的答案共用缓存
+
+    填空题还会统一分隔符并忽略大小写（与批改规则一致）。
+    """
+    text = unicodedata.normalize('NFKC', answer or '').strip()
+    text = re.sub(r'\s+', ' ', text)
+    if question_type == 'fill_blank':
+        text = text.replace(',', '、').replace('，', '、')
+        text = '、'.join(item.strip() for item in text.split('、') if item.strip()).lower()
+    return text
+
+
+class GradingResultCache:
+    """基于 SQLite 的AI批改结果缓存（线程安全）
+
+    题目或参考答案修改后键随之变化，旧结果不会再命中；
+    提示词版本变化时，打开缓存会删除其他版本的结果。
+    """
+
+    def __init__(self, path: str, prompt_version: str, max_entries: int = DEFAULT_MAX_ENTRIES):
+        """
+        Args:
+            path: 缓存文件路径（':memory:' 表示只保存在内存中）
+            prompt_version: 提示词版本，参与计算缓存键
+            max_entries: 最多保存的结果数，超出时删除最早写入的结果
+        """
+        self.path = path
+        self.prompt_version = prompt_version
+        self.max_entries = max(1, int(max_entries))
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        if path != ':memory:':
+            directory = os.path.dirname(os.path.abspath(path))
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            if path != ':memory:':
+                self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS grading_result ('
+                'cache_key TEXT PRIMARY KEY, prompt_version TEXT NOT NULL, '
+                'result TEXT NOT NULL, created_at REAL NOT NULL, hit_count INTEGER DEFAULT 0)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS ix_grading_result_created_at '
+                               'ON grading_result (created_at)')
+            removed = self._conn.execute('DELETE FROM grading_result WHERE prompt_version != ?',
+                                         (prompt_version,)).rowcount
+        if removed:
+            logger.info(f"提示词已变化，清除了 {removed} 条AI批改缓存")
+
+    def make_key(self, question: str, reference_answer: str, student_answer: str, max_score,
+                 question_type: str, provider: str, model: str, temperature) -> str:
+        """计算缓存键"""
+        payload = json.dumps([
+            question or '', reference_answer or '',
+            normalize_student_answer(student_answer, question_type),
+            max_score, question_type, provider, model, temperature, self.prompt_version
+        ], ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict]:
+        """获取缓存的批改结果，未命中时返回 None"""
+        with self._lock:
+            row = self._conn.execute('SELECT result FROM grading_result WHERE cache_key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            with self._conn:
+                self._conn.execute('UPDATE grading_result SET hit_count = hit_count + 1 WHERE cache_key = ?', (key,))
+        return json.loads(row[0])
+
+    def put(self, key: str, result: Dict):
+        """保存批改结果"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO grading_result (cache_key, prompt_version, result, created_at) '
+                'VALUES (?, ?, ?, ?)',
+                (key, self.prompt_version, json.dumps(result, ensure_ascii=False), time.time()))
+            self._writes += 1
+            if self._writes % PRUNE_INTERVAL:
+                return
+            count = self._conn.execute('SELECT COUNT(*) FROM grading_result').fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute(
+                    'DELETE FROM grading_result WHERE cache_key IN ('
+                    'SELECT cache_key FROM grading_result ORDER BY created_at LIMIT ?)',
+                    (count - self.max_entries,))
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM grading_result')
+
+    def stats(self) -> Dict:
+        with self._lock:
+            entries = self._conn.execute('SELECT COUNT(*) FROM grading_result').fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                'entries': entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'prompt_version': self.prompt_version
+            }
@@ -0,0 +1,201 @@
+"""
+AI批改任务队列模块
+将AI批改从提交请求中解耦：提交时只写入待批改任务，由后台工作线程异步完成批改
+"""
+
+import threading
+import logging
+from datetime import datetime
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class GradingJobQueue:
+    """基于数据库表的持久化批改任务队列
+
+    任务状态流转: pending -> running -> done / failed
+    进程崩溃后，遗留的 running 任务会在下次启动时重置为 pending 重新执行。
+    """
+
+    def __init__(self, app, db, job_model, handler: Callable, worker_count: int = 2,
+                 poll_interval: float = 5.0, max_attempts: int = 3, same_question_limit: int = 0,
+                 idle_handler: Optional[Callable[[], int]] = None):
+        """
+        Args:
+            app: Flask 应用实例（工作线程需要应用上下文）
+            db: Flask-SQLAlchemy 实例
+            job_model: 任务表模型类
+            handler: 任务处理函数 handler(jobs, max_attempts) -> Dict[int, Tuple[bool, str]]，
+                jobs 为一次领取的任务列表，返回 {任务ID: (是否成功, 错误信息)}，
+                失败且不应重试时可返回 (False, 错误信息, False)；
+                在应用上下文中调用，处理函数只修改会话不提交，由队列与任务状态一起提交
+            worker_count: 工作线程数量
+            poll_interval: 无任务时的轮询间隔（秒）
+            max_attempts: 单个任务最大尝试次数
+            same_question_limit: 领取时最多附带多少个其他提交中同一道题的待处理任务，
+                便于处理函数把它们合并为批量请求（0 表示只领取同一份提交的任务）
+            idle_handler: 没有待处理任务时执行的低优先级工作 idle_handler() -> 处理的数量，
+                同一时刻只有一个工作线程执行；在应用上下文中调用，由队列提交事务
+        """
+        self.app = app
+        self.db = db
+        self.job_model = job_model
+        self.handler = handler
+        self.worker_count = max(1, int(worker_count))
+        self.poll_interval = poll_interval
+        self.max_attempts = max(1, int(max_attempts))
+        self.same_question_limit = max(0, int(same_question_limit))
+        self.idle_handler = idle_handler
+        self._idle_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    @property
+    def started(self) -> bool:
+        return bool(self._threads)
+
+    def start(self):
+        """恢复崩溃遗留的任务并启动工作线程（重复调用无副作用）"""
+        with self._lock:
+            if self._threads:
+                return
+            self._stop.clear()
+            self.recover()
+            for i in range(self.worker_count):
+                thread = threading.Thread(target=self._worker_loop, name=f'grading-worker-{i + 1}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            logger.info(f"AI批改任务队列已启动，工作线程数: {self.worker_count}")
+
+    def stop(self, timeout: Optional[float] = None):
+        """停止工作线程"""
+        with self._lock:
+            self._stop.set()
+            self._wakeup.set()
+            for thread in self._threads:
+                thread.join(timeout)
+            self._threads = []
+
+    def notify(self):
+        """通知工作线程有新任务；若队列尚未启动则先启动"""
+        if not self.started:
+            self.start()
+        self._wakeup.set()
+
+    def recover(self) -> int:
+        """将上次运行中断的 running 任务重置为 pending"""
+        Job = self.job_model
+        with self.app.app_context():
+            try:
+                count = Job.query.filter_by(status='running').update(
+                    {'status': 'pending', 'updated_at': datetime.utcnow()},
+                    synchronize_session=False
+                )
+                self.db.session.commit()
+                if count:
+                    logger.info(f"已恢复 {count} 个中断的AI批改任务")
+                return count
+            except Exception as e:
+                self.db.session.rollback()
+                logger.error(f"恢复AI批改任务失败: {str(e)}")
+                return 0
+
+    def pending_count(self) -> int:
+        """待处理任务数量"""
+        with self.app.app_context():
+            return self.job_model.query.filter(self.job_model.status.in_(['pending', 'running'])).count()
+
+    def _claim_next(self):
+        """原子地领取同一份提交中的全部待处理任务，返回任务ID列表，没有任务时返回空列表
+
+        同一份试卷的任务一起领取，便于并发批改后一次性回填总分；
+        设置了 same_question_limit 时，还会附带其他提交中同一批题目的待处理任务。
+        """
+        Job = self.job_model
+        while True:
+            job = Job.query.filter_by(status='pending').order_by(Job.id).first()
+            if not job:
+                return []
+            candidate_jobs = Job.query.filter_by(result_id=job.result_id, status='pending').all()
+            candidate_ids = [row.id for row in candidate_jobs]
+            if self.same_question_limit:
+                candidate_ids += [row.id for row in Job.query.filter(
+                    Job.status == 'pending',
+                    Job.result_id != job.result_id,
+                    Job.question_id.in_({row.question_id for row in candidate_jobs})
+                ).order_by(Job.id).limit(self.same_question_limit).all()]
+            claimed_ids = []
+            for job_id in candidate_ids:
+                # 条件更新保证多个工作线程/进程不会领取同一个任务
+                claimed = Job.query.filter_by(id=job_id, status='pending').update(
+                    {'status': 'running', 'attempts': Job.attempts + 1, 'updated_at': datetime.utcnow()},
+                    synchronize_session=False
+                )
+                if claimed:
+                    claimed_ids.append(job_id)
+            self.db.session.commit()
+            if claimed_ids:
+                return claimed_ids
+
+    def _worker_loop(self):
+        while not self._stop.is_set():
+            processed = False
+            self._wakeup.clear()
+            with self.app.app_context():
+                try:
+                    job_ids = self._claim_next()
+                    if job_ids:
+                        processed = True
+                        self._run_jobs(job_ids)
+                    else:
+                        processed = self._run_idle()
+                except Exception as e:
+                    self.db.session.rollback()
+                    logger.error(f"AI批改工作线程异常: {str(e)}")
+                finally:
+                    self.db.session.remove()
+            if not processed:
+                self._wakeup.wait(self.poll_interval)
+
+    def _run_idle(self) -> bool:
+        """执行空闲工作，返回是否处理了内容（处理了则立即再检查新任务）"""
+        if self.idle_handler is None or not self._idle_lock.acquire(blocking=False):
+            return False
+        try:
+            count = self.idle_handler()
+            self.db.session.commit()
+            return bool(count)
+        finally:
+            self._idle_lock.release()
+
+    def _run_jobs(self, job_ids):
+        """执行一组任务，批改结果与任务状态在同一事务中提交"""
+        Job = self.job_model
+        jobs = Job.query.filter(Job.id.in_(job_ids)).order_by(Job.id).all()
+        if not jobs:
+            return
+        try:
+            outcomes = self.handler(jobs, self.max_attempts)
+        except Exception as e:
+            self.db.session.rollback()
+            outcomes = {job_id: (False, f"批改异常: {str(e)}") for job_id in job_ids}
+
+        for job in Job.query.filter(Job.id.in_(job_ids)).all():
+            success, message, *rest = outcomes.get(job.id, (False, '未返回批改结果'))
+            retry = rest[0] if rest else True
+            if success:
+                job.status = 'done'
+                job.error_message = None
+            elif not retry or job.attempts >= self.max_attempts:
+                job.status = 'failed'
+                job.error_message = message
+                logger.error(f"AI批改任务失败 - 任务ID: {job.id}, 错误: {message}")
+            else:
+                job.status = 'pending'
+                job.error_message = message
+                logger.warning(f"AI批改任务将重试 - 任务ID: {job.id}, 错误: {message}")
+            job.updated_at = datetime.utcnow()
+        self.db.session.commit()
@@ -0,0 +1,147 @@
+"""
+AI接口健康检查模块
+启动时同步测试AI接口连接最长要等待 10 秒，接口变慢时启动和保存测试设置都会被拖住。
+健康检查在后台线程中定期探测AI接口（复用批改请求的连接池），记录响应时间和失败的变化趋势，
+启动流程和请求处理只读取最近一次的检查结论，不再等待接口
+"""
+
+import threading
+import time
+import logging
+from collections import deque
+from typing import Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 检查结论
+UNKNOWN = 'unknown'    # 尚未完成第一次探测
+HEALTHY = 'healthy'    # 接口正常
+DEGRADED = 'degraded'  # 响应变慢或偶尔失败
+DOWN = 'down'          # 连续探测失败
+
+
+class HealthMonitor:
+    """后台定期探测AI接口的健康检查器（线程安全）
+
+    probe 返回 (是否可用, 说明)；每次探测的结果和耗时保存在最近 window 次的记录中，
+    连续失败 failure_threshold 次判定为 down，最后一次探测失败或响应超过 slow_threshold 秒判定为 degraded。
+    """
+
+    def __init__(self, probe: Callable[[], Tuple[bool, str]], interval: float = 60.0, window: int = 10,
+                 failure_threshold: int = 2, slow_threshold: float = 5.0,
+                 clock: Callable[[], float] = time.time):
+        """
+        Args:
+            probe: 探测函数，返回 (是否可用, 说明)
+            interval: 两次探测的间隔（秒），0 表示只在启动时探测一次
+            window: 计算失败率和响应时间趋势的探测次数
+            failure_threshold: 连续失败多少次判定为 down
+            slow_threshold: 响应时间超过多少秒判定为 degraded
+        """
+        self.probe = probe
+        self.interval = interval
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.slow_threshold = slow_threshold
+        self.clock = clock
+        self._results = deque(maxlen=max(1, int(window)))  # (检查时间, 是否可用, 耗时秒数)
+        self._consecutive_failures = 0
+        self._verdict = UNKNOWN
+        self._message = '正在后台检测AI接口'
+        self._checked_at = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.checks = 0
+
+    def start(self) -> 'HealthMonitor':
+        """启动后台探测线程（立即进行第一次探测）"""
+        with self._lock:
+            if self._thread is None:
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name='ai-health-monitor', daemon=True)
+                self._thread.start()
+        return self
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stop.set()
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout)
+
+    def _run(self):
+        while True:
+            self.check_now()
+            if self.interval <= 0 or self._stop.wait(self.interval):
+                return
+
+    def check_now(self) -> str:
+        """立即探测一次并更新结论（在调用线程中执行）"""
+        start = time.perf_counter()
+        try:
+            ok, message = self.probe()
+        except Exception as e:
+            ok, message = False, f"健康检查失败: {str(e)}"
+        self.record(ok, time.perf_counter() - start, message)
+        return self.verdict
+
+    def record(self, ok: bool, elapsed: float, message: str = ''):
+        """记录一次探测结果"""
+        with self._lock:
+            self.checks += 1
+            self._checked_at = self.clock()
+            self._results.append((self._checked_at, ok, elapsed))
+            self._consecutive_failures = 0 if ok else self._consecutive_failures + 1
+            previous = self._verdict
+            if self._consecutive_failures >= self.failure_threshold:
+                verdict = DOWN
+            elif not ok or elapsed > self.slow_threshold:
+                verdict = DEGRADED
+            else:
+                verdict = HEALTHY
+            self._verdict = verdict
+            self._message = message
+        if verdict != previous:
+            log = logger.info if verdict == HEALTHY else logger.warning
+            log(f"AI接口健康检查: {previous} -> {verdict}（{message}，耗时 {elapsed * 1000:.0f} ms）")
+
+    @property
+    def verdict(self) -> str:
+        with self._lock:
+            return self._verdict
+
+    def is_down(self) -> bool:
+        return self.verdict == DOWN
+
+    def _latency_trend(self) -> Optional[str]:
+        """比较前后两半探测的平均响应时间：rising（变慢）、falling（变快）或 stable；探测次数不足时为 None"""
+        latencies = [result[2] for result in self._results if result[1]]
+        if len(latencies) < 4:
+            return None
+        half = len(latencies) // 2
+        older = sum(latencies[:half]) / half
+        recent = sum(latencies[-half:]) / half
+        if older and recent / older >= 1.5:
+            return 'rising'
+        if older and recent / older <= 2 / 3:
+            return 'falling'
+        return 'stable'
+
+    def status(self) -> Dict:
+        """最近一次的检查结论以及最近 window 次探测的失败率和响应时间"""
+        with self._lock:
+            latencies = sorted(result[2] for result in self._results if result[1])
+            failures = sum(1 for result in self._results if not result[1])
+            return {
+                'verdict': self._verdict,
+                'message': self._message,
+                'checked_at': self._checked_at,
+                'checks': self.checks,
+                'consecutive_failures': self._consecutive_failures,
+                'error_rate': round(failures / len(self._results), 3) if self._results else 0.0,
+                'latency_ms': round(self._results[-1][2] * 1000, 1) if self._results else None,
+                'latency_p50_ms': round(latencies[len(latencies) // 2] * 1000, 1) if latencies else None,
+                'latency_max_ms': round(latencies[-1] * 1000, 1) if latencies else None,
+                'latency_trend': self._latency_trend(),
+                'running': self._thread is not None and self._thread.is_alive()
+            }
@@ -0,0 +1,256 @@
+"""
+模拟AI接口模块
+没有真实的AI接口时无法测试AI批改的性能。本模块在本地启动一个兼容 OpenAI / Anthropic 协议的测试服务器，
+按配置的延迟分布、错误率、限流率和评语长度返回批改结果（支持批量批改、只评分和流式响应），
+AI_GRADING_CONFIG 中 provider 设为 'mock' 即可离线开发、测试和压测
+"""
+
+import json
+import math
+import random
+import re
+import threading
+import time
+import zlib
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    'format': 'openai',       # 协议格式：openai 或 anthropic
+    'latency_ms': 800,        # 响应时间的中位数（毫秒）
+    'latency_sigma': 0.5,     # 响应时间按对数正态分布抖动的 sigma，0 表示固定延迟
+    'error_rate': 0.0,        # 返回 500 的比例
+    'throttle_rate': 0.0,     # 返回 429 的比例
+    'retry_after': 1,         # 429 响应的 Retry-After（秒）
+    'feedback_chars': 200,    # 评语的字符数
+    'stream_chunk_chars': 8,  # 流式响应每段的字符数
+}
+
+
+def merge_settings(settings: Optional[Dict] = None) -> Dict:
+    """在默认设置上覆盖传入的设置"""
+    merged = dict(DEFAULT_SETTINGS)
+    merged.update(settings or {})
+    return merged
+
+
+def sample_latency(settings: Dict, rng: random.Random) -> float:
+    """按对数正态分布抽取一次响应时间（秒）"""
+    median = max(0.0, float(settings['latency_ms'])) / 1000
+    sigma = float(settings['latency_sigma'])
+    if median <= 0 or sigma <= 0:
+        return median
+    return median * math.exp(rng.gauss(0, sigma))
+
+
+def _feedback(length: int) -> str:
+    text = 'AI评语：主要得分点覆盖较好，扣分点为论述不够完整。改进建议：补充关键概念并举例说明。'
+    return (text * (length // len(text) + 1))[:max(length, 5)]
+
+
+def grade_prompt(prompt: str, settings: Dict) -> str:
+    """
+    按批改提示词生成模型输出的文本
+
+    同一提示词总是得到同一分数；批量提示词返回JSON数组，只评分的提示词只返回分数，
+    补充评语的提示词沿用其中已评定的分数。
+    """
+    rng = random.Random(zlib.crc32(prompt.encode('utf-8')))
+    match = re.search(r'题目分值：(\d+)分', prompt)
+    max_score = int(match.group(1)) if match else 10
+    score_only = '只需评分' in prompt
+    feedback = _feedback(int(settings['feedback_chars']))
+
+    numbers = re.findall(r'【学生(\d+)】', prompt)
+    if numbers:
+        items = []
+        for number in numbers:
+            item = {'id': int(number), 'score': rng.randint(0, max_score)}
+            if not score_only:
+                item['feedback'] = feedback
+            items.append(item)
+        return json.dumps(items, ensure_ascii=False)
+
+    awarded = re.search(r'已评定为(\d+)分', prompt)
+    result = {'score': int(awarded.group(1)) if awarded else rng.randint(0, max_score)}
+    if not score_only:
+        result['feedback'] = feedback
+        result['analysis'] = feedback
+    return json.dumps(result, ensure_ascii=False)
+
+
+class MockAIHandler(BaseHTTPRequestHandler):
+    """处理 /chat/completions（OpenAI 格式）和 /messages（Anthropic 格式）请求"""
+
+    protocol_version = 'HTTP/1.1'  # 与真实接口一样支持长连接
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+        with server.lock:
+            rng = random.Random(server.rng.random())
+        server.begin_request()
+        try:
+            latency = sample_latency(server.settings, rng)
+            roll = rng.random()
+            if roll < server.settings['error_rate']:
+                time.sleep(latency)
+                server.count('errors')
+                return self._send_json(500, {'error': {'message': 'mock server error'}})
+            if roll < server.settings['error_rate'] + server.settings['throttle_rate']:
+                server.count('throttled')
+                return self._send_json(429, {'error': {'message': 'mock rate limit'}},
+                                       {'Retry-After': str(server.settings['retry_after'])})
+
+            anthropic = self.path.rstrip('/').endswith('/messages')
+            content = grade_prompt(self._prompt(body), server.settings)
+            if body.get('stream'):
+                server.count('streamed')
+                return self._send_stream(content, latency, anthropic)
+            time.sleep(latency)
+            self._send_json(200, self._response(content, anthropic))
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端已超时、取消或读到所需字段后关闭连接
+            pass
+        finally:
+            server.end_request()
+
+    def _prompt(self, body: Dict) -> str:
+        messages = body.get('messages') or []
+        return '\n'.join(str(message.get('content', '')) for message in messages if message.get('role') == 'user')
+
+    def _response(self, content: str, anthropic: bool) -> Dict:
+        tokens = {'prompt': 500, 'completion': max(1, len(content) // 2)}
+        if anthropic:
+            return {'type': 'message', 'role': 'assistant', 'content': [{'type': 'text', 'text': content}],
+                    'usage': {'input_tokens': tokens['prompt'], 'output_tokens': tokens['completion']}}
+        return {'object': 'chat.completion',
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content},
+                             'finish_reason': 'stop'}],
+                'usage': {'prompt_tokens': tokens['prompt'], 'completion_tokens': tokens['completion'],
+                          'total_tokens': tokens['prompt'] + tokens['completion']}}
+
+    def _send_json(self, status: int, payload: Dict, headers: Optional[Dict] = None):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, content: str, latency: float, anthropic: bool):
+        """逐段发送SSE事件：首段在 1/5 的响应时间后到达，其余在剩余时间内均匀到达"""
+        size = max(1, int(self.server.settings['stream_chunk_chars']))
+        chunks = [content[i:i + size] for i in range(0, len(content), size)]
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        time.sleep(latency / 5)
+        interval = latency * 4 / 5 / max(1, len(chunks))
+        for chunk in chunks:
+            if anthropic:
+                event = {'type': 'content_block_delta', 'index': 0, 'delta': {'type': 'text_delta', 'text': chunk}}
+            else:
+                event = {'choices': [{'index': 0, 'delta': {'content': chunk}}]}
+            self.wfile.write(f'data: {json.dumps(event, ensure_ascii=False)}\n\n'.encode('utf-8'))
+            self.wfile.flush()
+            time.sleep(interval)
+        end = 'data: {"type": "message_stop"}\n\n' if anthropic else 'data: [DONE]\n\n'
+        self.wfile.write(end.encode('utf-8'))
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockAIServer(ThreadingHTTPServer):
+    """模拟AI接口服务器（在后台线程中运行）"""
+
+    daemon_threads = True
+    request_queue_size = 256  # 压测时大量连接同时到达
+
+    def __init__(self, settings: Optional[Dict] = None, host: str = '127.0.0.1', port: int = 0,
+                 seed: Optional[int] = None):
+        """
+        Args:
+            settings: 覆盖 DEFAULT_SETTINGS 的设置
+            host, port: 监听地址，port 为 0 时自动选择空闲端口
+            seed: 随机数种子（延迟和错误的抽取），便于复现
+        """
+        super().__init__((host, port), MockAIHandler)
+        self.settings = merge_settings(settings)
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self._thread = None
+        self.requests = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.errors = 0
+        self.throttled = 0
+        self.streamed = 0
+
+    @property
+    def base_url(self) -> str:
+        """接口地址（OpenAI 格式请求 base_url + '/chat/completions'，Anthropic 格式 base_url + '/messages'）"""
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+    def start(self) -> 'MockAIServer':
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.serve_forever, name='mock-ai-server', daemon=True)
+            self._thread.start()
+            logger.info(f"模拟AI接口已启动: {self.base_url}")
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self.shutdown()
+            self._thread.join()
+            self._thread = None
+        self.server_close()
+
+    def begin_request(self):
+        with self.lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def end_request(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def count(self, name: str):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {
+                'url': self.base_url,
+                'requests': self.requests,
+                'in_flight': self.in_flight,
+                'peak_in_flight': self.peak_in_flight,
+                'errors': self.errors,
+                'throttled': self.throttled,
+                'streamed': self.streamed
+            }
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def get_mock_server(settings: Optional[Dict] = None) -> MockAIServer:
+    """获取进程内共享的模拟AI接口服务器（首次调用时按 settings 启动）"""
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = MockAIServer(settings).start()
+        return _server
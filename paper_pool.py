@@ -0,0 +1,252 @@
+"""
+试卷池模块
+全班同时打开考试页面时，每个请求都要分别抽题、加载题目并编译答案键。
+试卷池在后台为当前测试和可自选的预设预先抽好若干份试卷，请求到来时直接取出一份，
+取出后由后台线程异步补充。每份试卷由抽题种子决定，学生刷新页面时按种子复用同一份试卷
+"""
+
+import random
+import threading
+import logging
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Callable, Dict, Hashable, Iterable, List, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+# 按种子缓存的试卷数量
+SEEDED_PAPER_CACHE_SIZE = 512
+
+
+def new_paper_seed() -> int:
+    """生成一次作答的抽题种子"""
+    return random.SystemRandom().getrandbits(48)
+
+
+class PaperQuestion(NamedTuple):
+    """试卷中的题目数据（脱离数据库会话，可在线程间传递并直接用于渲染和生成快照）"""
+    id: int
+    question_type: str
+    content: str
+    image_path: Optional[str]
+    option_a: Optional[str]
+    option_b: Optional[str]
+    option_c: Optional[str]
+    option_d: Optional[str]
+    option_e: Optional[str]
+    correct_answer: str
+    score: int
+    updated_at: Optional[datetime] = None
+
+    @classmethod
+    def of(cls, question) -> 'PaperQuestion':
+        return cls(*(getattr(question, field, None) for field in cls._fields))
+
+
+class DrawnPaper(NamedTuple):
+    """抽好的一份试卷"""
+    questions: Dict[str, List[PaperQuestion]]  # {题型: 按出题顺序的题目列表}
+    snapshot: str  # 按出题顺序的 QuestionSnapshot 列表（JSON），直接保存为试卷快照
+    seed: Optional[int] = None  # 抽题种子，相同的种子和题库总是抽出相同的试卷
+    option_orders: Optional[Dict[int, str]] = None  # {题目ID: 各位置上原选项的字母}，未打乱选项时为空
+
+
+class SeededPaperCache:
+    """按 (来源, 种子) 缓存抽好的试卷，学生刷新考试页面时直接复用"""
+
+    def __init__(self, capacity: int = SEEDED_PAPER_CACHE_SIZE):
+        self.capacity = max(1, int(capacity))
+        self._papers = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[DrawnPaper]:
+        with self._lock:
+            paper = self._papers.get(key)
+            if paper is None:
+                self.misses += 1
+                return None
+            self._papers.move_to_end(key)
+            self.hits += 1
+            return paper
+
+    def put(self, key: Hashable, paper: DrawnPaper):
+        with self._lock:
+            self._papers[key] = paper
+            self._papers.move_to_end(key)
+            if len(self._papers) > self.capacity:
+                self._papers.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._papers.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'entries': len(self._papers), 'hits': self.hits, 'misses': self.misses}
+
+
+class PaperPool:
+    """预先抽题的试卷池
+
+    每个试卷来源（如 ('test', 测试ID, 内容哈希)）保留最多 depth 份抽好的试卷。
+    来源的题数、分值或题库变化后内容哈希随之变化，旧来源的试卷不会再被取出；
+    题库内容变化时调用 invalidate() 清空试卷池。
+    """
+
+    def __init__(self, app, db, builder: Callable[[Hashable], Optional[DrawnPaper]],
+                 sources: Optional[Callable[[], Iterable[Hashable]]] = None,
+                 enabled: bool = True, depth: int = 10, refill_interval: float = 30.0):
+        """
+        Args:
+            app: Flask 应用实例（补充线程需要应用上下文）
+            db: Flask-SQLAlchemy 实例
+            builder: 抽题函数 builder(来源) -> DrawnPaper，来源已不存在或已变化时返回 None
+            sources: 返回需要预热的来源列表（当前测试和可自选的预设），在补充线程中调用
+            enabled: 是否启用试卷池；关闭时 take() 总是返回 None
+            depth: 每个来源保留的试卷份数
+            refill_interval: 补充线程在没有通知时的检查间隔（秒）
+        """
+        self.app = app
+        self.db = db
+        self.builder = builder
+        self.sources = sources
+        self.enabled = enabled
+        self.depth = max(1, int(depth))
+        self.refill_interval = refill_interval
+        self._papers = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._generation = 0
+        self._sources_loaded = False
+        self.hits = 0
+        self.misses = 0
+        self.built = 0
+
+    @property
+    def started(self) -> bool:
+        return self._thread is not None
+
+    def start(self):
+        """启动补充线程（重复调用无副作用）"""
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._thread:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._refill_loop, name='paper-pool', daemon=True)
+            self._thread.start()
+            logger.info(f"试卷池已启动，每个测试预备 {self.depth} 份试卷")
+        self._wakeup.set()
+
+    def stop(self, timeout: Optional[float] = None):
+        """停止补充线程"""
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+            self._stop.set()
+            self._wakeup.set()
+        if thread:
+            thread.join(timeout)
+
+    def take(self, source: Hashable) -> Optional[DrawnPaper]:
+        """
+        取出一份抽好的试卷
+
+        Returns:
+            DrawnPaper；池中没有时返回 None，由调用方当场抽题，并通知补充线程为该来源预备试卷
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            papers = self._papers.setdefault(source, deque())
+            paper = papers.popleft() if papers else None
+            if paper is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if not self.started:
+            self.start()
+        self._wakeup.set()
+        return paper
+
+    def invalidate(self):
+        """清空试卷池，并重新读取需要预热的来源"""
+        with self._lock:
+            self._generation += 1
+            self._papers.clear()
+            self._sources_loaded = False
+        if self.started:
+            self._wakeup.set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'depth': self.depth,
+                'sources': len(self._papers),
+                'papers': {repr(source): len(papers) for source, papers in self._papers.items()},
+                'hits': self.hits,
+                'misses': self.misses,
+                'built': self.built,
+                'generation': self._generation
+            }
+
+    def _refill_loop(self):
+        with self.app.app_context():
+            while not self._stop.is_set():
+                self._wakeup.wait(self.refill_interval)
+                self._wakeup.clear()
+                if self._stop.is_set():
+                    break
+                try:
+                    self._load_sources()
+                    self.refill()
+                except Exception as e:
+                    logger.error(f"试卷池补充失败: {str(e)}")
+                finally:
+                    self.db.session.remove()
+
+    def _load_sources(self):
+        """登记需要预热的来源（试卷池失效后重新读取）"""
+        if self.sources is None:
+            return
+        with self._lock:
+            if self._sources_loaded:
+                return
+            generation = self._generation
+        sources = list(self.sources())
+        with self._lock:
+            if self._generation != generation:
+                return
+            for source in sources:
+                self._papers.setdefault(source, deque())
+            self._sources_loaded = True
+
+    def refill(self):
+        """为每个来源补足试卷（在应用上下文中调用）"""
+        with self._lock:
+            pending = [source for source, papers in self._papers.items() if len(papers) < self.depth]
+        for source in pending:
+            while not self._stop.is_set():
+                with self._lock:
+                    generation = self._generation
+                    papers = self._papers.get(source)
+                    if papers is None or len(papers) >= self.depth:
+                        break
+                paper = self.builder(source)
+                with self._lock:
+                    if self._generation != generation:
+                        # 抽题期间试卷池已失效，丢弃可能过期的试卷，下一轮重新补充
+                        self._wakeup.set()
+                        return
+                    if paper is None:
+                        # 来源已不存在或已变化
+                        self._papers.pop(source, None)
+                        break
+                    self._papers[source].append(paper)
+                    self.built += 1
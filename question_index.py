@@ -0,0 +1,88 @@
+"""
+题目ID索引模块
+按 (题库ID, 题型) 在内存中缓存题目ID数组，随机抽题时只需在数组上抽样再按ID批量查询，
+抽题耗时只与试卷题量有关，不再随题库大小增长
+"""
+
+import random
+import threading
+from array import array
+from typing import Callable, Iterable, List, Optional
+
+
+class QuestionIdIndex:
+    """进程内的题目ID索引
+
+    每个 (题库ID, 题型) 的题目ID以紧凑的整数数组保存，首次抽题时加载。
+    题库内容变化后调用 invalidate() 使相应索引失效，下次抽题时重新加载。
+    """
+
+    def __init__(self, loader: Callable[[Optional[int], str], Iterable[int]]):
+        """
+        Args:
+            loader: 加载函数 loader(bank_id, question_type) -> 题目ID序列，
+                bank_id 为 None 时表示不限题库
+        """
+        self._loader = loader
+        self._ids = {}
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def generation(self) -> int:
+        """索引版本号，每次失效时递增（可用于判断依赖题库的缓存是否过期）"""
+        return self._generation
+
+    def get(self, bank_id: Optional[int], question_type: str) -> array:
+        """获取题目ID数组，不存在时加载"""
+        key = (bank_id, question_type)
+        with self._lock:
+            ids = self._ids.get(key)
+            generation = self._generation
+            if ids is not None:
+                self.hits += 1
+                return ids
+            self.misses += 1
+        ids = array('q', self._loader(bank_id, question_type))
+        with self._lock:
+            # 加载期间索引被置为失效时不保存，避免缓存旧数据
+            if self._generation == generation:
+                self._ids[key] = ids
+        return ids
+
+    def sample(self, bank_id: Optional[int], question_type: str, count: int,
+               rng: Optional[random.Random] = None) -> List[int]:
+        """随机抽取最多 count 个不重复的题目ID"""
+        if count <= 0:
+            return []
+        ids = self.get(bank_id, question_type)
+        return (rng or random).sample(ids, min(count, len(ids)))
+
+    def invalidate(self, bank_id: Optional[int] = None):
+        """
+        使索引失效
+
+        Args:
+            bank_id: 内容发生变化的题库ID；为 None 时清空全部索引
+        """
+        with self._lock:
+            self._generation += 1
+            if bank_id is None:
+                self._ids.clear()
+                return
+            for key in list(self._ids):
+                # 不限题库的索引也包含该题库的题目
+                if key[0] == bank_id or key[0] is None:
+                    del self._ids[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'entries': len(self._ids),
+                'question_ids': sum(len(ids) for ids in self._ids.values()),
+                'hits': self.hits,
+                'misses': self.misses,
+                'generation': self._generation
+            }
@@ -0,0 +1,286 @@
+"""
+AI接口限流模块
+全班提交时所有批改线程同时请求AI接口，遇到429后又一起退避、一起重试，吞吐量大起大落。
+限流器按提供商共享：令牌桶同时限制每分钟请求数和token数，并发上限按 AIMD 自适应调整
+（请求成功时缓慢增加，遇到限流时减半），429 响应的 Retry-After 会让该提供商的所有请求一起暂停
+"""
+
+import asyncio
+import json
+import random
+import threading
+import time
+import logging
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+# 令牌桶最多积累多少秒的配额（允许的突发量）
+BURST_SECONDS = 10
+
+# 连续的限流响应通常来自同一个配额窗口，这段时间（秒）内只把并发上限减半一次
+DECREASE_COOLDOWN = 1.0
+
+# 异步等待并发名额时的检查间隔（秒）
+ASYNC_POLL_INTERVAL = 0.05
+
+# 请求结果
+OK = 'ok'
+THROTTLED = 'throttled'
+ERROR = 'error'
+
+
+def parse_retry_after(value) -> Optional[float]:
+    """解析 Retry-After 响应头（秒数或HTTP日期），无法解析时返回 None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def retry_delay(attempt: int, retry_after: Optional[float] = None, base: float = 1.0, cap: float = 30.0) -> float:
+    """
+    计算重试前的等待时间
+
+    有 Retry-After 时按服务器要求等待并加少量随机抖动，否则使用带抖动的指数退避，
+    避免所有线程在同一时刻重试。
+    """
+    if retry_after is not None:
+        return retry_after + random.uniform(0, base)
+    delay = min(cap, base * 2 ** attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def request_max_tokens(data: Dict, default: int) -> int:
+    """请求体中的最大输出token数（批量批改、评语等请求各自设置），没有时返回 default"""
+    for value in (data.get('max_tokens'), data.get('max_output_tokens'),
+                  (data.get('parameters') or {}).get('max_tokens')):
+        if value:
+            return int(value)
+    return int(default or 0)
+
+
+def estimate_tokens(data: Dict, max_tokens: int) -> int:
+    """
+    估算一次请求消耗的token数（提示词按每2个字符1个token估算，加上最大输出token数）
+
+    max_tokens 为默认的最大输出token数，请求体中设置了 max_tokens 时以请求为准。
+    """
+    return len(json.dumps(data, ensure_ascii=False)) // 2 + request_max_tokens(data, max_tokens)
+
+
+def used_tokens(response: Dict) -> Optional[int]:
+    """从响应中读取实际消耗的token数（各提供商的 usage 格式不同），没有时返回 None"""
+    usage = response.get('usage') if isinstance(response, dict) else None
+    if not isinstance(usage, dict):
+        return None
+    if 'total_tokens' in usage:
+        return int(usage['total_tokens'])
+    if 'input_tokens' in usage or 'output_tokens' in usage:
+        return int(usage.get('input_tokens', 0)) + int(usage.get('output_tokens', 0))
+    return None
+
+
+class TokenBucket:
+    """令牌桶：每分钟补充 per_minute 个令牌，最多积累 BURST_SECONDS 秒的配额
+
+    预留令牌时允许透支，调用方等待透支部分补充所需的时间，先到先得。
+    """
+
+    def __init__(self, per_minute: float, clock: Callable[[], float] = time.monotonic):
+        self.per_minute = float(per_minute)
+        self.rate = self.per_minute / 60.0
+        self.capacity = max(1.0, self.rate * BURST_SECONDS)
+        self.clock = clock
+        self.tokens = self.capacity
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float) -> float:
+        """预留令牌，返回需要等待的秒数"""
+        self._refill()
+        # 单次请求超过桶容量时按桶容量计算，否则永远无法满足
+        self.tokens -= min(amount, self.capacity)
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+    def refund(self, amount: float):
+        """退还（amount 为负数时补扣）令牌"""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+    def available(self) -> float:
+        self._refill()
+        return self.tokens
+
+
+class Permit(NamedTuple):
+    """一次请求占用的并发名额和预留的token数"""
+    tokens: int
+    started: float
+
+
+class ProviderRateLimiter:
+    """单个AI提供商的限流器（线程安全，同步和异步请求共用）"""
+
+    def __init__(self, name: str, requests_per_minute: float = 0, tokens_per_minute: float = 0,
+                 max_concurrency: int = 8, min_concurrency: int = 1, adaptive: bool = True,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            name: 提供商名称
+            requests_per_minute: 每分钟请求数上限（0 表示不限制）
+            tokens_per_minute: 每分钟token数上限（0 表示不限制）
+            max_concurrency: 并发请求数上限
+            min_concurrency: 自适应调整时并发上限的下限
+            adaptive: 是否按 AIMD 自适应调整并发上限
+        """
+        self.name = name
+        self.clock = clock
+        self.requests = TokenBucket(requests_per_minute, clock) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute, clock) if tokens_per_minute else None
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.min_concurrency = max(1, min(int(min_concurrency), self.max_concurrency))
+        self.adaptive = adaptive
+        self.limit = float(self.max_concurrency)
+        self.in_flight = 0
+        self.waiting = 0
+        self.paused_until = 0.0
+        self.granted = 0
+        self.throttled = 0
+        self.decreases = 0
+        self._last_decrease = float('-inf')
+        self._cond = threading.Condition()
+
+    def _try_acquire(self, tokens: int) -> Optional[float]:
+        """
+        在锁内尝试占用并发名额并预留配额
+
+        Returns:
+            需要等待的秒数（已占用名额）；暂停中或并发已满时返回 None
+        """
+        if self.clock() < self.paused_until or self.in_flight >= int(self.limit):
+            return None
+        self.in_flight += 1
+        self.granted += 1
+        wait = 0.0
+        if self.requests is not None:
+            wait = max(wait, self.requests.reserve(1))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.reserve(tokens))
+        return wait
+
+    def _blocked_for(self) -> Optional[float]:
+        """暂停中时返回剩余的暂停时间，否则返回 None（等待其他请求释放名额）"""
+        remaining = self.paused_until - self.clock()
+        return remaining if remaining > 0 else None
+
+    def acquire(self, tokens: int = 0) -> Permit:
+        """占用一个并发名额并等待配额（阻塞当前线程），请求结束后必须调用 release()"""
+        with self._cond:
+            self.waiting += 1
+            try:
+                while True:
+                    wait = self._try_acquire(tokens)
+                    if wait is not None:
+                        break
+                    self._cond.wait(self._blocked_for() or 1.0)
+            finally:
+                self.waiting -= 1
+        if wait > 0:
+            time.sleep(wait)
+        return Permit(tokens, self.clock())
+
+    async def acquire_async(self, tokens: int = 0) -> Permit:
+        """占用一个并发名额并等待配额（异步版本）"""
+        with self._cond:
+            self.waiting += 1
+        try:
+            while True:
+                with self._cond:
+                    wait = self._try_acquire(tokens)
+                    blocked = self._blocked_for()
+                if wait is not None:
+                    break
+                await asyncio.sleep(blocked or ASYNC_POLL_INTERVAL)
+        finally:
+            with self._cond:
+                self.waiting -= 1
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return Permit(tokens, self.clock())
+
+    def release(self, permit: Permit, outcome: str = OK, retry_after: Optional[float] = None,
+                tokens_used: Optional[int] = None):
+        """
+        释放并发名额，并根据请求结果调整并发上限
+
+        Args:
+            permit: acquire() 返回的名额
+            outcome: OK（成功）、THROTTLED（429限流）或 ERROR（其他失败，不调整并发上限）
+            retry_after: 限流响应要求的等待时间（秒），期间该提供商的请求全部暂停
+            tokens_used: 实际消耗的token数，与预留数的差额退还或补扣
+        """
+        with self._cond:
+            self.in_flight -= 1
+            if tokens_used is not None and self.tokens is not None:
+                self.tokens.refund(permit.tokens - tokens_used)
+            now = self.clock()
+            if outcome == THROTTLED:
+                self.throttled += 1
+                if self.adaptive and now - self._last_decrease >= DECREASE_COOLDOWN:
+                    self.limit = max(float(self.min_concurrency), self.limit / 2)
+                    self._last_decrease = now
+                    self.decreases += 1
+                    logger.warning(f"AI接口限流（{self.name}），并发上限降为 {int(self.limit)}")
+                if retry_after:
+                    self.paused_until = max(self.paused_until, now + retry_after)
+            elif outcome == OK and self.adaptive:
+                # 每轮并发请求全部成功大约增加 1
+                self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+    def stats(self) -> Dict:
+        with self._cond:
+            return {
+                'provider': self.name,
+                'concurrency_limit': int(self.limit),
+                'max_concurrency': self.max_concurrency,
+                'in_flight': self.in_flight,
+                'waiting': self.waiting,
+                'requests_per_minute': self.requests.per_minute if self.requests else None,
+                'tokens_per_minute': self.tokens.per_minute if self.tokens else None,
+                'available_requests': int(self.requests.available()) if self.requests else None,
+                'available_tokens': int(self.tokens.available()) if self.tokens else None,
+                'paused_for': round(max(0.0, self.paused_until - self.clock()), 2),
+                'granted': self.granted,
+                'throttled': self.throttled,
+                'decreases': self.decreases
+            }
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(provider: str, **settings) -> ProviderRateLimiter:
+    """获取提供商共享的限流器（同一提供商首次创建时的设置生效）"""
+    with _limiters_lock:
+        limiter = _limiters.get(provider)
+        if limiter is None:
+            limiter = _limiters[provider] = ProviderRateLimiter(provider, **settings)
+        return limiter
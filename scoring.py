@@ -0,0 +1,206 @@
+"""
+评分引擎模块
+将题目编译为答案键（预先标准化的正确答案），所有路由共用同一套评分规则
+"""
+
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, NamedTuple, Optional, Tuple
+
+# 题型列表
+QUESTION_TYPES = ('single_choice', 'multiple_choice', 'true_false', 'fill_blank', 'short_answer')
+
+# 多选题有效选项
+CHOICE_LETTERS = 'ABCDE'
+
+# 答案键缓存容量
+ANSWER_KEY_CACHE_SIZE = 4096
+
+
+def normalize_choice(answer) -> str:
+    """标准化单选题/判断题答案"""
+    return (answer or '').strip().upper()
+
+
+def normalize_multiple_choice(answer) -> str:
+    """标准化多选题答案为排序后的选项字母串，如 'A,C' -> 'AC'"""
+    return ''.join(sorted(c for c in (answer or '').upper() if c in CHOICE_LETTERS))
+
+
+# 参考答案中同一个空的多个可接受答案之间的分隔符，如 "计算机|电脑"
+ALIAS_SEPARATOR = '|'
+
+
+def split_blanks(text) -> list:
+    """
+    按原始文本分割各个填空（保留原文），支持顿号和英文逗号
+
+    全角逗号不作分隔符，可出现在空内；自动评分和AI批改前的本地比对都使用本函数。
+    """
+    text = (text or '').replace(',', '、')
+    return [f.strip() for f in text.split('、') if f.strip()]
+
+
+def blank_aliases(blank) -> list:
+    """参考答案中一个空的全部可接受答案"""
+    return [alias.strip() for alias in (blank or '').split(ALIAS_SEPARATOR) if alias.strip()]
+
+
+def split_fill_answers(text) -> list:
+    """分割填空题答案，支持顿号和英文逗号（全角逗号不作分隔符，可出现在空内），忽略大小写和首尾空白"""
+    return [f.lower() for f in split_blanks(text)]
+
+
+class QuestionSnapshot(NamedTuple):
+    """试卷中保存的题目评分快照，可代替 Question 对象参与评分"""
+    id: int
+    question_type: str
+    correct_answer: str
+    updated_at: Optional[datetime] = None
+
+    def to_json(self) -> list:
+        return [self.id, self.question_type, self.correct_answer,
+                self.updated_at.isoformat() if self.updated_at else None]
+
+    @classmethod
+    def from_json(cls, data) -> 'QuestionSnapshot':
+        qid, q_type, correct_answer, version = data
+        return cls(qid, q_type, correct_answer, datetime.fromisoformat(version) if version else None)
+
+    @classmethod
+    def of(cls, question) -> 'QuestionSnapshot':
+        return cls(question.id, question.question_type, question.correct_answer,
+                   getattr(question, 'updated_at', None))
+
+
+class AnswerKey:
+    """编译后的答案键，只保存评分需要的标准化数据"""
+
+    __slots__ = ('question_id', 'question_type', 'version', 'choice', 'blanks')
+
+    def __init__(self, question_id, question_type, version, choice=None, blanks=None):
+        self.question_id = question_id
+        self.question_type = question_type
+        self.version = version
+        self.choice = choice      # 单选/判断：标准化答案；多选：排序后的选项字母串
+        self.blanks = blanks      # 填空：各空可接受答案（标准化后）的元组
+
+    def score(self, answer, points) -> Tuple[Optional[float], Optional[bool]]:
+        """
+        对单个答案评分
+
+        Args:
+            answer: 学生答案
+            points: 该题型每题分值
+
+        Returns:
+            Tuple[score, is_correct]: 简答题返回 (None, None)，需由人工或AI评分
+        """
+        points = points or 0
+        q_type = self.question_type
+        if q_type in ('single_choice', 'true_false'):
+            is_correct = normalize_choice(answer) == self.choice
+            return (points if is_correct else 0), is_correct
+        if q_type == 'multiple_choice':
+            is_correct = normalize_multiple_choice(answer) == self.choice
+            return (points if is_correct else 0), is_correct
+        if q_type == 'fill_blank':
+            num_blanks = len(self.blanks)
+            if num_blanks == 0:
+                return 0, False
+            student_blanks = split_fill_answers(answer)
+            correct_count = sum(1 for i in range(min(len(student_blanks), num_blanks))
+                                if student_blanks[i] in self.blanks[i])
+            # 每空平均分配分数，按答对的空数给部分分
+            score_per_blank = round(points / num_blanks, 1)
+            return round(score_per_blank * correct_count), correct_count == num_blanks
+        return None, None
+
+
+def compile_answer_key(question) -> AnswerKey:
+    """将题目编译为答案键（不使用缓存）"""
+    q_type = question.question_type
+    version = getattr(question, 'updated_at', None)
+    if q_type in ('single_choice', 'true_false'):
+        return AnswerKey(question.id, q_type, version, choice=normalize_choice(question.correct_answer))
+    if q_type == 'multiple_choice':
+        return AnswerKey(question.id, q_type, version, choice=normalize_multiple_choice(question.correct_answer))
+    if q_type == 'fill_blank':
+        blanks = tuple(tuple(alias.lower() for alias in blank_aliases(blank))
+                       for blank in split_blanks(question.correct_answer))
+        return AnswerKey(question.id, q_type, version, blanks=tuple(blank for blank in blanks if blank))
+    return AnswerKey(question.id, q_type, version)
+
+
+_answer_key_cache = OrderedDict()
+_answer_key_lock = threading.Lock()
+
+
+def get_answer_key(question) -> AnswerKey:
+    """
+    获取题目的答案键，按 (题目ID, 更新时间) 缓存
+
+    题目被编辑后更新时间变化，旧的答案键自然失效，重复评分不再做字符串标准化。
+    """
+    cache_key = (question.id, getattr(question, 'updated_at', None))
+    with _answer_key_lock:
+        key = _answer_key_cache.get(cache_key)
+        if key is not None:
+            _answer_key_cache.move_to_end(cache_key)
+            return key
+    key = compile_answer_key(question)
+    with _answer_key_lock:
+        _answer_key_cache[cache_key] = key
+        if len(_answer_key_cache) > ANSWER_KEY_CACHE_SIZE:
+            _answer_key_cache.popitem(last=False)
+    return key
+
+
+def clear_answer_key_cache():
+    """清空答案键缓存"""
+    with _answer_key_lock:
+        _answer_key_cache.clear()
+
+
+def points_for(test_config, question_type) -> int:
+    """获取测试配置中某题型的每题分值，test_config 可以是 Test/TestPreset 对象或字典"""
+    field = f'{question_type}_score'
+    if isinstance(test_config, dict):
+        value = test_config.get(field)
+    else:
+        value = getattr(test_config, field, 0)
+    return value or 0
+
+
+def score_answers(answers: Dict, question_map: Dict, test_config,
+                  graded_scores: Optional[Dict] = None) -> Tuple[float, Dict]:
+    """
+    一次遍历对整份答卷评分
+
+    Args:
+        answers: {题目ID: 学生答案}，题目ID可以是整数或字符串
+        question_map: {题目ID(int): Question}
+        test_config: 测试配置（提供各题型分值）
+        graded_scores: {题目ID(int): 分数}，已由人工或AI评定的分数，优先于自动评分
+
+    Returns:
+        Tuple[total, details]: 总分（未取整）和 {题目ID: (score, is_correct)}
+    """
+    graded_scores = graded_scores or {}
+    total = 0
+    details = {}
+    for qid, answer in answers.items():
+        qid = int(qid)
+        question = question_map.get(qid)
+        if not question:
+            continue
+        if qid in graded_scores:
+            score = graded_scores[qid]
+            points = points_for(test_config, question.question_type)
+            is_correct = None if question.question_type == 'short_answer' else (score == points)
+        else:
+            score, is_correct = get_answer_key(question).score(answer, points_for(test_config, question.question_type))
+        details[qid] = (score, is_correct)
+        total += score or 0
+    return total, details
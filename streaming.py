@@ -0,0 +1,154 @@
+"""
+AI接口流式响应模块
+批改提示词只需要一个很小的JSON对象，但非流式请求要等模型写完全部内容（填空题还要求写很长的 analysis）。
+流式请求边接收边解析，评分所需的字段（如 score 和 feedback）全部完整后立即结束并关闭连接，
+不再等待和计费其余输出
+"""
+
+import json
+from typing import Dict, Iterable, Optional
+
+# 支持流式响应的提供商及其响应格式
+STREAM_FORMATS = {
+    'openai': 'openai',
+    'azure': 'openai',
+    'anthropic': 'anthropic',
+}
+
+_decoder = json.JSONDecoder()
+
+
+class IncrementalJSONFields:
+    """增量解析JSON对象的顶层字段
+
+    每收到一段文本调用 feed()，已经完整的顶层字段保存在 fields 中；
+    数字等标量只有在后面出现分隔符后才算完整（"8" 之后可能还有 "5"）。
+    对象之前的文字（如 ```json）会被忽略。
+    """
+
+    def __init__(self):
+        self.buffer = ''
+        self.fields = {}
+        self.closed = False
+        self._pos = None  # 下一个待解析字符的位置，None 表示尚未遇到 '{'
+
+    def feed(self, text: str):
+        self.buffer += text
+        if self.closed:
+            return
+        if self._pos is None:
+            start = self.buffer.find('{')
+            if start < 0:
+                return
+            self._pos = start + 1
+        while self._parse_next_field():
+            pass
+
+    def _skip(self, pos: int, chars: str = ' \t\r\n') -> int:
+        while pos < len(self.buffer) and self.buffer[pos] in chars:
+            pos += 1
+        return pos
+
+    def _parse_next_field(self) -> bool:
+        """解析下一个完整的字段，成功时返回 True；内容不完整时返回 False 等待更多文本"""
+        buffer = self.buffer
+        pos = self._skip(self._pos, ' \t\r\n,')
+        if pos >= len(buffer):
+            return False
+        if buffer[pos] == '}':
+            self.closed = True
+            return False
+        try:
+            key, pos = _decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            return False
+        pos = self._skip(pos)
+        if pos >= len(buffer) or buffer[pos] != ':':
+            return False
+        pos = self._skip(pos + 1)
+        try:
+            value, end = _decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            return False
+        if not isinstance(value, (str, dict, list)) and end >= len(buffer):
+            return False
+        if isinstance(key, str):
+            self.fields[key] = value
+        self._pos = end
+        return True
+
+    def has(self, names) -> bool:
+        return all(name in self.fields for name in names)
+
+
+class StreamReader:
+    """读取一次流式响应（SSE），所需字段完整后提示调用方结束读取"""
+
+    def __init__(self, provider: str, stop_fields=()):
+        """
+        Args:
+            provider: 提供商名称（须在 STREAM_FORMATS 中）
+            stop_fields: 这些顶层字段全部完整后即可结束读取；为空时读取到流结束
+        """
+        self.format = STREAM_FORMATS[provider]
+        self.stop_fields = tuple(stop_fields)
+        self.parser = IncrementalJSONFields()
+        self.finished = False
+        self.stopped_early = False
+
+    def feed_line(self, line: str) -> bool:
+        """
+        处理一行SSE数据
+
+        Returns:
+            bool: 是否可以结束读取（所需字段已完整或流已结束）
+        """
+        line = line.strip()
+        if not line.startswith('data:'):
+            return self.finished
+        data = line[5:].strip()
+        if data == '[DONE]':
+            self.finished = True
+            return True
+        try:
+            event = json.loads(data)
+        except json.JSONDecodeError:
+            return self.finished
+        text = self._delta_text(event)
+        if text:
+            self.parser.feed(text)
+        if self.stop_fields and self.parser.has(self.stop_fields):
+            self.stopped_early = True
+            self.finished = True
+        return self.finished
+
+    def _delta_text(self, event: Dict) -> Optional[str]:
+        if self.format == 'openai':
+            choices = event.get('choices') or []
+            return (choices[0].get('delta') or {}).get('content') if choices else None
+        if event.get('type') == 'message_stop':
+            self.finished = True
+        if event.get('type') == 'content_block_delta':
+            return (event.get('delta') or {}).get('text')
+        return None
+
+    def read(self, lines: Iterable[str]) -> Dict:
+        """从行迭代器读取，返回 response()"""
+        for line in lines:
+            if self.feed_line(line):
+                break
+        return self.response()
+
+    def response(self) -> Dict:
+        """
+        转换为与非流式响应相同格式的结果
+
+        提前结束时只包含已完整的字段，否则为模型输出的全部文本。
+        """
+        if self.stopped_early:
+            content = json.dumps(self.parser.fields, ensure_ascii=False)
+        else:
+            content = self.parser.buffer
+        if self.format == 'openai':
+            return {'choices': [{'message': {'content': content}}]}
+        return {'content': [{'type': 'text', 'text': content}]}
@@ -0,0 +1,162 @@
+"""
+提交写入模块
+考试高峰期全班集中提交时，把多个请求的写操作合并到同一个事务中，由单个写线程提交，
+避免大量请求各自开启 SQLite 写事务后在数据库锁上排队超时
+"""
+
+import queue
+import threading
+import time
+import logging
+from concurrent.futures import Future
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class GroupCommitWriter:
+    """合并提交的写入器
+
+    请求线程调用 write() 把写操作放入队列并等待结果；写线程每次取出一批写操作，
+    在同一个事务中依次执行后一次性提交。某个写操作出错时回滚本批次，
+    将出错的写操作单独报错，其余写操作重新执行，不影响同批的其他请求。
+
+    写操作函数在写线程的应用上下文中执行，只修改 db.session 不提交，
+    参数应为普通数据（不要传入请求线程会话中的 ORM 对象）。
+    """
+
+    def __init__(self, app, db, enabled: bool = True, max_batch: int = 50,
+                 max_wait: float = 0.005, timeout: float = 30):
+        """
+        Args:
+            app: Flask 应用实例（写线程需要应用上下文）
+            db: Flask-SQLAlchemy 实例
+            enabled: 是否启用合并写入；关闭时在请求线程中直接执行并提交
+            max_batch: 单个事务最多合并的写操作数
+            max_wait: 取到第一个写操作后等待更多写操作的时间（秒）
+            timeout: 请求等待写入完成的最长时间（秒）
+        """
+        self.app = app
+        self.db = db
+        self.enabled = enabled
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait = max(0.0, float(max_wait))
+        self.timeout = timeout
+        self._queue = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.writes = 0
+
+    @property
+    def started(self) -> bool:
+        return self._thread is not None
+
+    def start(self):
+        """启动写线程（重复调用无副作用）"""
+        with self._lock:
+            if self._thread:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._writer_loop, name='submission-writer', daemon=True)
+            self._thread.start()
+            logger.info("提交写入线程已启动")
+
+    def stop(self, timeout: Optional[float] = None):
+        """处理完队列中已有的写操作后停止写线程"""
+        with self._lock:
+            if not self._thread:
+                return
+            self._stop.set()
+            self._queue.put(None)
+            self._thread.join(timeout)
+            self._thread = None
+
+    def submit(self, write_fn: Callable, *args, **kwargs) -> Future:
+        """把写操作放入队列，返回在其事务提交后完成的 Future"""
+        if not self.started:
+            self.start()
+        future = Future()
+        self._queue.put((write_fn, args, kwargs, future))
+        return future
+
+    def write(self, write_fn: Callable, *args, **kwargs):
+        """
+        执行写操作并等待提交完成
+
+        Returns:
+            写操作函数的返回值
+
+        Raises:
+            写操作或提交时的异常；等待超时时抛出 concurrent.futures.TimeoutError
+        """
+        if not self.enabled:
+            session = self.db.session
+            try:
+                value = write_fn(*args, **kwargs)
+                session.commit()
+                return value
+            except Exception:
+                session.rollback()
+                raise
+        return self.submit(write_fn, *args, **kwargs).result(self.timeout)
+
+    def _writer_loop(self):
+        with self.app.app_context():
+            while not self._stop.is_set():
+                item = self._queue.get()
+                if item is None:
+                    continue
+                batch = [item]
+                deadline = time.monotonic() + self.max_wait
+                while len(batch) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    try:
+                        item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        continue
+                    batch.append(item)
+                try:
+                    self._flush(batch)
+                except Exception as e:
+                    logger.error(f"提交写入线程发生错误: {str(e)}")
+                    for _, _, _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                finally:
+                    self.db.session.remove()
+
+    def _flush(self, batch):
+        """在一个事务中执行一批写操作并提交"""
+        session = self.db.session
+        pending = [item for item in batch if item[3].set_running_or_notify_cancel()]
+        while pending:
+            values = []
+            failed_index = None
+            for index, (write_fn, args, kwargs, future) in enumerate(pending):
+                try:
+                    values.append(write_fn(*args, **kwargs))
+                except Exception as e:
+                    session.rollback()
+                    future.set_exception(e)
+                    failed_index = index
+                    break
+            if failed_index is not None:
+                # 出错的写操作已单独报错，其余写操作在新事务中重新执行
+                pending = pending[:failed_index] + pending[failed_index + 1:]
+                continue
+            try:
+                session.commit()
+            except Exception as e:
+                session.rollback()
+                for _, _, _, future in pending:
+                    future.set_exception(e)
+                return
+            self.batches += 1
+            self.writes += len(pending)
+            for (_, _, _, future), value in zip(pending, values):
+                future.set_result(value)
+            return
@@ -0,0 +1,36 @@
+"""
+测试公共配置
+
+Flask-SQLAlchemy 在导入 app 时按 DATABASE_URI 创建数据库引擎，之后修改 SQLALCHEMY_DATABASE_URI 不再生效。
+因此在导入 app 之前把 DATABASE_URI 指向临时数据库，测试中的 drop_all() 不会清空仓库中的数据库
+"""
+
+import os
+import tempfile
+
+import pytest
+
+_db_fd, _db_path = tempfile.mkstemp(suffix='.db')
+os.close(_db_fd)
+os.environ['DATABASE_URI'] = f'sqlite:///{_db_path}'
+
+
+def pytest_unconfigure(config):
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(_db_path + suffix):
+            os.unlink(_db_path + suffix)
+
+
+@pytest.fixture
+def database():
+    """重建临时数据库的全部表，在应用上下文中运行测试，结束后删除全部表"""
+    from app import app, db
+
+    app.config['TESTING'] = True
+    with app.app_context():
+        assert db.engine.url.database == _db_path
+        db.drop_all()
+        db.create_all()
+        yield db
+        db.session.remove()
+        db.drop_all()
@@ -0,0 +1,146 @@
+"""
+AI接口异步请求客户端的单元测试
+
+请求发送到本地测试服务器，不访问真实的AI接口
+"""
+
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip('aiohttp')
+
+from ai_async_client import AsyncAIClient
+from streaming import StreamReader
+
+
+class SlowHandler(BaseHTTPRequestHandler):
+    """按服务器的 delay 延迟后返回请求中的 n"""
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        if body.get('stream'):
+            return self._stream()
+        time.sleep(self.server.delay)
+        payload = json.dumps({'n': body['n']}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        try:
+            self.wfile.write(payload)
+        except BrokenPipeError:
+            # 客户端已超时或取消请求
+            pass
+
+    def _stream(self):
+        """逐段返回SSE数据，评分字段之后是很长、很慢的 analysis"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+        parts = ['{"score": 5, ', '"feedback": "ok", ', '"analysis": "'] + ['x' * 50] * 40
+        try:
+            for part in parts:
+                chunk = {'choices': [{'delta': {'content': part}}]}
+                self.wfile.write(f'data: {json.dumps(chunk)}\n\n'.encode('utf-8'))
+                self.wfile.flush()
+                time.sleep(0.05)
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端已读到所需字段并关闭连接
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # 默认的 5 容纳不下同时到达的连接
+
+
+@pytest.fixture
+def server():
+    httpd = StubServer(('127.0.0.1', 0), SlowHandler)
+    httpd.delay = 0.2
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _url(server):
+    return f'http://127.0.0.1:{server.server_address[1]}/v1/chat/completions'
+
+
+def test_many_requests_run_on_one_loop_thread(server):
+    """
+    单元测试：大量请求在同一个事件循环线程上同时进行，总耗时约为单次请求耗时
+    """
+    client = AsyncAIClient(timeout=5, max_retries=1, max_in_flight=100)
+
+    async def send_all():
+        return await asyncio.gather(*(client.post_json(_url(server), {}, {'n': i}) for i in range(50)))
+
+    start = time.monotonic()
+    results = client.call(send_all())
+    elapsed = time.monotonic() - start
+    try:
+        assert [response['n'] for _, response in results] == list(range(50))
+        assert all(success for success, _ in results)
+        assert elapsed < 3.0, f"异步请求耗时过长: {elapsed:.2f}s"
+        assert len([t for t in threading.enumerate() if t.name == 'ai-event-loop']) == 1
+        stats = client.stats()
+        assert stats['requests'] == 50
+        assert stats['peak_in_flight'] > 1
+        assert stats['in_flight'] == 0
+    finally:
+        client.stop(5)
+
+
+def test_request_timeout_and_cancellation(server):
+    """
+    单元测试：单个请求超时返回错误；取消等待方时请求一并取消
+    """
+    server.delay = 1.0
+    client = AsyncAIClient(timeout=0.2, max_retries=1)
+    try:
+        success, result = client.call(client.post_json(_url(server), {}, {'n': 1}))
+        assert success is False
+        assert result['error_message'] == 'API请求超时'
+    finally:
+        client.stop(5)
+
+    client = AsyncAIClient(timeout=5, max_retries=1)
+    try:
+        future = client.submit(client.post_json(_url(server), {}, {'n': 2}))
+        time.sleep(0.2)
+        future.cancel()
+        deadline = time.monotonic() + 2
+        while client.stats()['cancelled'] == 0 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert client.stats()['cancelled'] == 1
+        assert client.stats()['in_flight'] == 0
+    finally:
+        client.stop(5)
+
+
+def test_stream_closes_after_required_fields(server):
+    """
+    单元测试：流式响应读到所需字段后立即结束，不等待其余输出
+    """
+    client = AsyncAIClient(timeout=5, max_retries=1)
+    try:
+        start = time.monotonic()
+        success, result = client.call(client.post_json(
+            _url(server), {}, {'stream': True}, lambda: StreamReader('openai', ('score', 'feedback'))))
+        elapsed = time.monotonic() - start
+        assert success
+        assert json.loads(result['choices'][0]['message']['content']) == {'score': 5, 'feedback': 'ok'}
+        assert elapsed < 1.0, f"流式请求没有提前结束: {elapsed:.2f}s"
+    finally:
+        client.stop(5)
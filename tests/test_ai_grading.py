@@ -0,0 +1,282 @@
+"""
+AI批改服务的单元测试
+
+所有测试都不访问真实的AI接口
+"""
+
+import asyncio
+import time
+import pytest
+from ai_grading_service import AIGradingService
+
+
+@pytest.fixture
+def ai_service(monkeypatch):
+    """创建已启用的AI批改服务实例"""
+    service = AIGradingService()
+    monkeypatch.setattr(service, 'enabled', True)
+    return service
+
+
+def test_grade_many_runs_concurrently(ai_service, monkeypatch):
+    """
+    单元测试：grade_many 并发批改，总耗时约为单次请求耗时，结果顺序与输入一致
+    """
+    def slow_grade(question, reference_answer, student_answer, max_score, question_type='short_answer'):
+        time.sleep(0.3)
+        return True, {'score': int(student_answer), 'feedback': question}
+
+    monkeypatch.setattr(ai_service, 'grade_answer', slow_grade)
+    items = [{
+        'question': f'题目{i}',
+        'reference_answer': '参考答案',
+        'student_answer': str(i),
+        'max_score': 10
+    } for i in range(5)]
+
+    start = time.monotonic()
+    results = ai_service.grade_many(items)
+    elapsed = time.monotonic() - start
+
+    assert [r[1]['score'] for r in results] == [0, 1, 2, 3, 4]
+    assert all(success for success, _ in results)
+    assert elapsed < 1.0, f"并发批改耗时过长: {elapsed:.2f}s"
+
+
+def test_grade_many_isolates_failures(ai_service, monkeypatch):
+    """
+    单元测试：单道题批改异常不影响同批其他题目
+    """
+    def flaky_grade(question, reference_answer, student_answer, max_score, question_type='short_answer'):
+        if student_answer == 'bad':
+            raise RuntimeError('boom')
+        return True, {'score': 1, 'feedback': 'ok'}
+
+    monkeypatch.setattr(ai_service, 'grade_answer', flaky_grade)
+    items = [
+        {'question': 'q1', 'reference_answer': 'r', 'student_answer': 'good', 'max_score': 1},
+        {'question': 'q2', 'reference_answer': 'r', 'student_answer': 'bad', 'max_score': 1},
+    ]
+    results = ai_service.grade_many(items)
+    assert results[0][0] is True
+    assert results[1][0] is False
+    assert 'error_message' in results[1][1]
+
+
+def test_requests_share_one_http_session(ai_service, monkeypatch):
+    """
+    单元测试：所有批改请求复用同一个HTTP会话（连接池），不再调用模块级 requests.post
+    """
+    session = ai_service._get_http_session()
+    assert ai_service._get_http_session() is session
+
+    calls = []
+
+    class FakeResponse:
+        status_code = 200
+
+        def json(self):
+            return {'ok': True}
+
+    def fake_post(url, **kwargs):
+        calls.append(url)
+        return FakeResponse()
+
+    def fail_module_post(*args, **kwargs):
+        raise AssertionError('不应调用模块级 requests.post')
+
+    monkeypatch.setattr(session, 'post', fake_post)
+    monkeypatch.setattr('ai_grading_service.requests.post', fail_module_post)
+
+    assert ai_service._send_request('https://example.com/v1/chat', {}, {}) == (True, {'ok': True})
+    assert calls == ['https://example.com/v1/chat']
+    assert ai_service.get_connection_stats()['requests'] == 0
+
+
+def test_fill_blank_precheck_avoids_api_calls(ai_service, monkeypatch):
+    """
+    单元测试：本地能判定的填空题不调用AI接口，只有无法判定的填空交给AI
+    """
+    prompts = []
+
+    def fake_ai(question, reference_answer, student_answer, max_score, score_only=False):
+        # 批改步骤是生成器（见 AIGradingService._drive）
+        prompts.append((reference_answer, student_answer, max_score))
+        return True, {'score': max_score, 'feedback': 'AI评语：正确'}
+        yield
+
+    monkeypatch.setattr(ai_service, 'result_cache', None)
+    monkeypatch.setattr(ai_service, '_grade_fill_blank_with_ai', fake_ai)
+
+    success, result = ai_service.grade_answer('题目', '中央处理器|CPU、内存', 'cpu、内存', 10, 'fill_blank')
+    assert success and result['score'] == 10
+    assert prompts == []
+
+    success, result = ai_service.grade_answer('题目', '中央处理器、内存', '处理器芯片、内存', 10, 'fill_blank')
+    assert success and result['score'] == 10
+    assert prompts == [('中央处理器', '处理器芯片', 1)]
+    assert ai_service.get_precheck_stats()['api_calls_avoided'] == 1
+
+
+def test_grade_many_batches_answers_to_same_question(ai_service, monkeypatch):
+    """
+    单元测试：同一道简答题的多份答案合并为一次请求；缺失或无效的结果回退为逐份批改
+    """
+    prompts = []
+
+    def fake_request(user_prompt, stop_fields=(), max_tokens=None):
+        prompts.append(user_prompt)
+        if '【学生1】' not in user_prompt:
+            return True, {'choices': [{'message': {'content': '{"score": 3, "feedback": "单独批改"}'}}]}
+        content = ('```json\n[{"id": 1, "score": 4, "feedback": "AI评语：较好"},'
+                   ' {"id": 2, "score": 99, "feedback": ""},'
+                   ' {"id": 9, "score": 1, "feedback": "越界"},'
+                   ' {"id": 3, "score": "无"}]\n```')
+        return True, {'choices': [{'message': {'content': content}}]}
+
+    monkeypatch.setattr(ai_service, 'result_cache', None)
+    monkeypatch.setitem(ai_service.config, 'provider', 'openai')
+    monkeypatch.setitem(ai_service.config, 'batch_grading', True)
+    monkeypatch.setitem(ai_service.config, 'batch_max_size', 10)
+    monkeypatch.setitem(ai_service.config, 'max_tokens', 1000)
+    monkeypatch.setattr(ai_service, '_make_api_request', fake_request)
+
+    items = [{'question': '简述光合作用', 'reference_answer': '合成有机物', 'student_answer': answer,
+              'max_score': 5} for answer in ('答案一', '答案二', '答案三', ' 答案一 ')]
+    results = ai_service.grade_many(items)
+
+    assert [r[1]['score'] for r in results] == [4, 5, 3, 4]
+    assert results[1][1]['feedback'].startswith('AI评语')
+    assert results[2][1]['feedback'] == '单独批改'
+    # 一次批量请求（相同答案只发送一次）加一次回退请求
+    assert len(prompts) == 2
+    assert '【学生3】' in prompts[0] and '【学生4】' not in prompts[0]
+    stats = ai_service.get_batch_stats()
+    assert stats['batches'] == 1 and stats['answers'] == 2 and stats['fallbacks'] == 1
+
+
+def test_batch_size_follows_max_tokens(ai_service, monkeypatch):
+    """
+    单元测试：每批答案数受 max_tokens 和 batch_max_size 限制，答案平均分批
+    """
+    monkeypatch.setitem(ai_service.config, 'batch_grading', True)
+    monkeypatch.setitem(ai_service.config, 'batch_max_size', 10)
+    monkeypatch.setitem(ai_service.config, 'max_tokens', 1000)
+    assert ai_service.batch_size() == 6
+    assert [len(chunk) for chunk in ai_service._batch_chunks(list(range(13)))] == [5, 4, 4]
+    monkeypatch.setitem(ai_service.config, 'max_tokens', 100)
+    assert ai_service.batch_size() == 1
+    monkeypatch.setitem(ai_service.config, 'max_tokens', 1000)
+    monkeypatch.setitem(ai_service.config, 'batch_grading', False)
+    assert ai_service.batch_size() == 1
+
+
+def test_grade_many_async_runs_in_one_event_loop(ai_service, monkeypatch):
+    """
+    单元测试：异步接口在同一个事件循环中同时发出全部请求，结果顺序与输入一致
+    """
+    in_flight = []
+    peak = []
+
+    async def fake_request(user_prompt, stop_fields=(), max_tokens=None):
+        in_flight.append(user_prompt)
+        peak.append(len(in_flight))
+        await asyncio.sleep(0.3)
+        in_flight.remove(user_prompt)
+        score = int(user_prompt.split('题目：第')[1].split('题')[0])
+        return True, {'choices': [{'message': {'content': f'{{"score": {score}, "feedback": "ok"}}'}}]}
+
+    monkeypatch.setattr(ai_service, 'result_cache', None)
+    monkeypatch.setitem(ai_service.config, 'provider', 'openai')
+    monkeypatch.setitem(ai_service.config, 'async_requests', False)
+    monkeypatch.setattr(ai_service, '_make_api_request_async', fake_request)
+    items = [{'question': f'第{i}题', 'reference_answer': '参考答案', 'student_answer': '答案',
+              'max_score': 10} for i in range(20)]
+
+    start = time.monotonic()
+    results = asyncio.run(ai_service.grade_many_async(items))
+    elapsed = time.monotonic() - start
+
+    assert [result['score'] for _, result in results] == [min(i, 10) for i in range(20)]
+    assert max(peak) == 20
+    assert elapsed < 1.0, f"异步批改耗时过长: {elapsed:.2f}s"
+
+
+def test_circuit_breaker_fails_fast_when_provider_is_down(ai_service, monkeypatch):
+    """
+    单元测试：接口连续失败后熔断，熔断期间不再发送请求也不再等待重试
+    """
+    from circuit_breaker import CircuitBreaker
+    import requests
+
+    calls = []
+
+    def broken_post(url, **kwargs):
+        calls.append(url)
+        raise requests.exceptions.ConnectionError('connection refused')
+
+    monkeypatch.setattr(ai_service, 'result_cache', None)
+    monkeypatch.setattr(ai_service, 'circuit_breaker', CircuitBreaker(failure_threshold=2, reset_timeout=60))
+    monkeypatch.setitem(ai_service.config, 'provider', 'openai')
+    monkeypatch.setitem(ai_service.config, 'max_retries', 5)
+    monkeypatch.setattr(ai_service._get_http_session(), 'post', broken_post)
+    monkeypatch.setattr('ai_grading_service.time.sleep', lambda seconds: None)
+
+    success, result = ai_service.grade_answer('题目', '参考答案', '答案', 10)
+    assert not success and result['circuit_open']
+    assert len(calls) == 2  # 熔断后不再重试
+
+    start = time.monotonic()
+    success, result = ai_service.grade_answer('题目', '参考答案', '另一个答案', 10)
+    assert not success and result['circuit_open']
+    assert len(calls) == 2
+    assert time.monotonic() - start < 0.05
+    assert ai_service.get_circuit_stats()['state'] == 'open'
+
+
+def test_score_only_then_feedback_keeps_score(ai_service, monkeypatch):
+    """
+    单元测试：只评分的请求使用较小的 max_tokens 且不返回评语；补充评语时分数保持不变
+    """
+    requests_sent = []
+
+    def fake_request(user_prompt, stop_fields=(), max_tokens=None):
+        requests_sent.append((user_prompt, stop_fields, max_tokens))
+        if max_tokens is not None:
+            content = '{"score": 6}'
+        else:
+            content = '{"score": 9, "feedback": "AI评语：要点齐全"}'
+        return True, {'choices': [{'message': {'content': content}}]}
+
+    monkeypatch.setattr(ai_service, 'result_cache', None)
+    monkeypatch.setitem(ai_service.config, 'provider', 'openai')
+    monkeypatch.setitem(ai_service.config, 'score_only_max_tokens', 40)
+    monkeypatch.setattr(ai_service, '_make_api_request', fake_request)
+
+    success, result = ai_service.grade_answer('题目', '参考答案', '学生答案', 10, score_only=True)
+    assert success
+    assert result == {'score': 6, 'feedback': '', 'feedback_pending': True}
+    assert requests_sent[0][2] == 40
+    assert '只需评分' in requests_sent[0][0]
+
+    success, result = ai_service.generate_feedback('题目', '参考答案', '学生答案', 10, score=6)
+    assert success
+    assert result['score'] == 6
+    assert result['feedback'] == 'AI评语：要点齐全'
+    assert '已评定为6分' in requests_sent[1][0]
+    assert requests_sent[1][2] is None
+
+
+def test_missing_aiohttp_falls_back_without_changing_config(monkeypatch):
+    """
+    单元测试：未安装 aiohttp 时该服务实例改用同步请求，共享的 AI_GRADING_CONFIG 保持不变
+    """
+    import ai_async_client
+    from ai_grading_service import AIGradingService
+    from config import AI_GRADING_CONFIG
+
+    monkeypatch.setitem(AI_GRADING_CONFIG, 'async_requests', True)
+    monkeypatch.setattr(ai_async_client, 'is_available', lambda: False)
+    service = AIGradingService()
+    assert service._get_async_client() is None
+    assert AI_GRADING_CONFIG['async_requests'] is True
@@ -0,0 +1,74 @@
+"""
+熔断器的单元测试
+"""
+
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, is_failure_status
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_trips_after_consecutive_failures_and_recovers():
+    """
+    单元测试：连续失败后熔断并拒绝请求，超时后放行一个探测请求，探测成功即恢复
+    """
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=10, clock=clock)
+    for _ in range(3):
+        assert breaker.allow()
+        breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    assert breaker.stats()['retry_in'] == 10
+
+    clock.now += 10
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow()
+    assert not breaker.allow()  # 同时只放行一个探测请求
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.allow()
+    stats = breaker.stats()
+    assert stats['trips'] == 1
+    assert stats['rejected'] == 2
+
+
+def test_failed_probe_reopens():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=5, clock=clock)
+    breaker.record_failure()
+    clock.now += 5
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+
+
+def test_trips_on_failure_ratio():
+    """
+    单元测试：失败不连续但最近的失败率过高时熔断
+    """
+    breaker = CircuitBreaker(failure_threshold=3, failure_ratio=0.5, window=10)
+    for _ in range(4):
+        breaker.record_success()
+    for _ in range(2):
+        breaker.record_failure()
+        breaker.record_failure()
+        breaker.record_success()
+    # 最近10次中失败4次
+    assert breaker.state == CLOSED
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert breaker.stats()['consecutive_failures'] == 1
+
+
+def test_rate_limit_is_not_a_failure():
+    assert is_failure_status(500)
+    assert is_failure_status(401)
+    assert not is_failure_status(429)
+    assert not is_failure_status(400)
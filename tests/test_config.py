@@ -8,7 +8,7 @@ import pytest
 from hypothesis import given, strategies as st, settings, assume
 import tempfile
 import os
-from app import app, db, Test, TestPreset, Question, QuestionBank, User
+from app import app, db, Test, TestPreset, TestResult, Question, QuestionBank, User, merge_duplicate_preset_tests
 
 
 @pytest.fixture
@@ -406,3 +406,67 @@ def test_preset_delete(test_app):
         with test_app.app_context():
             preset = TestPreset.query.get(preset_id)
             assert preset is None, "预设应该已被删除"
+
+
+def _preset_test_count(preset_id):
+    return Test.query.filter_by(preset_id=preset_id).count()
+
+
+def test_preset_submissions_share_one_test(test_app):
+    """
+    单元测试：同一版本的预设只对应一条测试记录，修改分值后生成新版本
+    """
+    with test_app.app_context():
+        bank = QuestionBank.query.filter_by(name='single_choice_bank').order_by(QuestionBank.id.desc()).first()
+        preset = TestPreset(title='共享预设', single_choice_count=2, single_choice_score=5,
+                            single_choice_bank_id=bank.id)
+        db.session.add(preset)
+        db.session.commit()
+        preset_id = preset.id
+
+    for i in range(3):
+        with test_app.test_client() as client:
+            client.post('/student/start', data={'name': f'学生{i}', 'class_number': '001',
+                                                'test_content': preset_id})
+            assert client.get('/test').status_code == 200
+            client.post('/submit_test', data={})
+
+    with test_app.app_context():
+        assert _preset_test_count(preset_id) == 1
+        test = Test.query.filter_by(preset_id=preset_id).first()
+        assert test.title == '预设测试: 共享预设'
+        assert TestResult.query.filter_by(test_id=test.id).count() == 3
+
+        TestPreset.query.get(preset_id).single_choice_score = 10
+        db.session.commit()
+
+    with test_app.test_client() as client:
+        client.post('/student/start', data={'name': '学生9', 'class_number': '001', 'test_content': preset_id})
+        client.get('/test')
+
+    with test_app.app_context():
+        assert _preset_test_count(preset_id) == 2
+
+
+def test_merge_duplicate_preset_tests(test_app):
+    """
+    单元测试：合并旧版本重复创建的预设测试记录，成绩改为关联保留的记录
+    """
+    with test_app.app_context():
+        preset = TestPreset(title='旧预设', single_choice_count=1, single_choice_score=5)
+        db.session.add(preset)
+        legacy = [Test(title='预设测试: 旧预设', single_choice_count=1, single_choice_score=5,
+                       total_score=5, is_active=False) for _ in range(3)]
+        db.session.add_all(legacy)
+        db.session.flush()
+        for test in legacy:
+            db.session.add(TestResult(student_name='学生', class_number='001', test_id=test.id,
+                                      score=5, answers='{}'))
+        db.session.commit()
+        legacy_ids = [test.id for test in legacy]
+
+        assert merge_duplicate_preset_tests() == 2
+        remaining = Test.query.filter(Test.id.in_(legacy_ids)).all()
+        assert len(remaining) == 1
+        assert remaining[0].preset_id == preset.id
+        assert TestResult.query.filter_by(test_id=remaining[0].id).count() == 3
@@ -0,0 +1,84 @@
+"""
+填空题本地预批改的单元测试
+"""
+
+from types import SimpleNamespace
+
+from fill_blank_matcher import FillBlankMatcher, edit_distance, normalize_blank
+from scoring import compile_answer_key
+
+
+def test_normalization_ignores_case_width_and_trailing_punctuation():
+    assert normalize_blank('ＣＰＵ。') == normalize_blank('cpu')
+    assert normalize_blank(' 中央 处理器！') == '中央处理器'
+    assert normalize_blank('３．１４％') == '3.14%'
+    assert normalize_blank('x²') != normalize_blank('x2')
+
+
+def test_numeric_sign_and_fraction_answers_are_not_decided_by_stripping():
+    """小数点、负号、分数线和冒号是答案的一部分，去掉后才一致的答案交给AI判定"""
+    matcher = FillBlankMatcher(edit_tolerance=1)
+    for reference, answer in (('3.14', '314'), ('-2', '2'), ('1/2', '12'), ('3:2', '32'), ('50%', '50')):
+        match = matcher.match('填空', reference, answer)
+        assert match.correct == 0
+        assert match.undecided == [0]
+    for reference, answer in (('3.14', '３．１４'), ('-2', ' -2 '), ('1/2', '1/2。')):
+        assert matcher.match('填空', reference, answer).decided
+
+
+def test_aliases_and_exact_matches_are_decided_locally():
+    """同义答案和标准化后一致的答案在本地判定"""
+    match = FillBlankMatcher().match('计算机的核心部件是__和__', '中央处理器|CPU、内存', 'cpu,内存')
+    assert match.decided
+    assert (match.correct, match.total) == (2, 2)
+
+
+def test_order_free_question_matches_any_position():
+    """题目注明顺序不限时，答案可以出现在任意位置"""
+    matcher = FillBlankMatcher()
+    assert matcher.match('写出两种三原色（顺序不限）', '红、绿', '绿、红').correct == 2
+    ordered = matcher.match('写出两种三原色', '红、绿', '绿、红')
+    assert ordered.correct == 0
+    assert ordered.undecided == [0, 1]
+
+
+def test_only_unknown_blanks_are_escalated():
+    """拼写接近的长英文单词本地判对，无法判定的空交给AI，空白的空直接判错"""
+    match = FillBlankMatcher(edit_tolerance=1).match('题目', 'photosynthesis、叶绿体、氧气', 'photosynthesys、叶子')
+    assert match.correct == 1
+    assert match.undecided == [1]
+    assert match.undecided_references == ['叶绿体']
+    assert match.undecided_answers == ['叶子']
+
+
+def test_chinese_near_misses_are_escalated():
+    """中文答案差一个字常常意思相反（否定、反义），不容许编辑距离，交给AI判定"""
+    matcher = FillBlankMatcher(edit_tolerance=1)
+    for reference, answer in (('可逆反应', '不可逆反应'), ('负反馈调节', '正反馈调节'), ('光合作用', '光合做用')):
+        match = matcher.match('填空', reference, answer)
+        assert match.correct == 0
+        assert match.undecided == [0]
+
+
+def test_short_answers_need_exact_match():
+    match = FillBlankMatcher(edit_tolerance=1).match('题目', '北京', '南京')
+    assert match.correct == 0
+    assert not match.decided
+
+
+def test_edit_distance_limit():
+    assert edit_distance('kitten', 'sitting', 3) == 3
+    assert edit_distance('abc', 'abcdef', 1) == 2
+
+
+def test_matcher_and_auto_scoring_agree_on_aliases_and_separators():
+    """本地比对和自动评分使用同一套分空和同义答案规则：| 分隔同义答案，全角逗号留在空内"""
+    reference = '计算机|电脑、温度，压强'
+    key = compile_answer_key(SimpleNamespace(id=1, question_type='fill_blank', correct_answer=reference))
+    matcher = FillBlankMatcher(edit_tolerance=0)
+    for answer, correct in (('电脑、温度，压强', 2), ('计算机、温度', 1), ('电脑,温度,压强', 1)):
+        match = matcher.match('填空', reference, answer)
+        score, is_correct = key.score(answer, 2)
+        assert match.total == len(key.blanks) == 2
+        assert match.correct == score == correct
+        assert is_correct == (correct == 2)
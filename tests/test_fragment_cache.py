@@ -0,0 +1,35 @@
+"""
+题目片段缓存的单元测试
+"""
+
+from fragment_cache import FragmentCache
+
+
+def test_fragment_rendered_once_per_key():
+    """同一键只渲染一次，版本变化后重新渲染"""
+    cache = FragmentCache()
+    renders = []
+
+    def render(text):
+        renders.append(text)
+        return text
+
+    assert cache.get((1, 'v1', 'single_choice'), lambda: render('a')) == 'a'
+    assert cache.get((1, 'v1', 'single_choice'), lambda: render('b')) == 'a'
+    assert cache.get((1, 'v2', 'single_choice'), lambda: render('c')) == 'c'
+    assert renders == ['a', 'c']
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 2
+
+
+def test_least_recently_used_fragment_evicted():
+    """超出容量时淘汰最久未使用的片段"""
+    cache = FragmentCache(capacity=2)
+    cache.get(1, lambda: 'one')
+    cache.get(2, lambda: 'two')
+    cache.get(1, lambda: 'unused')
+    cache.get(3, lambda: 'three')
+
+    assert cache.get(1, lambda: 'reloaded') == 'one'
+    assert cache.get(2, lambda: 'reloaded') == 'reloaded'
+    assert cache.stats()['entries'] == 2
@@ -0,0 +1,60 @@
+"""
+AI批改结果缓存的单元测试
+"""
+
+import os
+import tempfile
+import pytest
+from grading_cache import GradingResultCache, normalize_student_answer
+
+
+@pytest.fixture
+def cache_path():
+    db_fd, db_path = tempfile.mkstemp(suffix='.db')
+    os.close(db_fd)
+    yield db_path
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(db_path + suffix):
+            os.unlink(db_path + suffix)
+
+
+def _key(cache, student_answer, question='题目', max_score=10):
+    return cache.make_key(question, '参考答案', student_answer, max_score, 'short_answer',
+                          'openai', 'gpt-3.5-turbo', 0.3)
+
+
+def test_equivalent_answers_share_key(cache_path):
+    """仅全半角和空白不同的答案使用同一个键，题目或分值不同时键不同"""
+    cache = GradingResultCache(cache_path, 'v1')
+    assert _key(cache, ' 光合作用  需要光 ') == _key(cache, '光合作用 需要光')
+    assert _key(cache, 'ＡＢＣ') == _key(cache, 'ABC')
+    assert _key(cache, '答案') != _key(cache, '答案', question='修改后的题目')
+    assert _key(cache, '答案') != _key(cache, '答案', max_score=5)
+
+
+def test_results_survive_reopen(cache_path):
+    """缓存保存在文件中，重新打开后仍可命中"""
+    cache = GradingResultCache(cache_path, 'v1')
+    key = _key(cache, '答案')
+    assert cache.get(key) is None
+    cache.put(key, {'score': 8, 'feedback': 'AI评语：很好'})
+    assert cache.get(key) == {'score': 8, 'feedback': 'AI评语：很好'}
+    assert cache.stats()['hit_rate'] == 0.5
+
+    reopened = GradingResultCache(cache_path, 'v1')
+    assert reopened.get(key)['score'] == 8
+
+
+def test_prompt_change_drops_results(cache_path):
+    """提示词版本变化后旧结果被清除"""
+    cache = GradingResultCache(cache_path, 'v1')
+    cache.put(_key(cache, '答案'), {'score': 1, 'feedback': ''})
+
+    changed = GradingResultCache(cache_path, 'v2')
+    assert changed.stats()['entries'] == 0
+    assert changed.get(_key(changed, '答案')) is None
+
+
+def test_fill_blank_normalization():
+    assert normalize_student_answer('CPU， 内存,硬盘', 'fill_blank') == 'cpu、内存、硬盘'
+    assert normalize_student_answer('CPU', 'short_answer') == 'CPU'
@@ -0,0 +1,338 @@
+"""
+AI批改任务队列的单元测试
+
+验证提交时只登记待批改任务，后台批改完成后回填分数
+"""
+
+import pytest
+from app import (app, db, Test, TestResult, Question, QuestionBank, ShortAnswerSubmission,
+                 StudentTestHistory, GradingJob, grading_job_queue, apply_ai_grading_result)
+from ai_grading_service import get_ai_grading_service
+
+
+@pytest.fixture
+def test_app_with_ai_test(database, monkeypatch):
+    """创建包含AI批改简答题测试的测试应用实例（临时数据库见 conftest.py）"""
+    ai_service = get_ai_grading_service()
+    monkeypatch.setattr(ai_service, 'enabled', True)
+    # 测试中不启动后台线程，由测试手动执行任务
+    monkeypatch.setattr(grading_job_queue, 'notify', lambda: None)
+
+    bank = QuestionBank(name='short_answer_bank', question_type='short_answer')
+    db.session.add(bank)
+    db.session.flush()
+    question = Question(
+        question_type='short_answer',
+        content='简述光合作用',
+        correct_answer='植物利用光能合成有机物',
+        score=10,
+        bank_id=bank.id
+    )
+    db.session.add(question)
+    test = Test(
+        title='AI批改测试',
+        short_answer_count=1,
+        short_answer_score=10,
+        short_answer_bank_id=bank.id,
+        short_answer_grading_method='ai',
+        total_score=10,
+        is_active=True
+    )
+    db.session.add(test)
+    db.session.commit()
+
+    yield app
+
+
+def _submit_short_answer(client, answer):
+    client.post('/student/start', data={'name': '测试学生', 'class_number': '001'})
+    assert client.get('/test').status_code == 200
+    with app.app_context():
+        question_id = Question.query.filter_by(question_type='short_answer').first().id
+    response = client.post('/submit_test', data={f'answer_{question_id}': answer}, follow_redirects=False)
+    assert response.status_code == 302
+    return question_id
+
+
+def test_submit_enqueues_pending_job(test_app_with_ai_test, monkeypatch):
+    """
+    单元测试：提交时不调用AI，只保存待批改记录和任务
+    """
+    def fail_if_called(*args, **kwargs):
+        raise AssertionError('提交请求中不应同步调用AI批改')
+    monkeypatch.setattr(get_ai_grading_service(), 'grade_answer', fail_if_called)
+
+    with test_app_with_ai_test.test_client() as client:
+        question_id = _submit_short_answer(client, '光合作用合成有机物')
+
+    with test_app_with_ai_test.app_context():
+        result = TestResult.query.first()
+        assert result.score == 0
+        submission = ShortAnswerSubmission.query.filter_by(result_id=result.id, question_id=question_id).first()
+        assert submission.score is None
+        assert submission.graded_bool is False
+        job = GradingJob.query.filter_by(result_id=result.id).first()
+        assert job is not None
+        assert job.status == 'pending'
+        assert job.max_score == 10
+
+
+def test_worker_fills_score_and_history(test_app_with_ai_test, monkeypatch):
+    """
+    单元测试：后台执行任务后回填提交记录、测试总分和学生历史
+    """
+    monkeypatch.setattr(get_ai_grading_service(), 'grade_answer',
+                        lambda **kwargs: (True, {'score': 8, 'feedback': 'AI评语：不错'}))
+
+    with test_app_with_ai_test.test_client() as client:
+        _submit_short_answer(client, '光合作用合成有机物')
+
+    with test_app_with_ai_test.app_context():
+        job_ids = grading_job_queue._claim_next()
+        assert len(job_ids) == 1
+        job_id = job_ids[0]
+        grading_job_queue._run_jobs(job_ids)
+
+        job = GradingJob.query.get(job_id)
+        assert job.status == 'done'
+        result = TestResult.query.first()
+        assert result.score == 8
+        submission = ShortAnswerSubmission.query.filter_by(result_id=result.id).first()
+        assert submission.score == 8
+        assert submission.graded_bool is True
+        assert submission.ai_feedback == 'AI评语：不错'
+        history = StudentTestHistory.query.filter_by(student_id=result.student_id).first()
+        assert history.highest_score == 8
+
+
+def test_circuit_open_hands_over_to_manual_grading(test_app_with_ai_test, monkeypatch):
+    """
+    单元测试：AI接口熔断时任务立即失败不再重试，题目保留为待人工批改
+    """
+    ai_service = get_ai_grading_service()
+    monkeypatch.setattr(ai_service, 'grade_answer',
+                        lambda **kwargs: (False, ai_service._circuit_open_error()))
+
+    with test_app_with_ai_test.test_client() as client:
+        _submit_short_answer(client, '光合作用合成有机物')
+
+    with test_app_with_ai_test.app_context():
+        job_ids = grading_job_queue._claim_next()
+        grading_job_queue._run_jobs(job_ids)
+
+        job = GradingJob.query.get(job_ids[0])
+        assert job.status == 'failed'
+        assert job.attempts == 1
+        submission = ShortAnswerSubmission.query.first()
+        assert submission.graded_bool is False
+        assert submission.score is None
+        assert '人工批改' in submission.comment
+
+
+def test_two_phase_grading_generates_feedback_on_view(test_app_with_ai_test, monkeypatch):
+    """
+    单元测试：两阶段批改时后台只评分，查看成绩后由批改队列在后台按已评定的分数生成评语，分数不变
+    """
+    from config import AI_GRADING_CONFIG
+    ai_service = get_ai_grading_service()
+    monkeypatch.setitem(AI_GRADING_CONFIG, 'two_phase_grading', True)
+    grade_calls = []
+    feedback_calls = []
+
+    def score_only_grade(**kwargs):
+        grade_calls.append(kwargs)
+        return True, {'score': 7, 'feedback': '', 'feedback_pending': True}
+
+    def fake_feedback(items):
+        feedback_calls.extend(items)
+        return [(True, {'score': item['score'], 'feedback': 'AI评语：要点基本覆盖'}) for item in items]
+
+    monkeypatch.setattr(ai_service, 'grade_answer', score_only_grade)
+    monkeypatch.setattr(ai_service, 'generate_feedback_many', fake_feedback)
+
+    with test_app_with_ai_test.test_client() as client:
+        _submit_short_answer(client, '光合作用合成有机物')
+        with test_app_with_ai_test.app_context():
+            grading_job_queue._run_jobs(grading_job_queue._claim_next())
+            result = TestResult.query.first()
+            result_id = result.id
+            assert result.score == 7
+            submission = ShortAnswerSubmission.query.first()
+            assert submission.ai_feedback is None
+            assert grade_calls[0]['score_only'] is True
+
+        assert client.get(f'/test_result/{result_id}').status_code == 200
+        # 查看成绩的请求不等待AI接口
+        assert feedback_calls == []
+        with test_app_with_ai_test.app_context():
+            assert grading_job_queue._run_idle()
+        assert client.get(f'/test_result/{result_id}').status_code == 200
+
+    with test_app_with_ai_test.app_context():
+        submission = ShortAnswerSubmission.query.first()
+        assert submission.score == 7
+        assert submission.ai_feedback == 'AI评语：要点基本覆盖'
+        assert submission.comment == 'AI评语：要点基本覆盖'
+        assert TestResult.query.first().score == 7
+    # 评语只生成一次
+    assert len(feedback_calls) == 1
+    assert feedback_calls[0]['score'] == 7 and feedback_calls[0]['max_score'] == 10
+
+
+def test_interrupted_job_is_recovered(test_app_with_ai_test):
+    """
+    单元测试：崩溃遗留的 running 任务在重启时恢复为 pending
+    """
+    with test_app_with_ai_test.test_client() as client:
+        _submit_short_answer(client, '答案')
+
+    with test_app_with_ai_test.app_context():
+        job_id = grading_job_queue._claim_next()[0]
+        assert GradingJob.query.get(job_id).status == 'running'
+
+    assert grading_job_queue.recover() == 1
+    with test_app_with_ai_test.app_context():
+        assert GradingJob.query.get(job_id).status == 'pending'
+
+
+def test_manual_grade_applies_delta_and_cancels_job(test_app_with_ai_test):
+    """
+    单元测试：教师评分按分差更新总分，并取消该题尚未执行的AI批改任务
+    """
+    with test_app_with_ai_test.test_client() as client:
+        question_id = _submit_short_answer(client, '答案')
+        with test_app_with_ai_test.app_context():
+            result_id = TestResult.query.first().id
+
+        with client.session_transaction() as sess:
+            sess['role'] = 'teacher'
+        for score in (6, 9):
+            client.post('/grade_short_answer_by_result', data={
+                'result_id': result_id, 'question_id': question_id, 'score': score, 'comment': '人工评分'
+            })
+
+    with test_app_with_ai_test.app_context():
+        result = TestResult.query.get(result_id)
+        assert result.score == 9
+        assert GradingJob.query.filter_by(result_id=result_id).first().status == 'done'
+        history = StudentTestHistory.query.filter_by(student_id=result.student_id).first()
+        assert (history.total_score, history.highest_score) == (9, 9)
+
+
+def test_rescore_counts_pending_ai_questions_as_zero(test_app_with_ai_test, monkeypatch):
+    """
+    单元测试：AI批改尚未完成时重新计算总分，待批改的填空题按 0 分计算，批改完成后不会重复计分
+    """
+    monkeypatch.setattr(get_ai_grading_service(), 'grade_answer',
+                        lambda **kwargs: (True, {'score': 8, 'feedback': 'AI评语：不错'}))
+    bank = QuestionBank(name='fill_blank_bank', question_type='fill_blank')
+    db.session.add(bank)
+    db.session.flush()
+    db.session.add(Question(question_type='fill_blank', content='光合作用的场所是__',
+                            correct_answer='叶绿体', score=5, bank_id=bank.id))
+    test = Test.query.first()
+    test.fill_blank_count, test.fill_blank_score = 1, 5
+    test.fill_blank_bank_id, test.fill_blank_grading_method = bank.id, 'ai'
+    test.total_score = 15
+    db.session.commit()
+
+    with test_app_with_ai_test.test_client() as client:
+        client.post('/student/start', data={'name': '测试学生', 'class_number': '001'})
+        assert client.get('/test').status_code == 200
+        answers = {f'answer_{q.id}': '叶绿体' if q.question_type == 'fill_blank' else '光合作用合成有机物'
+                   for q in Question.query.all()}
+        assert client.post('/submit_test', data=answers).status_code == 302
+        result_id = TestResult.query.first().id
+
+        with client.session_transaction() as sess:
+            sess['role'] = 'teacher'
+        client.post(f'/rescore_result/{result_id}')
+        db.session.expire_all()
+        assert TestResult.query.get(result_id).score == 0
+
+    grading_job_queue._run_jobs(grading_job_queue._claim_next())
+    db.session.expire_all()
+    assert TestResult.query.get(result_id).score == 13
+
+
+def test_ai_result_does_not_overwrite_teacher_grade(test_app_with_ai_test):
+    """
+    单元测试：读取提交记录后教师先完成评分，AI结果的条件更新不生效，不覆盖教师的分数
+    """
+    with test_app_with_ai_test.test_client() as client:
+        _submit_short_answer(client, '答案')
+
+    submission = ShortAnswerSubmission.query.first()
+    assert submission.graded_bool is False
+    # 模拟教师在另一个请求中评分
+    ShortAnswerSubmission.query.filter_by(id=submission.id).update(
+        {ShortAnswerSubmission.score: 9, ShortAnswerSubmission.graded_bool: True,
+         ShortAnswerSubmission.manual_reviewed: True}, synchronize_session=False)
+
+    assert apply_ai_grading_result(submission, {'score': 3, 'feedback': 'AI评语'}, 10) is None
+    db.session.expire_all()
+    submission = ShortAnswerSubmission.query.first()
+    assert (submission.score, submission.ai_feedback) == (9, None)
+
+
+def test_failed_feedback_is_retried_with_backoff_and_capped(test_app_with_ai_test, monkeypatch):
+    """
+    单元测试：评语生成失败的记录在重试间隔内不再请求，达到最大次数后不再重试
+    """
+    from datetime import timedelta
+    from config import AI_GRADING_CONFIG
+    from app import backfill_ai_feedback, pending_feedback_submissions, AI_FEEDBACK_FAILED_COMMENT
+    ai_service = get_ai_grading_service()
+    monkeypatch.setitem(AI_GRADING_CONFIG, 'two_phase_grading', True)
+    monkeypatch.setitem(AI_GRADING_CONFIG, 'feedback_max_attempts', 2)
+    monkeypatch.setattr(ai_service, 'grade_answer',
+                        lambda **kwargs: (True, {'score': 7, 'feedback': '', 'feedback_pending': True}))
+    feedback_calls = []
+
+    def failing_feedback(items):
+        feedback_calls.extend(items)
+        return [(False, {'error_message': '服务异常'}) for _ in items]
+
+    monkeypatch.setattr(ai_service, 'generate_feedback_many', failing_feedback)
+
+    with test_app_with_ai_test.test_client() as client:
+        _submit_short_answer(client, '光合作用合成有机物')
+    grading_job_queue._run_jobs(grading_job_queue._claim_next())
+
+    for expected_calls in (1, 1):
+        backfill_ai_feedback()
+        db.session.commit()
+        assert len(feedback_calls) == expected_calls
+    submission = ShortAnswerSubmission.query.first()
+    assert submission.ai_feedback_attempts == 1
+
+    # 重试间隔过后再次生成，达到最大次数后不再返回
+    ShortAnswerSubmission.query.update({ShortAnswerSubmission.ai_feedback_failed_at:
+                                        submission.ai_feedback_failed_at - timedelta(hours=1)})
+    backfill_ai_feedback()
+    db.session.commit()
+    assert len(feedback_calls) == 2
+    db.session.expire_all()
+    submission = ShortAnswerSubmission.query.first()
+    assert submission.ai_feedback_attempts == 2
+    assert submission.comment == AI_FEEDBACK_FAILED_COMMENT
+    assert submission.score == 7
+    ShortAnswerSubmission.query.update({ShortAnswerSubmission.ai_feedback_failed_at: None})
+    assert pending_feedback_submissions() == []
+
+
+def test_ai_grading_status_hides_internal_stats_from_non_teachers(test_app_with_ai_test):
+    """
+    单元测试：未登录时状态接口只返回是否可用，教师可以看到批改队列和评语统计
+    """
+    with test_app_with_ai_test.test_client() as client:
+        _submit_short_answer(client, '答案')
+        data = client.get('/api/ai_grading_status').get_json()
+        assert data['enabled'] is True
+        assert 'pending_jobs' not in data and 'rate_limit' not in data
+
+        with client.session_transaction() as sess:
+            sess['role'] = 'teacher'
+        data = client.get('/api/ai_grading_status').get_json()
+        assert data['pending_jobs'] == 1
+        assert data['pending_feedback'] == 0
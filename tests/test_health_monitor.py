@@ -0,0 +1,85 @@
+"""
+AI接口健康检查的单元测试
+"""
+
+import threading
+
+from health_monitor import DEGRADED, DOWN, HEALTHY, UNKNOWN, HealthMonitor
+from mock_ai_provider import MockAIServer
+
+
+def test_verdict_follows_probe_results():
+    """
+    单元测试：偶尔失败或变慢为 degraded，连续失败为 down，恢复后为 healthy，并记录失败率和响应时间趋势
+    """
+    monitor = HealthMonitor(lambda: (True, 'ok'), window=10, failure_threshold=2, slow_threshold=1.0)
+    assert monitor.verdict == UNKNOWN
+    for elapsed in (0.1, 0.1):
+        monitor.record(True, elapsed)
+    assert monitor.verdict == HEALTHY
+    monitor.record(False, 0.0, '无法连接到API服务器')
+    assert monitor.verdict == DEGRADED
+    monitor.record(False, 0.0, '无法连接到API服务器')
+    assert monitor.is_down()
+    for elapsed in (0.3, 0.4):
+        monitor.record(True, elapsed)
+    assert monitor.verdict == HEALTHY
+    monitor.record(True, 1.5)
+    assert monitor.verdict == DEGRADED
+
+    status = monitor.status()
+    assert status['checks'] == 7
+    assert status['error_rate'] == round(2 / 7, 3)
+    assert status['latency_ms'] == 1500.0
+    assert status['latency_trend'] == 'rising'
+
+
+def test_background_probe_does_not_block_start():
+    """
+    单元测试：start() 立即返回，探测在后台线程中进行；探测抛出异常记为失败
+    """
+    release = threading.Event()
+    probed = threading.Event()
+
+    def slow_probe():
+        release.wait(5)
+        probed.set()
+        raise RuntimeError('boom')
+
+    monitor = HealthMonitor(slow_probe, interval=0, failure_threshold=1)
+    monitor.start()
+    assert monitor.verdict == UNKNOWN
+    release.set()
+    probed.wait(5)
+    monitor.stop(5)
+    assert monitor.verdict == DOWN
+    assert 'boom' in monitor.status()['message']
+
+
+def test_service_health_check_against_mock_provider(monkeypatch):
+    """
+    单元测试：429 限流说明接口可用，500 连续出现后判定为 down；结论只在探测时更新
+    """
+    from ai_grading_service import AIGradingService
+    from config import AI_GRADING_CONFIG
+
+    server = MockAIServer({'latency_ms': 0}, seed=1).start()
+    try:
+        monkeypatch.setitem(AI_GRADING_CONFIG, 'provider', 'mock')
+        monkeypatch.setitem(AI_GRADING_CONFIG, 'base_url', server.base_url)
+        monkeypatch.setitem(AI_GRADING_CONFIG, 'enabled', True)
+        monkeypatch.setitem(AI_GRADING_CONFIG, 'result_cache', False)
+        service = AIGradingService()
+        monitor = service.health_monitor
+        assert service.get_health_status()['verdict'] == UNKNOWN
+
+        assert monitor.check_now() == HEALTHY
+        server.settings['throttle_rate'] = 1.0
+        assert monitor.check_now() == HEALTHY
+        server.settings.update({'throttle_rate': 0.0, 'error_rate': 1.0})
+        monitor.check_now()
+        assert monitor.check_now() == DOWN
+        assert service.get_health_status()['message'] == 'API服务异常 (状态码: 500)'
+        assert server.stats()['requests'] == 4
+    finally:
+        server.stop()
@@ -0,0 +1,81 @@
+"""
+学生历史记录增量统计的单元测试
+"""
+
+import pytest
+from app import (app, db, User, Test, TestResult, StudentTestHistory,
+                 record_history_score, refresh_student_history)
+
+
+@pytest.fixture
+def student_context(database):
+    """创建一名学生和一份测试配置（临时数据库见 conftest.py）"""
+    student = User(username='张三', role='student')
+    student.set_password('123456')
+    test = Test(title='历史统计测试', total_score=100, is_active=True)
+    db.session.add_all([student, test])
+    db.session.commit()
+    return student.id, test.id
+
+
+def _add_result(student_id, test_id, score):
+    result = TestResult(student_id=student_id, student_name='张三', class_number='001',
+                        test_id=test_id, score=score, answers='{}')
+    db.session.add(result)
+    record_history_score(student_id, score, student_name='张三', class_number='001')
+    db.session.commit()
+    return result
+
+
+def _snapshot(history):
+    return (history.test_count, history.total_score, history.average_score,
+            history.highest_score, history.lowest_score)
+
+
+def test_incremental_history_matches_rebuild(student_context):
+    """
+    单元测试：新增和改分后的增量统计与全量重建结果一致
+    """
+    student_id, test_id = student_context
+    results = [_add_result(student_id, test_id, score) for score in (60, 90, 75)]
+
+    history = StudentTestHistory.query.filter_by(student_id=student_id).first()
+    assert _snapshot(history) == (3, 225, 75, 90, 60)
+
+    # 替换当前最高分，需要重新查询最高分
+    old_score = results[1].score
+    results[1].score = 70
+    record_history_score(student_id, 70, old_score)
+    db.session.commit()
+    assert _snapshot(history) == (3, 205, 68, 75, 60)
+
+    # 替换当前最低分为新的最高分
+    old_score = results[0].score
+    results[0].score = 95
+    record_history_score(student_id, 95, old_score)
+    db.session.commit()
+    incremental = _snapshot(history)
+    assert incremental == (3, 240, 80, 95, 70)
+
+    refresh_student_history(student_id)
+    db.session.commit()
+    assert _snapshot(history) == incremental
+
+
+def test_concurrent_updates_are_not_lost(student_context):
+    """
+    单元测试：其他线程在读取历史记录后更新了统计，本次增量在SQL中累加，不会覆盖对方的更新
+    """
+    student_id, test_id = student_context
+    _add_result(student_id, test_id, 60)
+    history = StudentTestHistory.query.filter_by(student_id=student_id).first()
+
+    # 模拟另一线程（提交写入器或批改工作线程）同时记录了一次 90 分的测试
+    StudentTestHistory.query.filter_by(id=history.id).update({
+        StudentTestHistory.test_count: StudentTestHistory.test_count + 1,
+        StudentTestHistory.total_score: StudentTestHistory.total_score + 90,
+        StudentTestHistory.highest_score: 90,
+    }, synchronize_session=False)
+
+    _add_result(student_id, test_id, 75)
+    assert _snapshot(history) == (3, 225, 75, 90, 60)
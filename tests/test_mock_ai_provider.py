@@ -0,0 +1,80 @@
+"""
+模拟AI接口的单元测试
+"""
+
+import json
+
+import requests
+
+from mock_ai_provider import MockAIServer, grade_prompt, merge_settings
+
+
+def test_grade_prompt_formats():
+    """
+    单元测试：同一提示词得到同一分数，批量提示词返回数组，只评分的提示词不含评语
+    """
+    settings = merge_settings({'feedback_chars': 20})
+    single = json.loads(grade_prompt('题目分值：5分\n学生答案：光合作用', settings))
+    assert 0 <= single['score'] <= 5
+    assert len(single['feedback']) == 20
+    assert grade_prompt('题目分值：5分\n学生答案：光合作用', settings) == json.dumps(single, ensure_ascii=False)
+
+    batch = json.loads(grade_prompt('题目分值：10分\n【学生1】甲\n【学生2】乙\n只需评分', settings))
+    assert [item['id'] for item in batch] == [1, 2]
+    assert all('feedback' not in item for item in batch)
+
+    awarded = json.loads(grade_prompt('题目分值：10分\n该答案已评定为7分，请给出评语', settings))
+    assert awarded['score'] == 7
+
+
+def test_server_protocols_and_errors():
+    """
+    单元测试：模拟服务器按路径返回 OpenAI / Anthropic 格式，按错误率和限流率返回 500 / 429
+    """
+    server = MockAIServer({'latency_ms': 0}, seed=1).start()
+    try:
+        body = {'messages': [{'role': 'user', 'content': '题目分值：10分'}]}
+        response = requests.post(server.base_url + '/chat/completions', json=body, timeout=5)
+        assert 'score' in json.loads(response.json()['choices'][0]['message']['content'])
+        response = requests.post(server.base_url + '/messages', json=body, timeout=5)
+        assert 'score' in json.loads(response.json()['content'][0]['text'])
+
+        server.settings['throttle_rate'] = 1.0
+        response = requests.post(server.base_url + '/chat/completions', json=body, timeout=5)
+        assert response.status_code == 429
+        assert response.headers['Retry-After'] == '1'
+        server.settings.update({'throttle_rate': 0.0, 'error_rate': 1.0})
+        response = requests.post(server.base_url + '/chat/completions', json=body, timeout=5)
+        assert response.status_code == 500
+        assert server.stats()['requests'] == 4
+        assert server.stats()['throttled'] == 1 and server.stats()['errors'] == 1
+    finally:
+        server.stop()
+
+
+def test_service_grades_with_mock_provider(monkeypatch):
+    """
+    单元测试：provider 为 mock 时无需密钥，批改请求（含流式响应）发送到模拟服务器
+    """
+    from ai_grading_service import AIGradingService
+
+    server = MockAIServer({'latency_ms': 0, 'format': 'anthropic'}, seed=1).start()
+    try:
+        service = AIGradingService()
+        monkeypatch.setattr(service, 'result_cache', None)
+        monkeypatch.setitem(service.config, 'provider', 'mock')
+        monkeypatch.setitem(service.config, 'base_url', server.base_url)
+        monkeypatch.setitem(service.config, 'mock', {'format': 'anthropic'})
+        monkeypatch.setitem(service.config, 'stream_responses', True)
+        monkeypatch.setitem(service.config, 'enabled', True)
+        assert service._check_config()[0]
+        monkeypatch.setattr(service, 'enabled', True)
+
+        assert service.test_connection()[0]
+        success, result = service.grade_answer('简述光合作用', '合成有机物', '利用光能合成有机物', 10)
+        assert success
+        assert 0 <= result['score'] <= 10
+        assert result['feedback']
+        assert server.stats()['streamed'] == 1
+    finally:
+        server.stop()
@@ -0,0 +1,74 @@
+"""
+试卷池的单元测试
+"""
+
+from paper_pool import PaperPool, DrawnPaper
+
+
+def _make_pool(depth=3, valid_sources=('a', 'b')):
+    built = []
+
+    def builder(source):
+        if source not in valid_sources:
+            return None
+        built.append(source)
+        return DrawnPaper({'single_choice': []}, f'[{len(built)}]')
+
+    pool = PaperPool(None, None, builder, sources=lambda: ['a'], depth=depth)
+    # 测试中不启动补充线程，由测试手动补充
+    pool.start = lambda: None
+    return pool, built
+
+
+def test_take_misses_then_hits_after_refill():
+    """池为空时返回 None，补充后按顺序取出"""
+    pool, built = _make_pool()
+
+    assert pool.take('a') is None
+    pool.refill()
+    assert len(built) == 3
+
+    assert pool.take('a').snapshot == '[1]'
+    assert pool.take('a').snapshot == '[2]'
+    stats = pool.stats()
+    assert stats['hits'] == 2
+    assert stats['misses'] == 1
+    assert stats['papers'] == {repr('a'): 1}
+
+
+def test_sources_are_preloaded():
+    """预热来源在首次补充时登记"""
+    pool, built = _make_pool(depth=2)
+
+    pool._load_sources()
+    pool.refill()
+    assert built == ['a', 'a']
+    assert pool.take('a') is not None
+
+
+def test_invalidate_drops_papers():
+    """失效后清空已抽好的试卷"""
+    pool, _ = _make_pool()
+    pool.take('a')
+    pool.refill()
+
+    pool.invalidate()
+    assert pool.take('a') is None
+    assert pool.stats()['generation'] == 1
+
+
+def test_removed_source_is_forgotten():
+    """来源已不存在时不再为其补充"""
+    pool, built = _make_pool()
+
+    assert pool.take('gone') is None
+    pool.refill()
+    assert built == []
+    assert 'gone' not in str(pool.stats()['papers'])
+
+
+def test_disabled_pool_never_serves():
+    pool, _ = _make_pool()
+    pool.enabled = False
+    pool.refill()
+    assert pool.take('a') is None
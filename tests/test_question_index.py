@@ -0,0 +1,74 @@
+"""
+题目ID索引的单元测试
+"""
+
+import random
+from question_index import QuestionIdIndex
+
+
+def _make_index(data):
+    calls = []
+
+    def loader(bank_id, question_type):
+        calls.append((bank_id, question_type))
+        return data.get((bank_id, question_type), [])
+
+    return QuestionIdIndex(loader), calls
+
+
+def test_index_loads_lazily_and_caches():
+    """首次抽题时加载，之后命中缓存"""
+    index, calls = _make_index({(1, 'single_choice'): [1, 2, 3]})
+
+    assert list(index.get(1, 'single_choice')) == [1, 2, 3]
+    assert list(index.get(1, 'single_choice')) == [1, 2, 3]
+    assert calls == [(1, 'single_choice')]
+    assert index.stats()['hits'] == 1
+    assert index.stats()['misses'] == 1
+
+
+def test_sample_returns_distinct_ids_within_bank():
+    """抽样结果不重复，且不超过题库题量"""
+    index, _ = _make_index({(1, 'true_false'): list(range(100))})
+
+    sampled = index.sample(1, 'true_false', 10, rng=random.Random(0))
+    assert len(sampled) == len(set(sampled)) == 10
+    assert all(0 <= qid < 100 for qid in sampled)
+
+    assert sorted(index.sample(1, 'true_false', 500)) == list(range(100))
+    assert index.sample(1, 'true_false', 0) == []
+    assert index.sample(2, 'true_false', 5) == []
+
+
+def test_invalidate_bank_reloads_bank_and_unscoped_index():
+    """题库失效时同时清除不限题库的索引，其他题库保持缓存"""
+    data = {
+        (1, 'single_choice'): [1, 2],
+        (2, 'single_choice'): [3],
+        (None, 'single_choice'): [1, 2, 3],
+    }
+    index, calls = _make_index(data)
+    for bank_id in (1, 2, None):
+        index.get(bank_id, 'single_choice')
+    calls.clear()
+
+    data[(1, 'single_choice')] = [1, 2, 4]
+    index.invalidate(1)
+    assert list(index.get(1, 'single_choice')) == [1, 2, 4]
+    index.get(2, 'single_choice')
+    index.get(None, 'single_choice')
+    assert calls == [(1, 'single_choice'), (None, 'single_choice')]
+    assert index.generation == 1
+
+
+def test_load_during_invalidation_is_not_cached():
+    """加载期间发生失效时，不保存可能过期的结果"""
+    index = None
+
+    def loader(bank_id, question_type):
+        index.invalidate(bank_id)
+        return [1]
+
+    index = QuestionIdIndex(loader)
+    assert list(index.get(1, 'fill_blank')) == [1]
+    assert index.stats()['entries'] == 0
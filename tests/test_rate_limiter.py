@@ -0,0 +1,150 @@
+"""
+AI接口限流器的单元测试
+"""
+
+import threading
+import time
+from email.utils import formatdate
+
+import pytest
+
+import rate_limiter
+from rate_limiter import (ProviderRateLimiter, TokenBucket, estimate_tokens, parse_retry_after, retry_delay,
+                          used_tokens)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_parse_retry_after():
+    """
+    单元测试：支持秒数和HTTP日期两种格式，无法解析时返回 None
+    """
+    assert parse_retry_after('3') == 3.0
+    assert parse_retry_after('0.5') == 0.5
+    assert 8 <= parse_retry_after(formatdate(time.time() + 10, usegmt=True)) <= 10
+    assert parse_retry_after('soon') is None
+    assert parse_retry_after(None) is None
+
+
+def test_retry_delay_is_jittered():
+    """
+    单元测试：退避时间带随机抖动；有 Retry-After 时不早于服务器要求的时间
+    """
+    delays = {round(retry_delay(3), 3) for _ in range(20)}
+    assert len(delays) > 1
+    assert all(4 <= delay <= 8 for delay in delays)
+    assert all(5 <= retry_delay(0, retry_after=5) <= 6 for _ in range(20))
+
+
+def test_used_tokens_reads_provider_usage():
+    assert used_tokens({'usage': {'total_tokens': 120}}) == 120
+    assert used_tokens({'usage': {'input_tokens': 100, 'output_tokens': 30}}) == 130
+    assert used_tokens({'choices': []}) is None
+
+
+def test_estimate_tokens_uses_request_max_tokens():
+    """批量批改和评语请求设置了更大的 max_tokens，预留token时以请求为准，没有设置时使用默认值"""
+    batch = {'messages': [], 'max_tokens': 3000}
+    assert estimate_tokens(batch, 1000) == len('{"messages": [], "max_tokens": 3000}') // 2 + 3000
+    assert estimate_tokens({'parameters': {'max_tokens': 500}}, 1000) == len('{"parameters": {"max_tokens": 500}}') // 2 + 500
+    assert estimate_tokens({}, 1000) == 1 + 1000
+
+
+def test_token_bucket_waits_for_refill():
+    """
+    单元测试：令牌用完后按补充速度计算等待时间
+    """
+    clock = FakeClock()
+    bucket = TokenBucket(60, clock)  # 每秒1个，最多积累10个
+    assert [bucket.reserve(1) for _ in range(10)] == [0.0] * 10
+    assert bucket.reserve(1) == pytest.approx(1.0)
+    assert bucket.reserve(1) == pytest.approx(2.0)
+    clock.now += 5
+    assert bucket.reserve(1) == 0.0
+
+
+def test_aimd_adjusts_concurrency_limit():
+    """
+    单元测试：限流时并发上限减半（同一窗口内只减一次）并按 Retry-After 暂停，成功时逐步恢复
+    """
+    clock = FakeClock()
+    limiter = ProviderRateLimiter('test', max_concurrency=8, min_concurrency=2, clock=clock)
+    permits = [limiter.acquire() for _ in range(3)]
+    limiter.release(permits[0], rate_limiter.THROTTLED, retry_after=2)
+    limiter.release(permits[1], rate_limiter.THROTTLED)
+    stats = limiter.stats()
+    assert stats['concurrency_limit'] == 4
+    assert stats['throttled'] == 2
+    assert stats['paused_for'] == 2
+
+    clock.now += 1
+    limiter.release(permits[2], rate_limiter.THROTTLED)
+    assert limiter.stats()['concurrency_limit'] == 2
+    clock.now += 1
+    for _ in range(20):
+        limiter.release(limiter.acquire(), rate_limiter.OK)
+    assert 4 <= limiter.stats()['concurrency_limit'] < 8
+
+
+def test_acquire_blocks_when_concurrency_is_full():
+    """
+    单元测试：并发名额用完时新请求排队等待，释放名额后继续
+    """
+    limiter = ProviderRateLimiter('test', max_concurrency=1, adaptive=False)
+    first = limiter.acquire()
+    acquired = threading.Event()
+
+    def worker():
+        limiter.release(limiter.acquire())
+        acquired.set()
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    time.sleep(0.1)
+    assert not acquired.is_set()
+    assert limiter.stats()['waiting'] == 1
+    limiter.release(first)
+    thread.join(2)
+    assert acquired.is_set()
+    assert limiter.stats()['in_flight'] == 0
+
+
+def test_send_request_honours_retry_after(monkeypatch):
+    """
+    单元测试：429 响应后按 Retry-After 等待重试，并计入限流器
+    """
+    from ai_grading_service import AIGradingService
+
+    service = AIGradingService()
+    service.rate_limiter = ProviderRateLimiter('test', max_concurrency=4)
+    responses = [(429, {'Retry-After': '7'}), (200, {})]
+    sleeps = []
+
+    class FakeResponse:
+        text = ''
+
+        def __init__(self, status_code, headers):
+            self.status_code = status_code
+            self.headers = headers
+
+        def json(self):
+            return {'ok': True, 'usage': {'total_tokens': 10}}
+
+    monkeypatch.setattr(service._get_http_session(), 'post',
+                        lambda url, **kwargs: FakeResponse(*responses.pop(0)))
+    monkeypatch.setattr('ai_grading_service.time.sleep', sleeps.append)
+    monkeypatch.setitem(service.config, 'max_retries', 3)
+
+    success, result = service._send_request('https://example.com/v1/chat', {}, {})
+    assert success and result['ok']
+    assert len(sleeps) == 1 and 7 <= sleeps[0] <= 8
+    stats = service.get_rate_limit_stats()
+    assert stats['throttled'] == 1
+    assert stats['concurrency_limit'] == 2
+    assert stats['in_flight'] == 0
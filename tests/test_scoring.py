@@ -0,0 +1,68 @@
+"""
+评分引擎的单元测试
+"""
+
+from datetime import datetime
+from types import SimpleNamespace
+from scoring import score_answers, get_answer_key, clear_answer_key_cache, split_fill_answers
+
+
+def _question(qid, question_type, correct_answer, updated_at=None):
+    return SimpleNamespace(id=qid, question_type=question_type, correct_answer=correct_answer,
+                           updated_at=updated_at or datetime(2024, 1, 1))
+
+
+TEST_CONFIG = {
+    'single_choice_score': 2,
+    'multiple_choice_score': 4,
+    'true_false_score': 1,
+    'fill_blank_score': 6,
+    'short_answer_score': 10,
+}
+
+
+def test_score_answers_all_types():
+    """
+    单元测试：各题型评分规则，多选不计顺序，填空按空给部分分，简答题使用已评分数
+    """
+    question_map = {
+        1: _question(1, 'single_choice', 'B'),
+        2: _question(2, 'multiple_choice', 'A,C'),
+        3: _question(3, 'true_false', 'A'),
+        4: _question(4, 'fill_blank', '北京、上海、广州'),
+        5: _question(5, 'short_answer', '参考答案'),
+    }
+    answers = {'1': 'b', '2': 'CA', '3': 'B', '4': '北京,上海、深圳', '5': '学生答案'}
+
+    total, details = score_answers(answers, question_map, TEST_CONFIG, graded_scores={5: 7})
+
+    assert details[1] == (2, True)
+    assert details[2] == (4, True)
+    assert details[3] == (0, False)
+    assert details[4] == (4, False)
+    assert details[5] == (7, None)
+    assert total == 17
+
+
+def test_answer_key_cache_follows_question_version():
+    """
+    单元测试：题目更新时间变化后重新编译答案键
+    """
+    clear_answer_key_cache()
+    question = _question(1, 'single_choice', 'A')
+    first = get_answer_key(question)
+    assert get_answer_key(question) is first
+
+    question.correct_answer = 'C'
+    question.updated_at = datetime(2024, 1, 2)
+    second = get_answer_key(question)
+    assert second is not first
+    assert second.score('C', 2) == (2, True)
+
+
+def test_full_width_comma_stays_inside_blank():
+    """
+    单元测试：与原评分规则一致，只按顿号和英文逗号分空，全角逗号是空内的内容
+    """
+    assert split_fill_answers('温度，压强、浓度') == ['温度，压强', '浓度']
+    assert split_fill_answers(' A,b 、') == ['a', 'b']
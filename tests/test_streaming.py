@@ -0,0 +1,112 @@
+"""
+AI接口流式响应的单元测试
+"""
+
+import json
+
+from streaming import IncrementalJSONFields, StreamReader
+
+
+def _openai_lines(text, size=3):
+    """把文本切成小段，生成 OpenAI 格式的SSE数据行"""
+    for i in range(0, len(text), size):
+        chunk = {'choices': [{'delta': {'content': text[i:i + size]}}]}
+        yield 'data: ' + json.dumps(chunk, ensure_ascii=False)
+    yield 'data: [DONE]'
+
+
+def test_incremental_parser_waits_for_complete_values():
+    """
+    单元测试：字段值完整后才出现在 fields 中，数字要等到后面的分隔符
+    """
+    parser = IncrementalJSONFields()
+    parser.feed('```json\n{"score": 8')
+    assert parser.fields == {}
+    parser.feed('5, "feedback": "回答')
+    assert parser.fields == {'score': 85}
+    parser.feed('完整", "analysis": {"a": [1, 2]}}')
+    assert parser.fields == {'score': 85, 'feedback': '回答完整', 'analysis': {'a': [1, 2]}}
+    assert parser.closed
+
+
+def test_stream_reader_stops_after_required_fields():
+    """
+    单元测试：所需字段完整后结束读取，返回的响应与非流式响应格式相同
+    """
+    text = '{"score": 6, "feedback": "要点基本正确", "analysis": "' + '很长的分析' * 200 + '"}'
+    lines = list(_openai_lines(text))
+    consumed = []
+
+    def tracked():
+        for line in lines:
+            consumed.append(line)
+            yield line
+
+    reader = StreamReader('openai', ('score', 'feedback'))
+    response = reader.read(tracked())
+    assert reader.stopped_early
+    assert len(consumed) < len(lines) // 10
+    content = json.loads(response['choices'][0]['message']['content'])
+    assert content == {'score': 6, 'feedback': '要点基本正确'}
+
+
+def test_stream_reader_anthropic_reads_until_end_without_stop_fields():
+    """
+    单元测试：没有指定字段时读取到流结束，返回模型输出的全部文本
+    """
+    events = [
+        {'type': 'message_start'},
+        {'type': 'content_block_delta', 'delta': {'type': 'text_delta', 'text': '{"score": 3,'}},
+        {'type': 'content_block_delta', 'delta': {'type': 'text_delta', 'text': ' "feedback": "ok"}'}},
+        {'type': 'message_stop'},
+    ]
+    lines = ['event: message', *('data: ' + json.dumps(event) for event in events)]
+    reader = StreamReader('anthropic')
+    response = reader.read(lines)
+    assert not reader.stopped_early
+    assert response == {'content': [{'type': 'text', 'text': '{"score": 3, "feedback": "ok"}'}]}
+
+
+def test_send_request_closes_stream_early(monkeypatch):
+    """
+    单元测试：简答题批改使用流式请求，评分字段完整后关闭连接，不再读取 analysis
+    """
+    from ai_grading_service import AIGradingService
+
+    service = AIGradingService()
+    monkeypatch.setattr(service, 'enabled', True)
+    monkeypatch.setattr(service, 'result_cache', None)
+    monkeypatch.setitem(service.config, 'provider', 'openai')
+    monkeypatch.setitem(service.config, 'stream_responses', True)
+    text = '{"score": 7, "feedback": "较好", "analysis": "' + '详细分析' * 100 + '"}'
+    sent = []
+
+    class FakeStreamResponse:
+        status_code = 200
+        headers = {'Content-Type': 'text/event-stream; charset=utf-8'}
+        closed = False
+        lines_read = 0
+
+        def iter_lines(self):
+            for line in _openai_lines(text):
+                self.lines_read += 1
+                yield line.encode('utf-8')
+
+        def close(self):
+            self.closed = True
+
+    response = FakeStreamResponse()
+
+    def fake_post(url, json=None, stream=False, **kwargs):
+        sent.append((json, stream))
+        return response
+
+    monkeypatch.setattr(service._get_http_session(), 'post', fake_post)
+
+    success, result = service.grade_answer('题目', '参考答案', '学生答案', 10)
+    assert success
+    assert result['score'] == 7
+    assert result['feedback'] == '较好'
+    assert sent[0][0]['stream'] is True and sent[0][1] is True
+    assert response.closed
+    assert response.lines_read < 20
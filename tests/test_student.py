@@ -9,7 +9,12 @@ from hypothesis import given, strategies as st, settings, assume
 import tempfile
 import os
 import json
-from app import app, db, User, Test, TestResult, Question, QuestionBank, TestPreset
+import random
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from app import (app, db, User, Test, TestResult, Question, QuestionBank, TestPreset, TestPaper,
+                 load_questions_by_ids, seeded_paper_cache, shuffle_options, restore_option,
+                 submission_writer)
+from paper_pool import PaperQuestion
 
 
 @pytest.fixture
@@ -70,6 +75,16 @@ def test_app_with_test():
     os.unlink(db_path)
 
 
+def _draw_paper(client):
+    """打开测试页面抽题，返回本次试卷中的题目ID列表"""
+    response = client.get('/test')
+    assert response.status_code == 200
+    with client.session_transaction() as sess:
+        paper_id = sess['paper_id']
+    with app.app_context():
+        return list(TestPaper.query.get(paper_id).question_map())
+
+
 # Feature: debug-test-system, Property 10: 学生账户自动创建或登录
 @settings(max_examples=100)
 @given(
@@ -320,10 +335,8 @@ def test_image_upload_association(test_app_with_test):
             'class_number': '001'
         })
         
-        # 获取简答题ID
-        with test_app_with_test.app_context():
-            question = Question.query.filter_by(question_type='short_answer').first()
-            question_id = question.id
+        # 抽题并获取简答题ID
+        question_id = _draw_paper(client)[0]
         
         # 提交答案（包含图片标签）
         answer_with_image = '这是我的答案 <img src="/static/uploads/test.jpg">'
@@ -373,17 +386,14 @@ def test_multiple_test_submissions(test_app_with_test):
             'class_number': '001'
         })
         
-        # 获取题目ID
-        with test_app_with_test.app_context():
-            question = Question.query.filter_by(question_type='single_choice').first()
-            question_id = question.id
-        
         # 第一次提交
+        question_id = _draw_paper(client)[0]
         client.post('/submit_test', data={
             f'answer_{question_id}': 'A'
         })
         
         # 第二次提交
+        question_id = _draw_paper(client)[0]
         client.post('/submit_test', data={
             f'answer_{question_id}': 'B'
         })
@@ -409,17 +419,17 @@ def test_fill_blank_scoring(test_app_with_test):
             test.fill_blank_bank_id = fill_blank_bank.id
             test.total_score = 10
             
-            # 创建一个有多个填空的题目
-            question = Question.query.filter_by(question_type='fill_blank').first()
-            question.correct_answer = '答案1、答案2'  # 两个填空
+            # 所有填空题都设为两个填空，保证抽到的题目有多个填空
+            for question in Question.query.filter_by(question_type='fill_blank').all():
+                question.correct_answer = '答案1、答案2'  # 两个填空
             db.session.commit()
-            question_id = question.id
         
         # 学生登录
         client.post('/student/start', data={
             'name': '测试学生',
             'class_number': '001'
         })
+        question_id = _draw_paper(client)[0]
         
         # 提交答案（只答对一个）
         response = client.post('/submit_test', data={
@@ -434,3 +444,168 @@ def test_fill_blank_scoring(test_app_with_test):
             result = TestResult.query.order_by(TestResult.created_at.desc()).first()
             # 两个填空，答对一个，应该得5分
             assert result.score == 5, f"填空题部分分计算错误: {result.score}"
+
+
+def test_submission_limited_to_drawn_paper(test_app_with_test):
+    """
+    单元测试：只按抽到的试卷评分，试卷以外的题目被忽略，同一份试卷不能重复提交
+    """
+    with test_app_with_test.test_client() as client:
+        client.post('/student/start', data={
+            'name': '测试学生',
+            'class_number': '001'
+        })
+        paper_question_ids = _draw_paper(client)
+        with test_app_with_test.app_context():
+            paper_questions = load_questions_by_ids(paper_question_ids)
+            outside = Question.query.filter(
+                Question.question_type == 'single_choice',
+                ~Question.id.in_(paper_question_ids)
+            ).first()
+        
+        answer_data = {f'answer_{q.id}': q.correct_answer for q in paper_questions.values()}
+        answer_data[f'answer_{outside.id}'] = 'A'
+        client.post('/submit_test', data=answer_data)
+        client.post('/submit_test', data=answer_data)
+        
+        with test_app_with_test.app_context():
+            results = TestResult.query.filter_by(student_name='测试学生').all()
+            assert len(results) == 1, "同一份试卷只能提交一次"
+            answers = json.loads(results[0].answers)
+            assert str(outside.id) not in answers
+            assert set(answers) == {str(qid) for qid in paper_question_ids}
+
+
+def test_reload_keeps_same_paper(test_app_with_test):
+    """
+    单元测试：刷新测试页面时按种子重建同一份试卷，不新建试卷；提交后再打开则抽取新试卷
+    """
+    with test_app_with_test.test_client() as client:
+        client.post('/student/start', data={
+            'name': '测试学生',
+            'class_number': '001'
+        })
+        first = _draw_paper(client)
+        with client.session_transaction() as sess:
+            paper_id = sess['paper_id']
+        
+        # 清空按种子缓存的试卷，验证重建结果一致
+        seeded_paper_cache.clear()
+        assert _draw_paper(client) == first
+        with client.session_transaction() as sess:
+            assert sess['paper_id'] == paper_id
+        with test_app_with_test.app_context():
+            assert TestPaper.query.count() == 1
+        
+        client.post('/submit_test', data={})
+        _draw_paper(client)
+        with client.session_transaction() as sess:
+            assert sess['paper_id'] != paper_id
+
+
+def test_submit_clears_seed_for_next_attempt(test_app_with_test):
+    """
+    单元测试：提交保存成功后清除试卷种子，再次打开测试页面抽取新试卷
+    """
+    with test_app_with_test.test_client() as client:
+        client.post('/student/start', data={'name': '测试学生', 'class_number': '001'})
+        _draw_paper(client)
+        with client.session_transaction() as sess:
+            paper_id = sess['paper_id']
+        
+        response = client.post('/submit_test', data={})
+        assert response.status_code == 302
+        assert '/student_dashboard' in response.location
+        with client.session_transaction() as sess:
+            assert 'paper_attempt' not in sess
+        
+        _draw_paper(client)
+        with client.session_transaction() as sess:
+            assert sess['paper_id'] != paper_id
+            assert sess['paper_attempt']['paper_id'] == sess['paper_id']
+        with test_app_with_test.app_context():
+            assert TestPaper.query.count() == 2
+            assert TestPaper.query.get(paper_id).submitted_at is not None
+
+
+def test_failed_submit_keeps_seed(test_app_with_test, monkeypatch):
+    """
+    单元测试：提交保存失败时保留试卷种子，返回测试页面仍是同一份试卷，重新提交成功后才清除
+    """
+    def fail_write(func, data):
+        raise RuntimeError('数据库不可用')
+
+    with test_app_with_test.test_client() as client:
+        client.post('/student/start', data={'name': '测试学生', 'class_number': '001'})
+        first = _draw_paper(client)
+        with client.session_transaction() as sess:
+            paper_id = sess['paper_id']
+            attempt = dict(sess['paper_attempt'])
+        
+        with monkeypatch.context() as patch:
+            patch.setattr(submission_writer, 'write', fail_write)
+            response = client.post('/submit_test', data={})
+        assert response.status_code == 302
+        assert '/test' in response.location
+        with client.session_transaction() as sess:
+            assert sess['paper_attempt'] == attempt
+        
+        assert _draw_paper(client) == first
+        with client.session_transaction() as sess:
+            assert sess['paper_id'] == paper_id
+        with test_app_with_test.app_context():
+            assert TestPaper.query.count() == 1
+            assert TestResult.query.count() == 0
+        
+        client.post('/submit_test', data={})
+        with client.session_transaction() as sess:
+            assert 'paper_attempt' not in sess
+        with test_app_with_test.app_context():
+            assert TestResult.query.count() == 1
+
+
+def test_timed_out_submit_draws_new_paper_once_saved(test_app_with_test, monkeypatch):
+    """
+    单元测试：提交写入超时时保留种子；保存随后完成，再次打开测试页面不会重复抽到已提交的试卷
+    """
+    write = submission_writer.write
+
+    def slow_write(func, data):
+        write(func, data)
+        raise FutureTimeoutError()
+
+    with test_app_with_test.test_client() as client:
+        client.post('/student/start', data={'name': '测试学生', 'class_number': '001'})
+        _draw_paper(client)
+        with client.session_transaction() as sess:
+            paper_id = sess['paper_id']
+        
+        with monkeypatch.context() as patch:
+            patch.setattr(submission_writer, 'write', slow_write)
+            client.post('/submit_test', data={})
+        with client.session_transaction() as sess:
+            assert sess['paper_attempt']['paper_id'] == paper_id
+        
+        _draw_paper(client)
+        with client.session_transaction() as sess:
+            assert sess['paper_id'] != paper_id
+        with test_app_with_test.app_context():
+            assert TestPaper.query.get(paper_id).submitted_at is not None
+
+
+def test_shuffled_options_restore_original_answer():
+    """
+    单元测试：打乱选项后，学生选择的位置可以还原为原选项
+    """
+    question = PaperQuestion(id=1, question_type='multiple_choice', content='题目', image_path=None,
+                             option_a='甲', option_b='乙', option_c='丙', option_d='丁', option_e=None,
+                             correct_answer='A,C', score=5)
+    shuffled = shuffle_options(question, random.Random(7))
+    assert shuffled == shuffle_options(question, random.Random(7))
+    
+    order = shuffled['option_order']
+    assert sorted(order) == list('ABCD')
+    displayed = {letter: shuffled[f'option_{letter.lower()}'] for letter in 'ABCD'}
+    for letter, text in displayed.items():
+        assert getattr(question, f'option_{restore_option(letter, order).lower()}') == text
+    assert sorted(restore_option(shuffled['correct_answer'], order).replace(',', '')) == ['A', 'C']
@@ -0,0 +1,63 @@
+"""
+提交写入器的单元测试
+"""
+
+import threading
+import time
+import pytest
+from app import app, db, QuestionBank
+from submission_writer import GroupCommitWriter
+
+
+@pytest.fixture
+def writer(database):
+    """创建使用临时数据库的写入器（临时数据库见 conftest.py）"""
+    writer = GroupCommitWriter(app, db, max_batch=20, max_wait=0.05)
+    yield writer
+    writer.stop(timeout=5)
+
+
+def _add_bank(name):
+    if name == 'bad':
+        raise ValueError('无效的题库')
+    bank = QuestionBank(name=name, question_type='single_choice')
+    db.session.add(bank)
+    db.session.flush()
+    return bank.id
+
+
+def test_concurrent_writes_are_group_committed(writer):
+    """
+    单元测试：并发写操作合并提交，出错的写操作单独报错，不影响同批其他写操作
+    """
+    names = [f'bank_{i}' for i in range(10)] + ['bad']
+    outcomes = {}
+
+    def submit(name):
+        try:
+            outcomes[name] = writer.write(_add_bank, name)
+        except ValueError as e:
+            outcomes[name] = e
+
+    # 先占住写线程，使后续写操作在队列中积累成一批
+    gate = threading.Event()
+    blocker = writer.submit(lambda: gate.wait(5))
+    deadline = time.monotonic() + 5
+    while not blocker.running() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    threads = [threading.Thread(target=submit, args=(name,)) for name in names]
+    for thread in threads:
+        thread.start()
+    while writer._queue.qsize() < len(names) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    gate.set()
+    for thread in threads:
+        thread.join(5)
+    blocker.result(5)
+
+    assert isinstance(outcomes['bad'], ValueError)
+    with app.app_context():
+        saved = {bank.name: bank.id for bank in QuestionBank.query.all()}
+    assert saved == {name: outcomes[name] for name in names if name != 'bad'}
+    assert writer.writes == 11
+    assert writer.batches <= 3
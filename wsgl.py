@@ -1,4 +1,4 @@
-from app import app
+from app import app, start_grading_workers, upgrade_schema
 import os
 
 # 从环境变量或配置文件读取端口
@@ -10,5 +10,9 @@ except ImportError:
 
 if __name__ == '__main__':
     from waitress import serve
+    # 为旧数据库补充新增的列和索引（run.py 由 init_db 完成）
+    with app.app_context():
+        upgrade_schema()
+    start_grading_workers()
     print(f"Starting server on http://{HOST}:{PORT}")
     serve(app, host=HOST, port=PORT)
\ No newline at end of file